@@ -0,0 +1,188 @@
+"""
+Checks that the peak memory used by exports does not grow with the world.
+
+Synthetic worlds of increasing sizes are generated, then exported to HTML, both
+as a directory and as a streamed zip archive, and walked through as the Google
+Docs export does, while tracemalloc records the
+peak memory allocated. Walking through a world loaded all at once is measured
+too, for comparison.
+
+Run with `python -m benchmarks.export_memory` from the repository root. It
+exits with an error if the peak memory of an export grows by more than the
+allowed factor between the smallest and the largest world. Some growth is
+expected, as an area's storylets are loaded together and larger worlds tend
+to have a larger largest area.
+"""
+import argparse
+import gc
+import os
+import shutil
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterable, List, Tuple, TYPE_CHECKING
+
+from benchmarks.submissions import reset_db, use_temporary_db
+from benchmarks.world import WorldSize, generate_world
+
+if TYPE_CHECKING:
+    from fallen_london_chronicler.model import Storylet
+
+
+def export_html(export_dir: str) -> None:
+    from fallen_london_chronicler.db import get_session
+    from fallen_london_chronicler.export.html import HTMLExporter
+
+    with get_session() as session:
+        HTMLExporter(export_dir, "", incremental=False, workers=1) \
+            .export_all(session)
+
+
+def export_html_archive() -> None:
+    from fallen_london_chronicler.db import get_session
+    from fallen_london_chronicler.export.html import HTMLExporter
+
+    with get_session() as session, open(os.devnull, "wb") as stream:
+        HTMLExporter("", "", workers=1).export_archive(session, stream, "zip")
+
+
+def walk_streamed() -> None:
+    """
+    Reads everything the Google Docs export shows, like it does.
+    """
+    from fallen_london_chronicler.db import get_session
+    from fallen_london_chronicler.export.traversal import \
+        get_area_storylet_ids, iter_areas, iter_storylets
+    from fallen_london_chronicler.loaders import AREAS_PAGE, FULL_EXPORT
+
+    with get_session() as session:
+        storylet_ids = get_area_storylet_ids(session)
+        for area in iter_areas(session, AREAS_PAGE):
+            for storylet in iter_storylets(
+                    session, storylet_ids[area.id], FULL_EXPORT
+            ):
+                read_storylet(storylet)
+
+
+def walk_eager() -> None:
+    """
+    Reads everything the Google Docs export shows, with every area loaded at
+    once.
+    """
+    from sqlalchemy.orm import selectinload
+
+    from fallen_london_chronicler.db import get_session
+    from fallen_london_chronicler.model import Area, Storylet
+
+    with get_session() as session:
+        for area in session.query(Area).options(
+                selectinload(Area.storylets).selectinload(Storylet.branches)
+        ):
+            for storylet in area.storylets:
+                read_storylet(storylet)
+
+
+def read_storylet(storylet: "Storylet") -> int:
+    """
+    Loads everything shown about a storylet, and returns how many entities
+    that was.
+    """
+    count = len(storylet.observations) + len(storylet.quality_requirements)
+    for branch in storylet.branches:
+        count += len(branch.observations) + len(branch.quality_requirements)
+        for outcome in branch.outcome_observations:
+            count += len(outcome.messages) + (outcome.redirect is not None)
+    return count
+
+
+def measure(run: Callable[[], None]) -> Tuple[float, float]:
+    """
+    Runs the function, and returns its peak memory allocation in MiB and how
+    long it took.
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2 ** 20, elapsed
+
+
+def run(
+        scales: Iterable[float], export_dir: str
+) -> Dict[str, List[Tuple[float, int, float, float]]]:
+    from fallen_london_chronicler.db import get_session
+
+    results: Dict[str, List[Tuple[float, int, float, float]]] = {
+        "html export": [],
+        "html archive": [],
+        "streamed walk": [],
+        "eager walk": [],
+    }
+    for i, scale in enumerate(scales):
+        reset_db()
+        with get_session() as session:
+            counts = generate_world(session, WorldSize.scaled(scale))
+        rows = sum(counts.values())
+        for name, function in (
+                ("html export", lambda: export_html(export_dir)),
+                ("html archive", export_html_archive),
+                ("streamed walk", walk_streamed),
+                ("eager walk", walk_eager),
+        ):
+            # What SQLAlchemy and Jinja set up on first use is kept for the
+            # lifetime of the process, and must not be counted
+            if i == 0:
+                function()
+            peak, elapsed = measure(function)
+            results[name].append((scale, rows, peak, elapsed))
+            print(
+                f"scale {scale:<5} {rows:>8} rows  {name:<14} "
+                f"peak {peak:7.1f} MiB  {elapsed:6.1f}s"
+            )
+        shutil.rmtree(export_dir, ignore_errors=True)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "--scales",
+        type=float,
+        nargs="+",
+        default=[0.05, 0.1, 0.2],
+        help="The sizes of the worlds to export, relative to the default",
+    )
+    parser.add_argument(
+        "--max-growth",
+        type=float,
+        default=2.0,
+        help="The largest allowed ratio between the peak memory of exports "
+             "of the largest and the smallest world",
+    )
+    args = parser.parse_args()
+
+    work_dir = use_temporary_db()
+    try:
+        results = run(
+            sorted(args.scales), os.path.join(work_dir, "export")
+        )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    failed = False
+    for name, measurements in results.items():
+        growth = measurements[-1][2] / measurements[0][2]
+        bounded = name != "eager walk"
+        print(f"{name}: peak memory grew {growth:.2f}x")
+        if bounded and growth > args.max_growth:
+            failed = True
+    if failed:
+        print(f"Peak memory grew by more than {args.max_growth}x")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+Benchmarks the latency and throughput of the submission API.
+
+Submissions are sent to the app in-process, first against an empty database
+and then against one pre-populated by a bulk replay, while a local server
+stands in for the game's image server.
+
+Run with `python -m benchmarks.ingestion` from the repository root.
+"""
+import argparse
+import json
+import math
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from benchmarks.submissions import Event, count_rows, load_events, \
+    make_events, record_bulk, reset_db, use_temporary_db
+
+
+def make_png() -> bytes:
+    """
+    Makes a PNG image of a single transparent pixel.
+    """
+    def chunk(chunk_type: bytes, data: bytes) -> bytes:
+        checksum = zlib.crc32(chunk_type + data)
+        return struct.pack(">I", len(data)) + chunk_type + data \
+            + struct.pack(">I", checksum)
+
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 6, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) \
+        + chunk(b"IDAT", zlib.compress(b"\x00" + bytes(4))) \
+        + chunk(b"IEND", b"")
+
+
+PNG_PIXEL = make_png()
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(PNG_PIXEL)))
+        self.end_headers()
+        self.wfile.write(PNG_PIXEL)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class ImageServer:
+    """
+    Serves the same image for every path, in place of the game's server.
+    """
+
+    def __init__(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), ImageHandler)
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        )
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "ImageServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def percentile(values: List[float], p: float) -> float:
+    """
+    Gets a percentile of sorted values using the nearest-rank method.
+    """
+    rank = max(math.ceil(p / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def summarize(latencies: List[float], seconds: float) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "throughput": len(latencies) / seconds if seconds else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def run_scenario(events: List[Event], windows: int) -> Dict[str, Any]:
+    """
+    Sends each submission in turn and measures how long each one takes.
+    """
+    from starlette.testclient import TestClient
+    from fallen_london_chronicler.app import app
+
+    client = TestClient(app)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    timeline: List[float] = []
+    rejected = 0
+    start = time.perf_counter()
+    for endpoint, payload in events:
+        request_start = time.perf_counter()
+        response = client.post(
+            f"/api/submit/{endpoint}", json={**payload, "apiKey": ""}
+        )
+        latency = time.perf_counter() - request_start
+        if response.status_code != 200:
+            raise AssertionError(
+                f"Failed to submit {endpoint}: {response.text}"
+            )
+        if not response.json()["success"]:
+            rejected += 1
+        latencies[endpoint].append(latency)
+        timeline.append(latency)
+    seconds = time.perf_counter() - start
+
+    # Show how latency grows as the database fills up
+    window_size = math.ceil(len(timeline) / windows)
+    return {
+        "seconds": seconds,
+        "rejected": rejected,
+        "overall": summarize(timeline, seconds),
+        "endpoints": {
+            endpoint: summarize(values, sum(values))
+            for endpoint, values in sorted(latencies.items())
+        },
+        "windows_mean_ms": [
+            sum(window) / len(window) * 1000
+            for window in (
+                timeline[i:i + window_size]
+                for i in range(0, len(timeline), window_size)
+            )
+        ],
+        "rows": count_rows(),
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    """
+    Prints how the results changed since a previous run.
+    """
+    for name, scenario in results["scenarios"].items():
+        if name not in baseline["scenarios"]:
+            continue
+        print(f"{name} (vs. baseline)")
+        previous = baseline["scenarios"][name]
+        summaries = {"overall": scenario["overall"], **scenario["endpoints"]}
+        previous_summaries = \
+            {"overall": previous["overall"], **previous["endpoints"]}
+        for key, summary in summaries.items():
+            if key not in previous_summaries:
+                continue
+            previous_summary = previous_summaries[key]
+            changes = ", ".join(
+                f"{metric} {format_change(value, previous_summary[metric])}"
+                for metric, value in summary.items()
+                if metric != "count"
+            )
+            print(f"  {key:>18}: {changes}")
+
+
+def format_change(value: float, previous: float) -> str:
+    if not previous:
+        return "n/a"
+    return f"{(value - previous) / previous * 100:+.1f}%"
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    for name, scenario in results["scenarios"].items():
+        print(
+            f"{name}: {scenario['overall']['count']} submissions in "
+            f"{scenario['seconds']:.2f}s, {scenario['rejected']} rejected, "
+            f"{scenario['rows'].get('outcome_observations', 0)} outcome "
+            f"observations at the end"
+        )
+        summaries = {"overall": scenario["overall"], **scenario["endpoints"]}
+        for key, summary in summaries.items():
+            print(
+                f"  {key:>18}: {summary['throughput']:7.1f}/s  "
+                f"p50 {summary['p50_ms']:7.1f}ms  "
+                f"p95 {summary['p95_ms']:7.1f}ms  "
+                f"p99 {summary['p99_ms']:7.1f}ms"
+            )
+        windows = ", ".join(
+            f"{mean:.1f}" for mean in scenario["windows_mean_ms"]
+        )
+        print(f"  mean latency over time (ms): {windows}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "corpus",
+        nargs="*",
+        help="Capture files, or directories containing them, to replay "
+             "instead of synthetic submissions",
+    )
+    parser.add_argument("--events", type=int, default=300)
+    parser.add_argument(
+        "--prefill",
+        type=int,
+        default=3000,
+        help="The number of synthetic submissions recorded before the "
+             "pre-populated run",
+    )
+    parser.add_argument("--areas", type=int, default=20)
+    parser.add_argument("--storylets", type=int, default=30)
+    parser.add_argument("--windows", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--json", action="store_true", help="Output the results as JSON"
+    )
+    parser.add_argument(
+        "--output", help="Also write the results as JSON to this file"
+    )
+    parser.add_argument(
+        "--compare", help="Compare the results to those in this JSON file"
+    )
+    args = parser.parse_args()
+
+    use_temporary_db()
+    from fallen_london_chronicler.images import image_cache
+
+    if args.corpus:
+        events = load_events(args.corpus)[:args.events]
+    else:
+        events = make_events(
+            args.events, args.areas, args.storylets, args.seed
+        )
+    prefill = make_events(
+        args.prefill, args.areas, args.storylets, args.seed + 1
+    )
+
+    results: Dict[str, Any] = {"events": len(events), "scenarios": {}}
+    with ImageServer() as image_server:
+        image_cache.base_url = image_server.url
+        image_cache.cache_dir = tempfile.mkdtemp(prefix="flc-images-")
+        for name, initial_events in (("empty", None), ("populated", prefill)):
+            reset_db()
+            if initial_events:
+                # Images are fetched during the measured run only
+                image_cache.enabled = False
+                record_bulk(initial_events, flush_interval=1000)
+                image_cache.enabled = True
+            results["scenarios"][name] = run_scenario(events, args.windows)
+        image_cache.shutdown(wait=True)
+    results["images"] = image_cache.stats().__dict__
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    baseline: Optional[Dict[str, Any]] = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+    if baseline:
+        compare(results, baseline)
+
+
+if __name__ == "__main__":
+    main()
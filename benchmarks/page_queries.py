@@ -0,0 +1,179 @@
+"""
+Checks the number of SQL statements run to render each page.
+
+A synthetic world is generated, then pages of every kind are requested from
+the app in-process and exported to HTML, while the statements sent to the
+database are counted. The counts must stay within fixed bounds, however many
+entities each page shows, or else something on the page is loaded one row at
+a time.
+
+Run with `python -m benchmarks.page_queries` from the repository root. It
+exits with an error if any page runs more statements than allowed.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+from typing import Dict, List, Tuple
+
+from benchmarks.submissions import reset_db, use_temporary_db
+from benchmarks.world import WorldSize, generate_world
+
+# The most statements allowed for a page of each kind, including the one
+# reading its versions
+QUERY_BOUNDS = {
+    "areas": 2,
+    "area": 10,
+    "storylet": 14,
+    "branch": 20,
+}
+# The most statements allowed, on average, for each job of the HTML export,
+# which renders the pages of some areas, or of some storylets and their
+# branches
+EXPORT_JOB_QUERY_BOUND = 30
+
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args) -> None:
+        self.count += 1
+
+
+def get_page_urls(sample: int, seed: int) -> List[Tuple[str, str]]:
+    from fallen_london_chronicler.db import engine
+
+    rng = random.Random(seed)
+    urls = [("areas", "/areas/")]
+    area_storylets = engine.execute(
+        "SELECT area_id, storylet_id FROM areas_storylets"
+    ).fetchall()
+    area_branches = engine.execute(
+        "SELECT area_id, branches.id FROM areas_storylets "
+        "JOIN branches ON branches.storylet_id = areas_storylets.storylet_id"
+    ).fetchall()
+    area_ids = sorted({area_id for area_id, _ in area_storylets})
+    urls.extend(
+        ("area", f"/area/{area_id}")
+        for area_id in rng.sample(area_ids, min(sample, len(area_ids)))
+    )
+    urls.extend(
+        ("storylet", f"/storylet/{area_id}/{storylet_id}")
+        for area_id, storylet_id in rng.sample(
+            area_storylets, min(sample, len(area_storylets))
+        )
+    )
+    urls.extend(
+        ("branch", f"/branch/{area_id}/{branch_id}")
+        for area_id, branch_id in rng.sample(
+            area_branches, min(sample, len(area_branches))
+        )
+    )
+    return urls
+
+
+def count_page_statements(
+        urls: List[Tuple[str, str]]
+) -> Dict[str, List[int]]:
+    from sqlalchemy import event
+    from starlette.testclient import TestClient
+
+    from fallen_london_chronicler.app import app
+    from fallen_london_chronicler.db import engine
+
+    client = TestClient(app)
+    counts: Dict[str, List[int]] = {kind: [] for kind in QUERY_BOUNDS}
+    counter = StatementCounter()
+    event.listen(engine, "before_cursor_execute", counter)
+    try:
+        for kind, url in urls:
+            counter.count = 0
+            response = client.get(url)
+            response.raise_for_status()
+            counts[kind].append(counter.count)
+    finally:
+        event.remove(engine, "before_cursor_execute", counter)
+    return counts
+
+
+def count_export_statements(export_dir: str) -> Tuple[int, int]:
+    """
+    Exports the world to HTML in this process, and returns the number of
+    statements run and the number of jobs.
+    """
+    from sqlalchemy import event
+
+    from fallen_london_chronicler.db import engine, get_session
+    from fallen_london_chronicler.export.html import HTMLExporter, \
+        get_export_jobs
+
+    counter = StatementCounter()
+    with get_session() as session:
+        jobs = len(get_export_jobs(session))
+        event.listen(engine, "before_cursor_execute", counter)
+        try:
+            HTMLExporter(export_dir, "", incremental=False, workers=1) \
+                .export_all(session)
+        finally:
+            event.remove(engine, "before_cursor_execute", counter)
+    return counter.count, jobs
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=0.1,
+        help="The size of the world, relative to the default",
+    )
+    parser.add_argument(
+        "--sample",
+        type=int,
+        default=50,
+        help="The number of pages of each kind to request",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    work_dir = use_temporary_db()
+    try:
+        from fallen_london_chronicler.db import get_session
+
+        reset_db()
+        with get_session() as session:
+            generate_world(session, WorldSize.scaled(args.scale), args.seed)
+        page_counts = count_page_statements(
+            get_page_urls(args.sample, args.seed)
+        )
+        export_count, jobs = count_export_statements(
+            os.path.join(work_dir, "export")
+        )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    failed = False
+    for kind, counts in page_counts.items():
+        bound = QUERY_BOUNDS[kind]
+        print(
+            f"{kind + ' page':<14} {len(counts):>4} pages  "
+            f"statements min {min(counts):>3}  max {max(counts):>3}  "
+            f"bound {bound:>3}"
+        )
+        failed |= max(counts) > bound
+    per_job = export_count / jobs
+    print(
+        f"{'html export':<14} {jobs:>4} jobs   "
+        f"statements {export_count} ({per_job:.1f} per job)  "
+        f"bound {EXPORT_JOB_QUERY_BOUND} per job"
+    )
+    failed |= per_job > EXPORT_JOB_QUERY_BOUND
+    if failed:
+        print("Some pages ran more statements than allowed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Benchmarks rebuilding the database from captured submissions.
+
+The same synthetic stream of submissions is recorded once through the HTTP
+API, as it would be by a running server, and once by a bulk replay, for each
+number of events.
+
+Each HTTP submission starts from an empty session, and so lazily reloads the
+storylets of its area along with their observations, which takes longer as
+they accumulate. A bulk replay keeps them in memory instead, does not flush
+until it commits, and then inserts each table's new rows together. Here, it
+records around 190 to 200 events per second, against 18 down to 14 over
+HTTP: a speedup of 10x to 11x for a hundred events, growing to 14x to 15x for
+a thousand.
+
+Timings vary a lot from one run to the next on a busy machine, so each number
+of events is recorded several times and the median timings are reported.
+
+Run with `python -m benchmarks.replay` from the repository root.
+"""
+import argparse
+import json
+import statistics
+import time
+from typing import Any, Dict, List
+
+from benchmarks.submissions import Event, count_rows, make_events, \
+    record_bulk, reset_db, use_temporary_db
+
+
+def run_http(events: List[Event]) -> float:
+    from starlette.testclient import TestClient
+    from fallen_london_chronicler.app import app
+
+    client = TestClient(app)
+    start = time.perf_counter()
+    for endpoint, payload in events:
+        response = client.post(
+            f"/api/submit/{endpoint}", json={"apiKey": "", **payload}
+        )
+        if response.status_code != 200 or not response.json()["success"]:
+            raise AssertionError(
+                f"Failed to submit {endpoint}: {response.text}"
+            )
+    return time.perf_counter() - start
+
+
+def run(
+        events: List[Event], flush_interval: int, repeat: int
+) -> Dict[str, Any]:
+    from fallen_london_chronicler.images import image_cache
+    image_cache.enabled = False
+
+    http_times = []
+    bulk_times = []
+    for _ in range(repeat):
+        reset_db()
+        http_times.append(run_http(events))
+        http_rows = count_rows()
+        reset_db()
+        bulk_times.append(record_bulk(events, flush_interval))
+        if count_rows() != http_rows:
+            raise AssertionError("Bulk replay recorded different rows")
+    http_seconds = statistics.median(http_times)
+    bulk_seconds = statistics.median(bulk_times)
+    return {
+        "events": len(events),
+        "rows": sum(http_rows.values()),
+        "speedup": http_seconds / bulk_seconds,
+        "results": {
+            "http": {
+                "seconds": http_seconds,
+                "events_per_second": len(events) / http_seconds,
+            },
+            "bulk": {
+                "seconds": bulk_seconds,
+                "events_per_second": len(events) / bulk_seconds,
+            },
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "--events", type=int, nargs="+", default=[100, 300, 1000]
+    )
+    parser.add_argument("--areas", type=int, default=20)
+    parser.add_argument("--storylets", type=int, default=30)
+    parser.add_argument("--flush-interval", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--repeat", type=int, default=3,
+        help="Number of times to record each stream"
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Output the results as JSON"
+    )
+    args = parser.parse_args()
+
+    use_temporary_db()
+    from fallen_london_chronicler.images import image_cache
+
+    runs = [
+        run(
+            make_events(count, args.areas, args.storylets, args.seed),
+            args.flush_interval,
+            args.repeat,
+        )
+        for count in args.events
+    ]
+    image_cache.shutdown()
+
+    if args.json:
+        print(json.dumps(runs, indent=2))
+        return
+    print(
+        f"{'events':>7} {'rows':>7} {'http/s':>7} {'bulk/s':>7} "
+        f"{'speedup':>8}"
+    )
+    for result in runs:
+        print(
+            f"{result['events']:>7} {result['rows']:>7} "
+            f"{result['results']['http']['events_per_second']:>7.0f} "
+            f"{result['results']['bulk']['events_per_second']:>7.0f} "
+            f"{result['speedup']:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""
+Synthetic submissions and helpers shared by the submission benchmarks.
+
+The app is configured when it is imported, so the benchmarks only import it
+once use_temporary_db has pointed it at a throwaway database.
+"""
+import os
+import random
+import tempfile
+import time
+from typing import Any, Dict, Iterable, List, Tuple
+
+Event = Tuple[str, Dict[str, Any]]
+
+SETTING_ID = 5
+FIRST_AREA_ID = 100
+FIRST_STORYLET_ID = 10000
+FIRST_QUALITY_ID = 500
+
+
+def make_requirement(rng: random.Random, i: int) -> Dict[str, Any]:
+    quality_id = FIRST_QUALITY_ID + rng.randrange(50)
+    return {
+        "id": i,
+        "category": "Stories",
+        "image": "question",
+        "isCost": False,
+        "nature": "Status",
+        "qualityId": quality_id,
+        "qualityName": f"Quality {quality_id}",
+        "status": "Unlocked",
+        "tooltip": f"You unlocked this with <span class='quality-name'>"
+                   f"Quality {quality_id}</span> {rng.randint(3, 9)} "
+                   f"<em>(you needed 3)</em>",
+    }
+
+
+def make_branch(rng: random.Random, branch_id: int) -> Dict[str, Any]:
+    return {
+        "id": branch_id,
+        "actionCost": 1,
+        "actionLocked": False,
+        "buttonText": "Go",
+        "challenges": [],
+        "currencyCost": 0,
+        "currencyLocked": False,
+        "description": f"Branch <em>{branch_id}</em>",
+        "image": "question",
+        "isLocked": False,
+        "name": f"Branch {branch_id}",
+        "ordering": branch_id % 10,
+        "planKey": f"plan{branch_id}",
+        "qualityLocked": False,
+        "qualityRequirements": [make_requirement(rng, branch_id)],
+    }
+
+
+def make_storylet(
+        rng: random.Random, storylet_id: int, with_branches: bool
+) -> Dict[str, Any]:
+    return {
+        "id": storylet_id,
+        "category": "Unspecialised",
+        "image": "question",
+        "name": f"Storylet {storylet_id}",
+        "teaser": f"Teaser {storylet_id} & more",
+        "description": f"Description of {storylet_id}"
+        if with_branches else None,
+        "qualityRequirements": [
+            make_requirement(rng, storylet_id * 10 + i) for i in range(2)
+        ],
+        "childBranches": [
+            make_branch(rng, storylet_id * 10 + i) for i in range(3)
+        ] if with_branches else None,
+    }
+
+
+def make_possession(quality_id: int, level: int) -> Dict[str, Any]:
+    return {
+        "id": quality_id,
+        "qualityPossessedId": quality_id,
+        "name": f"Quality {quality_id}",
+        "description": "",
+        "image": "question",
+        "equippable": False,
+        "category": "Stories",
+        "nature": "Status",
+        "level": level,
+        "effectiveLevel": level,
+        "himbleLevel": 0,
+        "nameAndLevel": f"Quality {quality_id} {level}",
+        "progressAsPercentage": 0,
+        "enhancements": [],
+    }
+
+
+def make_events(
+        count: int, areas: int, storylets: int, seed: int
+) -> List[Event]:
+    """
+    Builds a stream of submissions from a player wandering between areas,
+    looking at storylets and choosing branches.
+    """
+    rng = random.Random(seed)
+    events: List[Event] = [("setting", {"setting": {
+        "canChangeOutfit": True,
+        "canTravel": True,
+        "id": SETTING_ID,
+        "isInfiniteDraw": False,
+        "itemsUsableHere": True,
+        "name": "London",
+    }})]
+    area_id = None
+    while len(events) < count:
+        if area_id is None or rng.random() < 0.1:
+            area_id = FIRST_AREA_ID + rng.randrange(areas)
+            events.append(("area", {
+                "area": {
+                    "id": area_id,
+                    "areaKey": f"area{area_id}",
+                    "canChangeOutfit": True,
+                    "canMoveTo": True,
+                    "discovered": True,
+                    "hideName": False,
+                    "image": "question",
+                    "name": f"Area {area_id}",
+                    "premiumSubRequired": False,
+                    "showOps": True,
+                    "type": "District",
+                    "unlocked": True,
+                },
+                "settingId": SETTING_ID,
+            }))
+        location = {"areaId": area_id, "settingId": SETTING_ID}
+        first_storylet_id = FIRST_STORYLET_ID \
+            + (area_id - FIRST_AREA_ID) * storylets
+        storylet_ids = rng.sample(
+            range(first_storylet_id, first_storylet_id + storylets),
+            min(storylets, 8),
+        )
+        events.append(("storylet/list", {
+            **location,
+            "storylets": [make_storylet(rng, i, False) for i in storylet_ids],
+        }))
+        storylet_id = rng.choice(storylet_ids)
+        events.append(("storylet/view", {
+            **location,
+            "inInventory": False,
+            "storylet": make_storylet(rng, storylet_id, True),
+        }))
+        quality_id = FIRST_QUALITY_ID + rng.randrange(50)
+        level = rng.randint(1, 10)
+        events.append(("storylet/outcome", {
+            **location,
+            "branchId": storylet_id * 10 + rng.randrange(3),
+            "endStorylet": {
+                "canGoAgain": True,
+                "currentActionsRemaining": 1,
+                "event": {
+                    "id": storylet_id,
+                    "name": f"Outcome {storylet_id}",
+                    "description": f"Outcome of {storylet_id}",
+                    "image": "question",
+                },
+                "isDirectLinkingEvent": False,
+                "isLinkingEvent": False,
+                "image": "question",
+                "maxActionsAllowed": 1,
+                "premiumBenefitsApply": False,
+                "rootEventId": storylet_id,
+            },
+            "messages": [{
+                "type": "StandardQualityChangeMessage",
+                "message": f"You've gained {level} x Quality {quality_id}.",
+                "image": "question",
+                "possession": make_possession(quality_id, level),
+            }],
+            "redirect": None,
+        }))
+        if rng.random() < 0.05:
+            events.append(("possessions", {"possessions": [{
+                "appearance": "Default",
+                "categories": ["Stories"],
+                "name": "Stories",
+                "possessions": [
+                    make_possession(FIRST_QUALITY_ID + i, rng.randint(1, 10))
+                    for i in range(50)
+                ],
+            }]}))
+    return events[:count]
+
+
+def load_events(paths: Iterable[str]) -> List[Event]:
+    """
+    Loads recorded submissions from capture files, or directories containing
+    them, in the order in which they were received.
+    """
+    from fallen_london_chronicler.capture import find_capture_files, \
+        read_capture_file
+
+    records = [
+        record
+        for file_path in find_capture_files(paths)
+        for record in read_capture_file(file_path)
+    ]
+    records.sort(key=lambda r: r.time)
+    return [(record.endpoint, record.payload) for record in records]
+
+
+def use_temporary_db() -> str:
+    work_dir = tempfile.mkdtemp(prefix="flc-benchmark-")
+    db_path = os.path.join(work_dir, "benchmark.db")
+    os.environ["DB_URL"] = f"sqlite:///{db_path}"
+    return work_dir
+
+
+def record_bulk(events: List[Event], flush_interval: int) -> float:
+    """
+    Records submissions with a bulk replay, and returns how long it took.
+    """
+    from fallen_london_chronicler.capture import CapturedSubmission
+    from fallen_london_chronicler.db import get_session
+    from fallen_london_chronicler.model import User
+    from fallen_london_chronicler.replay import Replay
+
+    with get_session() as session:
+        user_id = User.get_by_api_key(session, "").id
+    records = [
+        CapturedSubmission(
+            time=float(i),
+            endpoint=endpoint,
+            user_id=user_id,
+            user_name="Administrator",
+            payload=payload,
+        )
+        for i, (endpoint, payload) in enumerate(events)
+    ]
+    replay = Replay(
+        batch_size=0,
+        progress_interval=float("inf"),
+        bulk=True,
+        flush_interval=flush_interval,
+    )
+    replay.stats.total = len(records)
+    start = time.perf_counter()
+    replay.run_bulk(records)
+    elapsed = time.perf_counter() - start
+    if replay.stats.rejected:
+        raise AssertionError(f"{replay.stats.rejected} submissions rejected")
+    return elapsed
+
+
+def reset_db() -> None:
+    from fallen_london_chronicler import model
+    from fallen_london_chronicler.auth import invalidate_authorizations
+    from fallen_london_chronicler.db import engine, setup_db
+
+    model.Base.metadata.drop_all(engine)
+    setup_db()
+    invalidate_authorizations()
+
+
+def count_rows() -> Dict[str, int]:
+    from fallen_london_chronicler import model
+    from fallen_london_chronicler.db import engine
+
+    return {
+        table.name: engine.execute(table.count()).scalar()
+        for table in model.Base.metadata.sorted_tables
+    }
@@ -0,0 +1,178 @@
+"""
+Benchmarks the parsing of quality requirement tooltips.
+
+Run with `python -m benchmarks.tooltips` from the repository root.
+"""
+import argparse
+import json
+import random
+import time
+from typing import Callable, List, Optional, Tuple
+
+from fallen_london_chronicler.tooltips import TOOLTIPS_NONE, \
+    TOOLTIPS_AT_LEAST_ONE, TOOLTIPS_MINIMUM, TOOLTIPS_MAXIMUM, \
+    TOOLTIPS_EXACTLY, TOOLTIPS_RANGE, TOOLTIPS_WORDY, TOOLTIPS_WORDY_ITEM, \
+    TooltipRequirement, parse_tooltip
+from fallen_london_chronicler.utils import match_any
+
+QUALITIES = (
+    "Watchful", "Shadowy", "Dangerous", "Persuasive", "A Player of Chess",
+    "Glasswork", "Mithridacy", "Connected: The Duchess", "Nightmares",
+    "Scandal", "Suspicion", "Wounds", "Route: Lodgings", "Moonlit Pearl",
+    "Jade Fragment", "Cryptic Clue", "Appalling Secret", "Making Waves",
+    "A Constables' Pal", "Rat on a String", "Stormy-Eyed",
+    "Inspired...", "Casing...", "Airs of the Forgotten Quarter",
+    "Devices of the Wolfstack Docks", "Ambition: Nemesis",
+)
+
+# Tooltips as they are sent by the game, one template per known phrasing;
+# {q} is the quality name, {a}, {b} and {c} are quantities
+TEMPLATES = (
+    "You unlocked this by not having any "
+    "<span class='quality-name'>{q}</span>",
+    "You can't do this when you have <span class='quality-name'>{q}</span>",
+    "Unlocked when you do not have <span class='quality-name'>{q}</span>",
+    "You need an <span class='quality-name'>{q}</span>",
+    "You need <span class='quality-name'>{q}</span>",
+    "Unlocked when you have <span class='quality-name'>{q}</span>",
+    "You unlocked this with <span class='quality-name'>{q}</span> "
+    "<em>(you have {c} in all)</em>",
+    "You must be {q}.",
+    "You unlocked this with <span class='quality-name'>{q}</span> {c} "
+    "<em>(you needed {a})</em>",
+    "You unlocked this with {c} <span class='quality-name'>{q}</span> "
+    "<em>(you needed {a})</em>",
+    "You need <span class='quality-name'>{q}</span> {a}"
+    "<em>(you have {c})</em>",
+    "You need {a} <span class='quality-name'>{q}</span> "
+    "<em>(you have {c})</em>",
+    "You need {a} <span class='quality-name'>{q}</span>",
+    "You can't do this when you have <span class='quality-name'>{q}</span> "
+    "higher than {b} <em>(you have {c})</em>",
+    "You unlocked this with <span class='quality-name'>{q}</span> {c} "
+    "<em>(you needed {b} at most)</em>",
+    "You unlocked this with <span class='quality-name'>{q}</span> {c} "
+    "<em>(you needed exactly {a})</em>",
+    "You need exactly <span class='quality-name'>{q}</span> {a} "
+    "<em>(you have {c})</em>",
+    "You unlocked this with <span class='quality-name'>{q}</span> {c} "
+    "<em>(you needed {a}-{b})</em>",
+    "You need <span class='quality-name'>{q}</span> {a}-{b} "
+    "<em>(you have {c})</em>",
+    "Unlocked when <span class='quality-name'>{q}</span> is:"
+    "<ul class='wordy-list'><li>Hopeful</li>"
+    "<li class='current'><em>Bereft</em></li><li>\\\"Reformed\\\"</li></ul>",
+    "This tooltip has a phrasing which is not recognized for {q}",
+)
+
+
+def make_corpus(size: int, distinct: int, seed: int) -> List[str]:
+    """
+    Builds a corpus in which a limited number of distinct tooltips repeat,
+    as they do across submissions.
+    """
+    rng = random.Random(seed)
+    tooltips = [
+        rng.choice(TEMPLATES).format(
+            q=rng.choice(QUALITIES),
+            a=rng.randint(1, 15),
+            b=rng.randint(15, 30),
+            c=rng.randint(0, 30),
+        )
+        for _ in range(distinct)
+    ]
+    # Favour some tooltips over others, like the most common storylets
+    weights = [1 / (i + 1) for i in range(distinct)]
+    return rng.choices(tooltips, weights=weights, k=size)
+
+
+def parse_tooltip_sequential(tooltip: str) -> Optional[TooltipRequirement]:
+    """
+    Parses a tooltip by trying each kind's patterns in turn, as was done
+    before the patterns were combined.
+    """
+    if match_any(TOOLTIPS_NONE, tooltip):
+        return TooltipRequirement(quantity_max=0)
+    elif match_any(TOOLTIPS_AT_LEAST_ONE, tooltip):
+        return TooltipRequirement(quantity_min=1)
+    elif match := match_any(TOOLTIPS_MINIMUM, tooltip):
+        return TooltipRequirement(quantity_min=int(match.group("quantity_min")))
+    elif match := match_any(TOOLTIPS_MAXIMUM, tooltip):
+        return TooltipRequirement(quantity_max=int(match.group("quantity_max")))
+    elif match := match_any(TOOLTIPS_EXACTLY, tooltip):
+        quantity = int(match.group("quantity"))
+        return TooltipRequirement(quantity_min=quantity, quantity_max=quantity)
+    elif match := match_any(TOOLTIPS_RANGE, tooltip):
+        return TooltipRequirement(
+            quantity_min=int(match.group("quantity_min")),
+            quantity_max=int(match.group("quantity_max")),
+        )
+    elif match := match_any(TOOLTIPS_WORDY, tooltip):
+        return TooltipRequirement(required_values=tuple(
+            req.replace(r'\"', '"')
+            for req in TOOLTIPS_WORDY_ITEM.findall(match.group("requirements"))
+        ))
+    return None
+
+
+def time_parser(
+        parser: Callable[[str], Optional[TooltipRequirement]],
+        corpus: List[str],
+) -> float:
+    start = time.perf_counter()
+    for tooltip in corpus:
+        parser(tooltip)
+    return time.perf_counter() - start
+
+
+def run(corpus: List[str]) -> List[Tuple[str, float]]:
+    # Check that both parsers agree before comparing them
+    for tooltip in set(corpus):
+        expected = parse_tooltip_sequential(tooltip)
+        if parse_tooltip.__wrapped__(tooltip) != expected:
+            raise AssertionError(f"Parsers disagree on: {tooltip}")
+
+    parse_tooltip.cache_clear()
+    return [
+        ("sequential", time_parser(parse_tooltip_sequential, corpus)),
+        ("combined", time_parser(parse_tooltip.__wrapped__, corpus)),
+        ("cached (cold)", time_parser(parse_tooltip, corpus)),
+        ("cached (warm)", time_parser(parse_tooltip, corpus)),
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--distinct", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--json", action="store_true", help="Output the results as JSON"
+    )
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.size, args.distinct, args.seed)
+    results = run(corpus)
+    if args.json:
+        print(json.dumps({
+            "size": args.size,
+            "distinct": args.distinct,
+            "results": {
+                name: {
+                    "seconds": seconds,
+                    "per_tooltip_us": seconds / len(corpus) * 1e6,
+                }
+                for name, seconds in results
+            },
+        }, indent=2))
+        return
+    print(f"{len(corpus)} tooltips, {args.distinct} distinct")
+    for name, seconds in results:
+        print(
+            f"{name:>15}: {seconds:.3f}s "
+            f"({seconds / len(corpus) * 1e6:.2f}us per tooltip)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,492 @@
+"""
+Generates a synthetic world for scale testing.
+
+The world is written directly through the models in bulk, with observations
+whose content hashes match those the app would compute, so that the web
+views, the exporters and new submissions all work on top of it.
+
+Run with `python -m benchmarks.world --output world.db` from the repository
+root, or call generate_world from another benchmark.
+"""
+import argparse
+import os
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Type
+
+from sqlalchemy.orm import Session
+
+from benchmarks.submissions import reset_db
+from fallen_london_chronicler import model
+from fallen_london_chronicler.model.secondaries import areas_settings, \
+    areas_storylets, settings_storylets
+from fallen_london_chronicler.model.storylet import storylets_order
+from fallen_london_chronicler.model.utils import get_content_hash
+
+# The number of rows sent to the database in each INSERT
+INSERT_CHUNK_SIZE = 10000
+
+WORDS = (
+    "lamplight", "tomb-colonist", "devil", "rubbery", "zee", "clay",
+    "urchin", "sunless", "bazaar", "cantigaster", "echo", "mirror",
+    "neathbow", "honey", "spider", "bishop", "widow", "duchess", "cat",
+    "ambassador", "fungus", "correspondence", "storm", "Veilgarden",
+    "Spite", "Watchmaker's Hill", "Wolfstack", "Ladybones", "Mahogany",
+)
+
+
+@dataclass
+class WorldSize:
+    areas: int = 200
+    settings: int = 20
+    storylets: int = 5000
+    qualities: int = 1000
+    branches_per_storylet: int = 3
+    observations_per_entity: int = 4
+    requirements_per_observation: int = 2
+    outcomes_per_branch: int = 2
+    messages_per_outcome: int = 3
+    order_edges_per_storylet: int = 2
+
+    @classmethod
+    def scaled(cls, scale: float) -> "WorldSize":
+        """
+        Gets a world with proportionally more or fewer entities, but the same
+        number of observations per entity.
+        """
+        default = cls()
+        return cls(
+            areas=max(int(default.areas * scale), 1),
+            settings=max(int(default.settings * scale), 1),
+            storylets=max(int(default.storylets * scale), 1),
+            qualities=max(int(default.qualities * scale), 1),
+        )
+
+
+class WorldGenerator:
+    """
+    Builds rows for every table in memory and inserts them in large chunks,
+    assigning IDs itself so that no row has to be read back.
+    """
+
+    def __init__(self, session: Session, size: WorldSize, seed: int):
+        self.session = session
+        self.size = size
+        self.rng = random.Random(seed)
+        self.counts: Dict[str, int] = {}
+        self._next_ids: Dict[str, int] = {}
+        self._time = datetime(2021, 1, 1)
+
+    def generate(self) -> Dict[str, int]:
+        area_ids = self.add_areas()
+        area_settings = self.add_settings(area_ids)
+        quality_ids = self.add_qualities()
+        storylets_by_area = self.add_storylets(area_settings)
+        storylet_ids = [s for ids in storylets_by_area.values() for s in ids]
+        self.add_storylet_order(storylets_by_area)
+        branch_ids = self.add_branches(storylet_ids, quality_ids)
+        self.add_outcomes(branch_ids, storylet_ids, area_ids, quality_ids)
+        return dict(self.counts)
+
+    def add_areas(self) -> List[int]:
+        area_ids = list(range(1, self.size.areas + 1))
+        self.insert(model.Area, [
+            {
+                "id": area_id,
+                "name": self.title(),
+                "description": self.sentence(),
+                "image": f"area{area_id % 50}",
+                "type": self.rng.choice(list(model.AreaType)),
+            }
+            for area_id in area_ids
+        ])
+        return area_ids
+
+    def add_settings(self, area_ids: List[int]) -> Dict[int, int]:
+        """
+        Adds settings and returns the setting of each area.
+        """
+        setting_ids = list(range(1, self.size.settings + 1))
+        self.insert(model.Setting, [
+            {
+                "id": setting_id,
+                "name": self.title(),
+                "can_change_outfit": True,
+                "can_travel": self.rng.random() < 0.8,
+                "is_infinite_draw": False,
+                "items_usable_here": True,
+            }
+            for setting_id in setting_ids
+        ])
+        area_settings = {
+            area_id: setting_ids[i % len(setting_ids)]
+            for i, area_id in enumerate(area_ids)
+        }
+        self.insert(areas_settings, [
+            {"area_id": area_id, "setting_id": setting_id}
+            for area_id, setting_id in area_settings.items()
+        ])
+        return area_settings
+
+    def add_qualities(self) -> List[int]:
+        quality_ids = list(range(1, self.size.qualities + 1))
+        self.insert(model.Quality, [
+            {
+                "id": quality_id,
+                "name": self.title(),
+                "description": self.sentence(),
+                "category": self.rng.choice(
+                    ("Stories", "Curiosity", "Goods", "Circumstance")
+                ),
+                "nature": self.rng.choice(list(model.QualityNature)),
+            }
+            for quality_id in quality_ids
+        ])
+        return quality_ids
+
+    def add_storylets(
+            self, area_settings: Dict[int, int]
+    ) -> Dict[int, List[int]]:
+        """
+        Adds storylets, most of them listed in a single area; the others are
+        only reached through redirects.
+        """
+        storylets = []
+        area_ids = list(area_settings)
+        storylets_by_area: Dict[int, List[int]] = {a: [] for a in area_ids}
+        area_links = []
+        setting_links = set()
+        for storylet_id in range(1, self.size.storylets + 1):
+            is_top_level = self.rng.random() < 0.9
+            area_id = self.rng.choice(area_ids)
+            storylets.append({
+                "id": storylet_id,
+                "category": self.rng.choice(list(model.StoryletCategory)),
+                "image": f"storylet{storylet_id % 100}",
+                "is_top_level": is_top_level,
+                "is_card": is_top_level and self.rng.random() < 0.1,
+                "is_autofire": False,
+                "can_go_back": True,
+            })
+            storylets_by_area[area_id].append(storylet_id)
+            if is_top_level:
+                area_links.append(
+                    {"area_id": area_id, "storylet_id": storylet_id}
+                )
+                setting_links.add((area_settings[area_id], storylet_id))
+
+        observations = []
+        requirements = []
+        for storylet_id in range(1, self.size.storylets + 1):
+            name = self.title()
+            for _ in range(self.size.observations_per_entity):
+                observation_id = self.next_id(model.StoryletObservation)
+                observation_requirements = self.requirements(
+                    model.StoryletQualityRequirement,
+                    "storylet_observation_id",
+                    observation_id,
+                )
+                observation = {
+                    "id": observation_id,
+                    "storylet_id": storylet_id,
+                    "last_modified": self.tick(),
+                    "name": name,
+                    "description": self.sentence(),
+                    "teaser": self.sentence(),
+                }
+                observation["content_hash"] = self.content_hash(
+                    model.StoryletObservation,
+                    observation,
+                    quality_requirements=observation_requirements,
+                )
+                observations.append(observation)
+                requirements.extend(observation_requirements)
+            copy_latest_observation(
+                model.Storylet, storylets[storylet_id - 1], observation
+            )
+        self.insert(model.Storylet, storylets)
+        self.insert(areas_storylets, area_links)
+        self.insert(settings_storylets, [
+            {"setting_id": setting_id, "storylet_id": storylet_id}
+            for setting_id, storylet_id in sorted(setting_links)
+        ])
+        self.insert(model.StoryletObservation, observations)
+        self.insert(model.StoryletQualityRequirement, requirements)
+        return storylets_by_area
+
+    def add_storylet_order(
+            self, storylets_by_area: Dict[int, List[int]]
+    ) -> None:
+        """
+        Orders each area's storylets, always before later ones, like the
+        orders recorded from storylet lists.
+        """
+        edges = set()
+        for storylet_ids in storylets_by_area.values():
+            for i, before_id in enumerate(storylet_ids[:-1]):
+                later_ids = storylet_ids[i + 1:]
+                for after_id in self.rng.sample(
+                        later_ids,
+                        min(self.size.order_edges_per_storylet, len(later_ids))
+                ):
+                    edges.add((before_id, after_id))
+        self.insert(storylets_order, [
+            {"before_id": before_id, "after_id": after_id}
+            for before_id, after_id in sorted(edges)
+        ])
+
+    def add_branches(
+            self, storylet_ids: List[int], quality_ids: List[int]
+    ) -> List[int]:
+        branches = []
+        observations = []
+        requirements = []
+        challenges = []
+        for storylet_id in storylet_ids:
+            for ordering in range(self.size.branches_per_storylet):
+                branch_id = self.next_id(model.Branch)
+                branches.append({
+                    "id": branch_id,
+                    "storylet_id": storylet_id,
+                    "action_cost": 1,
+                    "button_text": "Go",
+                    "image": f"branch{branch_id % 100}",
+                    "ordering": ordering,
+                })
+                name = self.title()
+                for _ in range(self.size.observations_per_entity):
+                    observation_id = self.next_id(model.BranchObservation)
+                    observation_requirements = self.requirements(
+                        model.BranchQualityRequirement,
+                        "branch_observation_id",
+                        observation_id,
+                    )
+                    observation_challenges = [
+                        {
+                            "id": self.next_id(model.Challenge),
+                            "branch_observation_id": observation_id,
+                            "game_id": self.rng.choice(quality_ids),
+                            "category": "Challenge",
+                            "name": self.title(),
+                            "description": self.sentence(),
+                            "image": "challenge",
+                            "target": self.rng.randint(50, 200),
+                            "nature": model.ChallengeNature.STATUS,
+                            "type": model.ChallengeType.CHALLENGE,
+                        }
+                    ] if self.rng.random() < 0.3 else []
+                    observation = {
+                        "id": observation_id,
+                        "branch_id": branch_id,
+                        "last_modified": self.tick(),
+                        "name": name,
+                        "description": self.sentence(),
+                        "currency_cost": 0,
+                    }
+                    observation["content_hash"] = self.content_hash(
+                        model.BranchObservation,
+                        observation,
+                        challenges=observation_challenges,
+                        quality_requirements=observation_requirements,
+                    )
+                    observations.append(observation)
+                    requirements.extend(observation_requirements)
+                    challenges.extend(observation_challenges)
+                copy_latest_observation(
+                    model.Branch, branches[-1], observation
+                )
+        self.insert(model.Branch, branches)
+        self.insert(model.BranchObservation, observations)
+        self.insert(model.BranchQualityRequirement, requirements)
+        self.insert(model.Challenge, challenges)
+        return [branch["id"] for branch in branches]
+
+    def add_outcomes(
+            self,
+            branch_ids: List[int],
+            storylet_ids: List[int],
+            area_ids: List[int],
+            quality_ids: List[int],
+    ) -> None:
+        outcomes = []
+        messages = []
+        for branch_id in branch_ids:
+            for _ in range(self.size.outcomes_per_branch):
+                outcome_id = self.next_id(model.OutcomeObservation)
+                outcome_messages = []
+                for _ in range(self.size.messages_per_outcome):
+                    quality_id = self.rng.choice(quality_ids)
+                    change = self.rng.randint(-5, 10) or 1
+                    outcome_messages.append({
+                        "id": self.next_id(model.OutcomeMessage),
+                        "outcome_observation_id": outcome_id,
+                        "type": model.OutcomeMessageType
+                        .STANDARD_QUALITY_CHANGE,
+                        "text": f"You've {'gained' if change > 0 else 'lost'}"
+                                f" {abs(change)} x Quality {quality_id}.",
+                        "image": f"quality{quality_id % 100}",
+                        "change": change,
+                        "quality_id": quality_id,
+                    })
+                roll = self.rng.random()
+                outcome = {
+                    "id": outcome_id,
+                    "branch_id": branch_id,
+                    "last_modified": self.tick(),
+                    "name": self.title(),
+                    "description": self.sentence(),
+                    "image": f"outcome{outcome_id % 100}",
+                    "is_success": self.rng.random() < 0.7,
+                    "redirect_id": self.rng.choice(storylet_ids)
+                    if roll < 0.1 else None,
+                    "redirect_area_id": self.rng.choice(area_ids)
+                    if 0.1 <= roll < 0.15 else None,
+                    "redirect_setting_id": None,
+                    "redirect_branch_id": None,
+                }
+                outcome["content_hash"] = self.content_hash(
+                    model.OutcomeObservation,
+                    outcome,
+                    messages=outcome_messages,
+                )
+                outcomes.append(outcome)
+                messages.extend(outcome_messages)
+        self.insert(model.OutcomeObservation, outcomes)
+        self.insert(model.OutcomeMessage, messages)
+
+    def requirements(
+            self, cls: Type[Any], observation_key: str, observation_id: int
+    ) -> List[Dict[str, Any]]:
+        rows = []
+        for _ in range(self.size.requirements_per_observation):
+            quality_id = self.rng.randint(1, self.size.qualities)
+            quantity = self.rng.randint(1, 10)
+            rows.append({
+                "id": self.next_id(cls),
+                observation_key: observation_id,
+                "quality_id": quality_id,
+                "game_id": self.rng.randint(1, 10 ** 6),
+                "image": f"quality{quality_id % 100}",
+                "is_cost": self.rng.random() < 0.2,
+                "required_quantity_min": quantity,
+                "required_quantity_max": quantity
+                if self.rng.random() < 0.2 else None,
+                "required_values": None,
+                "fallback_text": None,
+            })
+        return rows
+
+    def content_hash(
+            self,
+            cls: Type[Any],
+            row: Dict[str, Any],
+            **related_rows: List[Dict[str, Any]],
+    ) -> str:
+        """
+        Hashes an observation the way the app does, through transient
+        instances of its related objects.
+        """
+        relationships = cls.__mapper__.relationships
+        values = {}
+        for name in cls.CONTENT_HASH_FIELDS:
+            if name in related_rows:
+                related_cls = relationships[name].mapper.class_
+                values[name] = [related_cls(**r) for r in related_rows[name]]
+            else:
+                values[name] = row.get(name)
+        return get_content_hash(values)
+
+    def insert(self, model_or_table: Any, rows: List[Dict[str, Any]]) -> None:
+        table = getattr(model_or_table, "__table__", model_or_table)
+        for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+            self.session.execute(
+                table.insert(), rows[i:i + INSERT_CHUNK_SIZE]
+            )
+        self.counts[table.name] = self.counts.get(table.name, 0) + len(rows)
+
+    def next_id(self, cls: Type[Any]) -> int:
+        name = cls.__tablename__
+        self._next_ids[name] = self._next_ids.get(name, 0) + 1
+        return self._next_ids[name]
+
+    def tick(self) -> datetime:
+        # Each observation is a little more recent than the previous one
+        self._time += timedelta(seconds=self.rng.randint(1, 600))
+        return self._time
+
+    def title(self) -> str:
+        return " ".join(self.rng.sample(WORDS, 3)).title()
+
+    def sentence(self) -> str:
+        words = self.rng.choices(WORDS, k=self.rng.randint(6, 20))
+        return " ".join(words).capitalize() + "."
+
+
+
+def copy_latest_observation(
+        cls: Type[Any], entity: Dict[str, Any], observation: Dict[str, Any]
+) -> None:
+    entity["latest_observation_id"] = observation["id"]
+    for name in cls.LATEST_OBSERVATION_FIELDS:
+        entity[name] = observation.get(name)
+
+
+def generate_world(
+        session: Session, size: WorldSize, seed: int = 0
+) -> Dict[str, int]:
+    """
+    Fills an empty database with a synthetic world, and returns the number
+    of rows added to each table.
+    """
+    return WorldGenerator(session, size, seed).generate()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "--output",
+        default="world.db",
+        help="The SQLite database to create (default: world.db)",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Multiplies the number of areas, settings, storylets and "
+             "qualities",
+    )
+    parser.add_argument(
+        "--observations",
+        type=int,
+        default=WorldSize.observations_per_entity,
+        help="The number of observations of each storylet and branch",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--force", action="store_true", help="Overwrite the output database"
+    )
+    args = parser.parse_args()
+
+    if os.path.exists(args.output):
+        if not args.force:
+            parser.error(f"{args.output} already exists, use --force")
+        os.remove(args.output)
+    os.environ["DB_URL"] = f"sqlite:///{os.path.abspath(args.output)}"
+    from fallen_london_chronicler.db import get_session
+
+    size = WorldSize.scaled(args.scale)
+    size.observations_per_entity = args.observations
+    start = time.perf_counter()
+    reset_db()
+    with get_session() as session:
+        counts = generate_world(session, size, args.seed)
+    elapsed = time.perf_counter() - start
+    for name, count in sorted(counts.items()):
+        print(f"{name:>32}: {count}")
+    print(f"Generated {sum(counts.values())} rows in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import multiprocessing
+
 import uvicorn
 
 from fallen_london_chronicler.config import config
@@ -5,6 +7,8 @@ from fallen_london_chronicler.log import LOGGING_CONFIG
 
 
 def main() -> None:
+    # Lets the HTML export start worker processes from a frozen executable
+    multiprocessing.freeze_support()
     uvicorn.run(
         "fallen_london_chronicler.app:app",
         host="0.0.0.0",
@@ -1,9 +1,10 @@
 import json
 import logging
 import re
-from typing import Iterable, List, Optional, Type, TypeVar
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Type, TypeVar
 
-from bs4 import BeautifulSoup
+from sqlalchemy import inspect
 from sqlalchemy.orm import Session
 
 from fallen_london_chronicler.images import get_or_cache_image, ImageType
@@ -15,146 +16,20 @@ from fallen_london_chronicler.model import Area, AreaType, Storylet, \
     BranchQualityRequirement, OutcomeObservation, OutcomeMessage, \
     OutcomeMessageType, QualityRequirement, StoryletQualityRequirement, \
     Setting, User, UserPossession
+from fallen_london_chronicler.model.base import GameEntity, record_change
 from fallen_london_chronicler.model.storylet import StoryletStickiness
-from fallen_london_chronicler.model.utils import pairwise
+from fallen_london_chronicler.model.utils import pairwise, \
+    set_latest_observation
+from fallen_london_chronicler.sanitize import normalize_html
 from fallen_london_chronicler.schema import StoryletInfo, AreaInfo, \
     BranchInfo, ChallengeInfo, QualityRequirementInfo, \
     StoryletBranchOutcomeInfo, StoryletBranchOutcomeMessageInfo, PossessionInfo
 from fallen_london_chronicler.schema.setting import SettingInfo
 from fallen_london_chronicler.schema.storylet import CardInfo
+from fallen_london_chronicler.tooltips import parse_tooltip, \
+    TooltipRequirement
 from fallen_london_chronicler.utils import match_any
 
-TOOLTIPS_NONE = (
-    re.compile(
-        r"^You unlocked this by not having any "
-        r"<span class='quality-name'>(?P<quality>.+)</span>$"
-    ),
-    re.compile(
-        r"^You can't do this when you have "
-        r"<span class='quality-name'>(?P<quality>.+)</span>$"
-    ),
-    re.compile(
-        r"^Unlocked when you do not have "
-        r"<span class='quality-name'>(?P<quality>.+)</span>$"
-    ),
-    re.compile(
-        r"^You unlocked this by having no "
-        r"<span class='quality-name'>(?P<quality>.+)</span>$"
-    )
-)
-TOOLTIPS_AT_LEAST_ONE = (
-    re.compile(
-        r"^You need (?:an? )?<span class='quality-name'>(?P<quality>.+)</span>$"
-    ),
-    re.compile(
-        r"^Unlocked when you have <span class='quality-name'>(?P<quality>.+)"
-        r"</span>$"
-    ),
-    re.compile(
-        r"^You need to be <span class='quality-name'>(?P<quality>.+)</span> "
-        r"someone$"
-    ),
-    re.compile(
-        r"^You unlocked this with (?:an? )?"
-        r"<span class='quality-name'>(?P<quality>.+)</span>\s*"
-        r"<em>\s*\(you have (?P<current>\d+) in all\)\s*</em>$"
-    ),
-    re.compile(
-        r"^You can't do this when you have any "
-        r"<span class='quality-name'>(?P<quality>.+)</span>$"
-    ),
-    re.compile(r"^You must be (?P<quality>.+)\.$"),
-    re.compile(r"^This is unlocked because you have the (?P<quality>.+)\.$")
-)
-TOOLTIPS_MINIMUM = (
-    re.compile(
-        r"^You unlocked this with "
-        r"<span class='quality-name'>(?P<quality>.+)</span> (?P<current>\d+)\s*"
-        r"<em>\s*\(you needed (?P<quantity_min>\d+)\)\s*</em>$"
-    ),
-    re.compile(
-        r"^You unlocked this with (?P<current>\d+) "
-        r"<span class='quality-name'>(?P<quality>.+)</span>\s*"
-        r"<em>\s*\(you needed (?P<quantity_min>\d+)\)\s*</em>$"
-    ),
-    re.compile(
-        r"^You need <span class='quality-name'>(?P<quality>.+)</span>\s*"
-        r"(?P<quantity_min>\d+)<em>\s*\(you have (?P<current>\d+)\)\s*</em>$"
-    ),
-    re.compile(
-        r"^You need (?P<quantity_min>\d+) "
-        r"<span class='quality-name'>(?P<quality>.+)</span>\s*"
-        r"<em>\s*\(you have (?P<current>\d+)\)\s*</em>$"
-    ),
-    re.compile(
-        r"^You need (?P<quantity_min>\d+) "
-        r"<span class='quality-name'>(?P<quality>.+)</span>$"
-    ),
-    re.compile(
-        r"^You need <span class='quality-name'>(?P<quality>.+)</span> "
-        r"(?P<quantity_min>\d+)$"
-    ),
-)
-TOOLTIPS_MAXIMUM = (
-    re.compile(
-        r"^You can't do this when you have <span class='quality-name'>"
-        r"(?P<quality>.+)</span> higher than (?P<quantity_max>\d+)\s*"
-        r"<em>\s*\(you have (?P<current>\d+)\)\s*</em>$"
-    ),
-    re.compile(
-        r"^You unlocked this with "
-        r"<span class='quality-name'>(?P<quality>.+)</span> (?P<current>\d+)\s*"
-        r"<em>\s*\(you needed (?P<quantity_max>\d+) at most\)\s*</em>$"
-    ),
-    re.compile(
-        r"^You unlocked this by not having "
-        r"<span class='quality-name'>(?P<quality>.+)</span>\s*"
-        r"<em>\s*\(you needed (?P<quantity_max>\d+) at most\)\s*</em>$"
-    )
-)
-TOOLTIPS_EXACTLY = (
-    re.compile(
-        r"^You unlocked this with (?:an? )?"
-        r"<span class='quality-name'>(?P<quality>.+)</span> (?P<current>\d+)\s*"
-        r"<em>\s*\(you needed exactly (?P<quantity>\d+)\)\s*</em>$"
-    ),
-    re.compile(
-        r"^You need exactly "
-        r"<span class='quality-name'>(?P<quality>.+)</span> (?P<quantity>\d+)\s*"
-        r"(?:<em>\s*\(you have (?P<current>\d+)\)\s*</em>)?$"
-    ),
-    re.compile(
-        r"^You need <span class='quality-name'>(?P<quality>.+)</span>\s*"
-        r"exactly (?P<quantity>\d+)$"
-    ),
-    re.compile(
-        r"^You unlocked this with any "
-        r"<span class='quality-name'>(?P<quality>.+)</span>\s*"
-        r"<em>\s*\(you needed exactly (?P<quantity>\d+)\)\s*</em>$"
-    ),
-)
-TOOLTIPS_RANGE = (
-    re.compile(
-        r"^You unlocked this with "
-        r"<span class='quality-name'>(?P<quality>.+)</span> (?P<current>\d+)\s*"
-        r"<em>\s*\(you needed (?P<quantity_min>\d+)-(?P<quantity_max>\d+)\)\s*</em>$"
-    ),
-    re.compile(
-        r"^You need <span class='quality-name'>(?P<quality>.+)</span> "
-        r"(?P<quantity_min>\d+)-(?P<quantity_max>\d+)\s*"
-        r"(?:<em>\s*\(you have (?P<current>\d+)\)\s*</em>)?$"
-    )
-)
-TOOLTIPS_WORDY = (
-    re.compile(
-        r"^Unlocked when <span class='quality-name'>(?P<quality>.+)</span> is:"
-        r"<ul class='wordy-list'>(?P<requirements>.+)</ul>$"
-    ),
-)
-TOOLTIPS_WORDY_ITEM = re.compile(
-    r"<li(?: class='current')?>(?:<em>)?(.*?)(?:</em>)?</li>"
-)
-
 QUALITY_GAIN = (
     re.compile(
         r"^You've gained (?P<quantity>\d+) x (?P<quality>.+?)"
@@ -187,20 +62,32 @@ QUALITY_SET_TO = (
 T = TypeVar("T", bound=QualityRequirement)
 
 
+@dataclass
+class PossessionSyncStats:
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+
+
 def record_area(
         session: Session,
         area_info: AreaInfo,
         setting_id: Optional[int] = None
 ) -> Area:
-    area = Area.get_or_create(session, area_info.id)
-    area.name = area_info.name
-    area.description = fix_html(area_info.description)
-    area.image = get_or_cache_image(ImageType.HEADER, area_info.image)
-    area.type = AreaType(area_info.type)
+    area = Area.upsert(
+        session,
+        area_info.id,
+        name=area_info.name,
+        description=normalize_html(area_info.description),
+        image=get_or_cache_image(ImageType.HEADER, area_info.image),
+        type=AreaType(area_info.type),
+    )
     if setting_id is not None:
-        setting = Setting.get_or_create(session, setting_id)
+        setting = Setting.upsert(session, setting_id)
         if setting not in area.settings:
             area.settings.append(setting)
+            setting.increment_version()
     return area
 
 
@@ -209,16 +96,20 @@ def record_setting(
         setting_info: SettingInfo,
         area_id: Optional[int] = None
 ) -> Setting:
-    setting = Setting.get_or_create(session, setting_info.id)
-    setting.name = setting_info.name
-    setting.can_change_outfit = setting_info.canChangeOutfit
-    setting.can_travel = setting_info.canTravel
-    setting.is_infinite_draw = setting_info.isInfiniteDraw
-    setting.items_usable_here = setting_info.itemsUsableHere
+    setting = Setting.upsert(
+        session,
+        setting_info.id,
+        name=setting_info.name,
+        can_change_outfit=setting_info.canChangeOutfit,
+        can_travel=setting_info.canTravel,
+        is_infinite_draw=setting_info.isInfiniteDraw,
+        items_usable_here=setting_info.itemsUsableHere,
+    )
     if area_id is not None:
-        area = Area.get_or_create(session, area_id)
+        area = Area.upsert(session, area_id)
         if area not in setting.areas:
             setting.areas.append(area)
+            setting.increment_version()
     return setting
 
 
@@ -228,6 +119,8 @@ def record_opportunities(
         area_id: Optional[int],
         setting_id: Optional[int],
 ) -> List[Storylet]:
+    cards_info = list(cards_info)
+    prefetch_cards(session, cards_info, area_id, setting_id)
     return [
         record_card(session, card_info, area_id, setting_id)
         for card_info in cards_info
@@ -240,50 +133,142 @@ def record_area_storylets(
         setting_id: int,
         storylets_info: Iterable[StoryletInfo]
 ) -> List[Storylet]:
+    storylets_info = list(storylets_info)
+    prefetch_storylets(session, storylets_info, area_id, setting_id)
     storylets = [
         record_storylet(session, storylet_info, area_id, setting_id)
         for storylet_info in storylets_info
     ]
     for storylet in storylets:
-        storylet.is_top_level = True
+        if not storylet.is_top_level:
+            storylet.is_top_level = True
+            storylet.increment_version()
 
     # Create ordered pairs to enable a sorted display - we don't know what the
     # actual, total order is since we don't have access to every storylet that
     # could appear in the area, so let's just create pairwise associations
+    reordered_areas = set()
     for before, after in pairwise(storylets):
         if after in before.before:
             before.before.remove(after)
         if after not in before.after:
             before.after.append(after)
+            # The pairs are shared by every area listing both storylets, so
+            # the order of each of them changed, not just of this one
+            reordered_areas.add(Area.upsert(session, area_id))
+            reordered_areas.update(set(before.areas) & set(after.areas))
+            # The order is versioned by the area, but the pages listing the
+            # storylet still need to be invalidated
+            record_change(session, before)
+    for area in reordered_areas:
+        increment_order_version(area)
 
     return storylets
 
 
+def increment_order_version(area: Area) -> None:
+    if inspect(area).persistent:
+        # Increment in SQL so that concurrent changes are all counted
+        area.order_version = Area.order_version + 1
+    else:
+        area.order_version = (area.order_version or 0) + 1
+
+
+def prefetch_storylets(
+        session: Session,
+        storylets_info: Iterable[StoryletInfo],
+        area_id: Optional[int],
+        setting_id: Optional[int],
+) -> None:
+    """
+    Loads all the entities referenced by the storylets in bulk.
+    """
+    entity_ids = get_location_entity_ids(area_id, setting_id)
+    for storylet_info in storylets_info:
+        entity_ids[Storylet].add(storylet_info.id)
+        entity_ids[Quality].update(
+            qr.qualityId for qr in storylet_info.qualityRequirements
+        )
+        for branch_info in storylet_info.childBranches or ():
+            entity_ids[Branch].add(branch_info.id)
+            entity_ids[Quality].update(
+                qr.qualityId for qr in branch_info.qualityRequirements
+            )
+    prefetch_entities(session, entity_ids)
+
+
+def prefetch_cards(
+        session: Session,
+        cards_info: Iterable[CardInfo],
+        area_id: Optional[int],
+        setting_id: Optional[int],
+) -> None:
+    """
+    Loads all the entities referenced by the cards in bulk.
+    """
+    entity_ids = get_location_entity_ids(area_id, setting_id)
+    for card_info in cards_info:
+        entity_ids[Storylet].add(card_info.eventId)
+        entity_ids[Quality].update(
+            qr.qualityId for qr in card_info.qualityRequirements
+        )
+    prefetch_entities(session, entity_ids)
+
+
+def get_location_entity_ids(
+        area_id: Optional[int], setting_id: Optional[int]
+) -> Dict[Type[GameEntity], Set[int]]:
+    entity_ids = {
+        Area: set(),
+        Setting: set(),
+        Storylet: set(),
+        Branch: set(),
+        Quality: set(),
+    }
+    if area_id is not None:
+        entity_ids[Area].add(area_id)
+    if setting_id is not None:
+        entity_ids[Setting].add(setting_id)
+    return entity_ids
+
+
+def prefetch_entities(
+        session: Session, entity_ids: Dict[Type[GameEntity], Set[int]]
+) -> None:
+    for entity_cls, ids in entity_ids.items():
+        if ids:
+            entity_cls.get_many(session, ids)
+
+
 def record_storylet(
         session: Session,
         storylet_info: StoryletInfo,
         area_id: Optional[int],
         setting_id: Optional[int],
 ) -> Storylet:
-    storylet = Storylet.get_or_create(session, storylet_info.id)
+    values = dict(
+        category=StoryletCategory(storylet_info.category),
+        image=get_or_cache_image(ImageType.ICON, storylet_info.image),
+    )
     if storylet_info.canGoBack is not None:
-        storylet.can_go_back = storylet_info.canGoBack
+        values["can_go_back"] = storylet_info.canGoBack
     if storylet_info.distribution is not None:
-        storylet.distribution = StoryletDistribution(
+        values["distribution"] = StoryletDistribution(
             str(storylet_info.distribution)
         )
     if storylet_info.frequency is not None:
-        storylet.frequency = StoryletFrequency(storylet_info.frequency)
+        values["frequency"] = StoryletFrequency(storylet_info.frequency)
     if storylet_info.urgency is not None:
-        storylet.urgency = StoryletUrgency(storylet_info.urgency)
-    storylet.category = StoryletCategory(storylet_info.category)
-    storylet.image = get_or_cache_image(ImageType.ICON, storylet_info.image)
-    record_observation(
-        storylet.observations,
+        values["urgency"] = StoryletUrgency(storylet_info.urgency)
+    storylet = Storylet.upsert(session, storylet_info.id, **values)
+    observation = record_observation(
+        session,
+        storylet,
+        "observations",
         StoryletObservation,
         name=storylet_info.name,
-        description=fix_html(storylet_info.description),
-        teaser=fix_html(storylet_info.teaser),
+        description=normalize_html(storylet_info.description),
+        teaser=normalize_html(storylet_info.teaser),
         quality_requirements=[
             record_quality_requirement(
                 session, StoryletQualityRequirement, quality_requirement_info
@@ -291,22 +276,26 @@ def record_storylet(
             for quality_requirement_info in storylet_info.qualityRequirements
         ],
     )
+    set_latest_observation(storylet, observation)
     if storylet_info.childBranches is not None:
         for branch_info in storylet_info.childBranches:
             branch = record_branch(session, branch_info)
             if branch not in storylet.branches:
                 storylet.branches.append(branch)
+                branch.increment_version()
 
     if area_id is not None:
-        area = Area.get_or_create(session, area_id)
+        area = Area.upsert(session, area_id)
         if storylet not in area.storylets:
             # TODO Remove when bug is figured out
             print(f"Adding {storylet} to {', '.join(str(s.id) for s in area.storylets)}")
             area.storylets.append(storylet)
+            storylet.increment_version()
     if setting_id is not None:
-        setting = Setting.get_or_create(session, setting_id)
+        setting = Setting.upsert(session, setting_id)
         if storylet not in setting.storylets:
             setting.storylets.append(storylet)
+            storylet.increment_version()
 
     return storylet
 
@@ -317,17 +306,22 @@ def record_card(
         area_id: Optional[int],
         setting_id: Optional[int],
 ) -> Storylet:
-    storylet = Storylet.get_or_create(session, card_info.eventId)
-    storylet.category = StoryletCategory(card_info.category)
-    storylet.image = get_or_cache_image(ImageType.ICON, card_info.image)
-    storylet.is_card = True
-    storylet.is_autofire = card_info.isAutofire
-    storylet.stickiness = StoryletStickiness(card_info.stickiness)
-    record_observation(
-        storylet.observations,
+    storylet = Storylet.upsert(
+        session,
+        card_info.eventId,
+        category=StoryletCategory(card_info.category),
+        image=get_or_cache_image(ImageType.ICON, card_info.image),
+        is_card=True,
+        is_autofire=card_info.isAutofire,
+        stickiness=StoryletStickiness(card_info.stickiness),
+    )
+    observation = record_observation(
+        session,
+        storylet,
+        "observations",
         StoryletObservation,
         name=card_info.name,
-        teaser=fix_html(card_info.teaser),
+        teaser=normalize_html(card_info.teaser),
         quality_requirements=[
             record_quality_requirement(
                 session, StoryletQualityRequirement, quality_requirement_info
@@ -335,29 +329,37 @@ def record_card(
             for quality_requirement_info in card_info.qualityRequirements
         ],
     )
+    set_latest_observation(storylet, observation)
 
     if area_id is not None:
-        area = Area.get_or_create(session, area_id)
+        area = Area.upsert(session, area_id)
         if storylet not in area.storylets:
             area.storylets.append(storylet)
+            storylet.increment_version()
     if setting_id is not None:
-        setting = Setting.get_or_create(session, setting_id)
-        if setting not in setting.storylets:
+        setting = Setting.upsert(session, setting_id)
+        if storylet not in setting.storylets:
             setting.storylets.append(storylet)
+            storylet.increment_version()
     return storylet
 
 
 def record_branch(session: Session, branch_info: BranchInfo) -> Branch:
-    branch = Branch.get_or_create(session, branch_info.id)
-    branch.action_cost = branch_info.actionCost
-    branch.button_text = branch_info.buttonText
-    branch.image = get_or_cache_image(ImageType.ICON, branch_info.image)
-    branch.ordering = branch_info.ordering
-    record_observation(
-        branch.observations,
+    branch = Branch.upsert(
+        session,
+        branch_info.id,
+        action_cost=branch_info.actionCost,
+        button_text=branch_info.buttonText,
+        image=get_or_cache_image(ImageType.ICON, branch_info.image),
+        ordering=branch_info.ordering,
+    )
+    observation = record_observation(
+        session,
+        branch,
+        "observations",
         BranchObservation,
         currency_cost=branch_info.currencyCost,
-        description=fix_html(branch_info.description),
+        description=normalize_html(branch_info.description),
         name=branch_info.name,
         challenges=[
             record_challenge(challenge_info)
@@ -370,6 +372,7 @@ def record_branch(session: Session, branch_info: BranchInfo) -> Branch:
             for quality_requirement_info in branch_info.qualityRequirements
         ],
     )
+    set_latest_observation(branch, observation)
     return branch
 
 
@@ -378,7 +381,7 @@ def record_challenge(challenge_info: ChallengeInfo) -> Challenge:
     challenge.game_id = challenge_info.id
     challenge.category = challenge_info.category
     challenge.name = challenge_info.name
-    challenge.description = fix_html(challenge_info.description)
+    challenge.description = normalize_html(challenge_info.description)
     challenge.image = get_or_cache_image(
         ImageType.ICON_SMALL, challenge_info.image
     )
@@ -410,34 +413,18 @@ def record_quality_requirement(
     )
     quality_requirement.quality_id = quality_requirement.quality.id
 
-    quantity_min = quantity_max = required_values = None
     tooltip = quality_requirement_info.tooltip
-    if match_any(TOOLTIPS_NONE, quality_requirement_info.tooltip):
-        quantity_max = 0
-    elif match_any(TOOLTIPS_AT_LEAST_ONE, quality_requirement_info.tooltip):
-        quantity_min = 1
-    elif match := match_any(TOOLTIPS_MINIMUM, quality_requirement_info.tooltip):
-        quantity_min = int(match.group("quantity_min"))
-    elif match := match_any(TOOLTIPS_MAXIMUM, quality_requirement_info.tooltip):
-        quantity_max = int(match.group("quantity_max"))
-    elif match := match_any(TOOLTIPS_EXACTLY, quality_requirement_info.tooltip):
-        quantity_min = quantity_max = int(match.group("quantity"))
-    elif match := match_any(TOOLTIPS_RANGE, quality_requirement_info.tooltip):
-        quantity_min = int(match.group("quantity_min"))
-        quantity_max = int(match.group("quantity_max"))
-    elif match := match_any(TOOLTIPS_WORDY, quality_requirement_info.tooltip):
-        required_values = [
-            req.replace(r'\"', '"')
-            for req in TOOLTIPS_WORDY_ITEM.findall(match.group("requirements"))
-        ]
-    else:
+    requirement = parse_tooltip(tooltip)
+    if requirement is None:
         logging.warning(f"Unknown tooltip: {tooltip}")
-        quality_requirement.fallback_text = fix_html(tooltip)
+        quality_requirement.fallback_text = normalize_html(tooltip)
+        requirement = TooltipRequirement()
 
-    quality_requirement.required_quantity_min = quantity_min
-    quality_requirement.required_quantity_max = quantity_max
-    quality_requirement.required_values = json.dumps(required_values) \
-        if required_values else None
+    quality_requirement.required_quantity_min = requirement.quantity_min
+    quality_requirement.required_quantity_max = requirement.quantity_max
+    quality_requirement.required_values = \
+        json.dumps(list(requirement.required_values)) \
+        if requirement.required_values else None
 
     return quality_requirement
 
@@ -451,14 +438,16 @@ def record_quality(
         description: Optional[str] = None,
         storylet_id: Optional[int] = None,
 ) -> Quality:
-    quality = Quality.get_or_create(session, game_id)
-    quality.name = name
-    quality.category = category
-    quality.nature = QualityNature(nature)
+    values = dict(
+        name=name,
+        category=category,
+        nature=QualityNature(nature),
+    )
     if description is not None:
-        quality.description = description
+        values["description"] = description
+    quality = Quality.upsert(session, game_id, **values)
     if storylet_id is not None:
-        quality.storylet = Storylet.get_or_create(session, storylet_id)
+        quality.storylet = Storylet.upsert(session, storylet_id)
     return quality
 
 
@@ -496,28 +485,32 @@ def record_outcome(
     if redirect_area and redirect_setting:
         if redirect_setting not in redirect_area.settings:
             redirect_area.settings.append(redirect_setting)
+            redirect_setting.increment_version()
     elif redirect_area:
         if setting_id is not None:
-            setting = Setting.get_or_create(session, setting_id)
+            setting = Setting.upsert(session, setting_id)
             if setting not in redirect_area.settings:
                 redirect_area.settings.append(setting)
+                setting.increment_version()
     elif redirect_setting:
         if area_id is not None:
-            area = Area.get_or_create(session, area_id)
+            area = Area.upsert(session, area_id)
             if area not in redirect_setting.areas:
                 redirect_setting.areas.append(area)
+                redirect_setting.increment_version()
 
     return record_observation(
-        branch.outcome_observations,
+        session,
+        branch,
+        "outcome_observations",
         OutcomeObservation,
         name=outcome_info.event.name if outcome_info else None,
-        description=fix_html(
+        description=normalize_html(
             outcome_info.event.description if outcome_info else None
         ),
         image=get_or_cache_image(
-            ImageType.ICON,
-            outcome_info.event.image if outcome_info else branch.image
-        ),
+            ImageType.ICON, outcome_info.event.image
+        ) if outcome_info else branch.image,
         is_success=not any(
             om.type == OutcomeMessageType.DIFFICULTY_ROLL_FAILURE
             for om in outcome_messages
@@ -607,7 +600,7 @@ def record_outcome_message(
             " (Simple challenges mean you don't learn so much.)", ""
         )
 
-    message.text = fix_html(message.text)
+    message.text = normalize_html(message.text)
 
     if change is not None and change != message.change:
         logging.warning(
@@ -623,10 +616,40 @@ def update_user_possessions(
         session: Session,
         user: User,
         possession_infos: Iterable[PossessionInfo]
-) -> None:
-    user.possessions.clear()
-    for possession_info in possession_infos:
-        update_user_possession(session, user, possession_info)
+) -> PossessionSyncStats:
+    """
+    Makes the user's possessions match the submitted ones, only writing the
+    rows which have changed.
+    """
+    possession_infos = {p.id: p for p in possession_infos}
+    prefetch_entities(session, {
+        Quality: set(possession_infos),
+        Storylet: {
+            p.useEventId for p in possession_infos.values()
+            if p.useEventId is not None
+        },
+    })
+
+    stats = PossessionSyncStats()
+    for quality_id in set(user.possessions) - set(possession_infos):
+        # The orphaned possession is deleted on flush
+        del user.possessions[quality_id]
+        stats.deleted += 1
+    for possession_info in possession_infos.values():
+        possession = user.get_possession(possession_info.id)
+        old_state = (
+            possession.level, possession.progress_as_percentage
+        ) if possession else None
+        possession = update_user_possession(session, user, possession_info)
+        if old_state is None:
+            stats.inserted += 1
+        elif old_state != (
+                possession.level, possession.progress_as_percentage
+        ):
+            stats.updated += 1
+        else:
+            stats.unchanged += 1
+    return stats
 
 
 def update_user_possession(
@@ -641,15 +664,12 @@ def update_user_possession(
         nature=possession_info.nature,
         storylet_id=possession_info.useEventId,
     )
-    possession = user.get_possession(possession_info.id)
+    possession = user.get_possession(quality.id)
     if not possession:
-        possession = UserPossession()
-        user.possessions.append(possession)
+        possession = UserPossession(quality_id=quality.id)
+        user.possessions[quality.id] = possession
     possession.quality = quality
     possession.level = possession_info.level
     possession.progress_as_percentage = possession_info.progressAsPercentage
     return possession
 
-
-def fix_html(text: Optional[str]) -> Optional[str]:
-    return str(BeautifulSoup(text, "html.parser")) if text is not None else None
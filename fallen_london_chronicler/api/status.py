@@ -0,0 +1,25 @@
+from dataclasses import asdict
+from typing import Any, Dict
+
+from fastapi import APIRouter
+
+from fallen_london_chronicler.images import image_cache
+from fallen_london_chronicler.ingestion import get_ingestion_stats
+from fallen_london_chronicler.ordering import get_storylet_order_cache_stats
+from fallen_london_chronicler.sanitize import get_html_cache_stats
+from fallen_london_chronicler.tooltips import get_tooltip_cache_stats
+from fallen_london_chronicler.web.cache import get_page_cache_stats
+
+router = APIRouter()
+
+
+@router.get("/")
+async def status() -> Dict[str, Any]:
+    return {
+        "images": asdict(image_cache.stats()),
+        "ingestion": asdict(get_ingestion_stats()),
+        "html": get_html_cache_stats(),
+        "tooltips": get_tooltip_cache_stats(),
+        "storylet_order": get_storylet_order_cache_stats(),
+        "pages": get_page_cache_stats(),
+    }
@@ -1,19 +1,26 @@
 import logging
-from typing import Tuple, Optional
+from typing import Callable, Dict, Tuple, Optional, Type
 
 from fastapi import APIRouter
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
 
 from fallen_london_chronicler.aggregator import record_area, \
     record_area_storylets, \
     record_storylet, record_outcome, record_setting, record_opportunities, \
-    update_user_possessions
+    update_user_possessions, prefetch_storylets
 from fallen_london_chronicler.auth import authorize
+from fallen_london_chronicler.capture import capture_submission
 from fallen_london_chronicler.db import get_session
+from fallen_london_chronicler.ingestion import enqueue_submissions, is_queued
 from fallen_london_chronicler.model import OutcomeObservation, User
+from fallen_london_chronicler.model.base import is_bulk
 from fallen_london_chronicler.schema import SubmitResponse, AreaRequest, \
     StoryletListRequest, StoryletViewRequest, StoryletBranchOutcomeRequest, \
-    OutcomeSubmitResponse, PossessionsRequest, SettingRequest
-from fallen_london_chronicler.schema.requests import OpportunitiesRequest
+    OutcomeSubmitResponse, PossessionsRequest, SettingRequest, \
+    BatchSubmitRequest, BatchSubmitResponse
+from fallen_london_chronicler.schema.requests import OpportunitiesRequest, \
+    SubmitRequest
 
 router = APIRouter()
 
@@ -26,15 +33,10 @@ async def possessions(
         user = authorize(session, possessions_request.apiKey)
         if not user:
             return SubmitResponse(success=False, error="Invalid API key")
-        logging.info(f"{{{user.name}}} Update possessions")
-        update_user_possessions(
-            session,
-            user,
-            (
-                p for cpi in possessions_request.possessions
-                for p in cpi.possessions
-            ))
-    return SubmitResponse(success=True)
+        capture_submission("possessions", user, possessions_request)
+        if is_queued():
+            return enqueue_submission("possessions", user, possessions_request)
+        return submit_possessions(session, user, possessions_request)
 
 
 @router.post("/area")
@@ -43,14 +45,10 @@ async def area(area_request: AreaRequest) -> SubmitResponse:
         user = authorize(session, area_request.apiKey)
         if not user:
             return SubmitResponse(success=False, error="Invalid API key")
-        logging.info(
-            f"{{{user.name}}} Submitting area {area_request.area.name} "
-            f"({area_request.area.id})"
-        )
-        user.current_area = record_area(
-            session, area_request.area, area_request.settingId
-        )
-    return SubmitResponse(success=True)
+        capture_submission("area", user, area_request)
+        if is_queued():
+            return enqueue_submission("area", user, area_request)
+        return submit_area(session, user, area_request)
 
 
 @router.post("/setting")
@@ -61,15 +59,10 @@ async def setting(
         user = authorize(session, setting_request.apiKey)
         if not user:
             return SubmitResponse(success=False, error="Invalid API key")
-        logging.info(
-            f"{{{user.name}}} Submitting setting "
-            f"{setting_request.setting.name} ({setting_request.setting.id})"
-        )
-        user.current_setting = record_setting(
-            session, setting_request.setting, setting_request.areaId
-        )
-
-    return SubmitResponse(success=True)
+        capture_submission("setting", user, setting_request)
+        if is_queued():
+            return enqueue_submission("setting", user, setting_request)
+        return submit_setting(session, user, setting_request)
 
 
 @router.post("/opportunities")
@@ -80,19 +73,12 @@ async def opportunities(
         user = authorize(session, opportunities_request.apiKey)
         if not user:
             return SubmitResponse(success=False, error="Invalid API key")
-        logging.info(
-            f"{{{user.name}}} Submitting opportunities in "
-            f"area {opportunities_request.areaId}/"
-            f"setting {opportunities_request.settingId}"
-        )
-        area_id, setting_id = get_location(user, opportunities_request)
-        record_opportunities(
-            session,
-            opportunities_request.displayCards,
-            area_id,
-            setting_id,
-        )
-    return SubmitResponse(success=True)
+        capture_submission("opportunities", user, opportunities_request)
+        if is_queued():
+            return enqueue_submission(
+                "opportunities", user, opportunities_request
+            )
+        return submit_opportunities(session, user, opportunities_request)
 
 
 @router.post("/storylet/list")
@@ -103,22 +89,12 @@ async def storylet_list(
         user = authorize(session, storylet_list_request.apiKey)
         if not user:
             return SubmitResponse(success=False, error="Invalid API key")
-        area_id, setting_id = get_location(user, storylet_list_request)
-        logging.info(
-            f"{{{user.name}}} Submitting storylets in "
-            f"area {storylet_list_request.areaId}/"
-            f"setting {storylet_list_request.settingId}"
-        )
-        if area_id is None or setting_id is None:
-            return SubmitResponse(
-                success=False,
-                error="Current area ID or setting ID does not match submitted "
-                      "area ID or setting ID, refresh page"
+        capture_submission("storylet/list", user, storylet_list_request)
+        if is_queued():
+            return enqueue_submission(
+                "storylet/list", user, storylet_list_request
             )
-        record_area_storylets(
-            session, area_id, setting_id, storylet_list_request.storylets
-        )
-    return SubmitResponse(success=True)
+        return submit_storylet_list(session, user, storylet_list_request)
 
 
 @router.post("/storylet/view")
@@ -129,24 +105,12 @@ async def storylet_view(
         user = authorize(session, storylet_view_request.apiKey)
         if not user:
             return SubmitResponse(success=False, error="Invalid API key")
-        area_id, setting_id = get_location(user, storylet_view_request)
-        logging.info(
-            f"{{{user.name}}} Submitting storylet "
-            f"{storylet_view_request.storylet.name} "
-            f"({storylet_view_request.storylet.id}) in "
-            f"area {storylet_view_request.areaId}/"
-            f"setting {storylet_view_request.settingId}"
-        )
-        storylet = record_storylet(
-            session, storylet_view_request.storylet, area_id, setting_id,
-        )
-        if storylet_view_request.isLinkingFromOutcomeObservation is not None:
-            observation = session.query(OutcomeObservation).get(
-                storylet_view_request.isLinkingFromOutcomeObservation
+        capture_submission("storylet/view", user, storylet_view_request)
+        if is_queued():
+            return enqueue_submission(
+                "storylet/view", user, storylet_view_request
             )
-            if observation:
-                observation.redirect = storylet
-    return SubmitResponse(success=True)
+        return submit_storylet_view(session, user, storylet_view_request)
 
 
 @router.post("/storylet/outcome")
@@ -157,41 +121,331 @@ async def storylet_outcome(
         user = authorize(session, storylet_outcome_request.apiKey)
         if not user:
             return OutcomeSubmitResponse(success=False, error="Invalid API key")
-        area_id, setting_id = get_location(user, storylet_outcome_request)
+        if is_queued():
+            capture_submission(
+                "storylet/outcome", user, storylet_outcome_request
+            )
+            enqueue_submission(
+                "storylet/outcome", user, storylet_outcome_request
+            )
+            new_area_id, new_setting_id = get_outcome_redirect(
+                storylet_outcome_request
+            )
+            return OutcomeSubmitResponse(
+                success=True,
+                newAreaId=new_area_id,
+                newSettingId=new_setting_id,
+            )
+        return submit_captured(
+            "storylet/outcome",
+            session,
+            user,
+            storylet_outcome_request,
+            submit_storylet_outcome,
+        )
+
+
+@router.post("/batch")
+async def batch(batch_request: BatchSubmitRequest) -> BatchSubmitResponse:
+    """
+    Applies several submissions, in order, in a single transaction.
+
+    Each item names the endpoint it would otherwise have been posted to (e.g.
+    "area" or "storylet/outcome") and carries that endpoint's request body;
+    the API key of the batch is used for every item.
+
+    Each item is applied in its own savepoint: if it fails, only its changes
+    are rolled back, and the error is reported in its result.
+    """
+    with get_session() as session:
+        user = authorize(session, batch_request.apiKey)
+        if not user:
+            return BatchSubmitResponse(success=False, error="Invalid API key")
         logging.info(
-            f"{{{user.name}}} Submitting storylet outcome in "
-            f"area {storylet_outcome_request.areaId}/"
-            f"setting {storylet_outcome_request.settingId}"
+            f"{{{user.name}}} Submitting batch of "
+            f"{len(batch_request.items)} items"
+        )
+        results = []
+        queued = []
+        for item in batch_request.items:
+            handler = SUBMIT_HANDLERS.get(item.endpoint)
+            if not handler:
+                results.append(SubmitResponse(
+                    success=False, error=f"Unknown endpoint: {item.endpoint}"
+                ))
+                continue
+            request_cls, submit = handler
+            try:
+                submit_request = request_cls.parse_obj(item.data)
+            except ValidationError as e:
+                results.append(SubmitResponse(success=False, error=str(e)))
+                continue
+            if is_queued():
+                capture_submission(item.endpoint, user, submit_request)
+                queued.append((item.endpoint, user.id, submit_request))
+                results.append(SubmitResponse(success=True))
+                continue
+            try:
+                with session.begin_nested():
+                    result = submit_captured(
+                        item.endpoint, session, user, submit_request, submit
+                    )
+            except Exception as e:
+                logging.exception(
+                    f"{{{user.name}}} Failed to apply {item.endpoint} "
+                    f"submission in batch"
+                )
+                result = SubmitResponse(
+                    success=False, error=f"{type(e).__name__}: {e}"
+                )
+            results.append(result)
+        enqueue_submissions(queued)
+    return BatchSubmitResponse(success=True, results=results)
+
+
+def submit_captured(
+        endpoint: str,
+        session: Session,
+        user: User,
+        submit_request: SubmitRequest,
+        submit: Callable[[Session, User, SubmitRequest], SubmitResponse],
+) -> SubmitResponse:
+    """
+    Applies a submission, then captures it along with the ID of the outcome it
+    recorded, if any, so that a replay can follow later submissions' links to
+    that outcome.
+    """
+    try:
+        response = submit(session, user, submit_request)
+    except Exception:
+        capture_submission(endpoint, user, submit_request)
+        raise
+    capture_submission(
+        endpoint,
+        user,
+        submit_request,
+        outcome_observation_id=getattr(
+            response, "outcomeObservationId", None
+        ),
+    )
+    return response
+
+
+def enqueue_submission(
+        endpoint: str, user: User, submit_request: SubmitRequest
+) -> SubmitResponse:
+    """
+    Queues a submission to be applied later by the ingestion writer.
+    """
+    logging.info(f"{{{user.name}}} Queuing {endpoint} submission")
+    enqueue_submissions([(endpoint, user.id, submit_request)])
+    return SubmitResponse(success=True)
+
+
+def submit_possessions(
+        session: Session,
+        user: User,
+        possessions_request: PossessionsRequest
+) -> SubmitResponse:
+    stats = update_user_possessions(
+        session,
+        user,
+        (
+            p for cpi in possessions_request.possessions
+            for p in cpi.possessions
+        ))
+    logging.info(
+        f"{{{user.name}}} Update possessions: {stats.inserted} inserted, "
+        f"{stats.updated} updated, {stats.deleted} deleted, "
+        f"{stats.unchanged} unchanged"
+    )
+    return SubmitResponse(success=True)
+
+
+def submit_area(
+        session: Session, user: User, area_request: AreaRequest
+) -> SubmitResponse:
+    logging.info(
+        f"{{{user.name}}} Submitting area {area_request.area.name} "
+        f"({area_request.area.id})"
+    )
+    area = record_area(session, area_request.area, area_request.settingId)
+    # Set the ID rather than the relationship so that later submissions can
+    # read it before the session is flushed
+    user.current_area_id = area.id
+    return SubmitResponse(success=True)
+
+
+def submit_setting(
+        session: Session, user: User, setting_request: SettingRequest
+) -> SubmitResponse:
+    logging.info(
+        f"{{{user.name}}} Submitting setting "
+        f"{setting_request.setting.name} ({setting_request.setting.id})"
+    )
+    setting = record_setting(
+        session, setting_request.setting, setting_request.areaId
+    )
+    # Set the ID rather than the relationship so that later submissions can
+    # read it before the session is flushed
+    user.current_setting_id = setting.id
+    return SubmitResponse(success=True)
+
+
+def submit_opportunities(
+        session: Session,
+        user: User,
+        opportunities_request: OpportunitiesRequest
+) -> SubmitResponse:
+    logging.info(
+        f"{{{user.name}}} Submitting opportunities in "
+        f"area {opportunities_request.areaId}/"
+        f"setting {opportunities_request.settingId}"
+    )
+    area_id, setting_id = get_location(user, opportunities_request)
+    record_opportunities(
+        session,
+        opportunities_request.displayCards,
+        area_id,
+        setting_id,
+    )
+    return SubmitResponse(success=True)
+
+
+def submit_storylet_list(
+        session: Session,
+        user: User,
+        storylet_list_request: StoryletListRequest
+) -> SubmitResponse:
+    area_id, setting_id = get_location(user, storylet_list_request)
+    logging.info(
+        f"{{{user.name}}} Submitting storylets in "
+        f"area {storylet_list_request.areaId}/"
+        f"setting {storylet_list_request.settingId}"
+    )
+    if area_id is None or setting_id is None:
+        return SubmitResponse(
+            success=False,
+            error="Current area ID or setting ID does not match submitted "
+                  "area ID or setting ID, refresh page"
         )
-        outcome = record_outcome(
-            user=user,
-            session=session,
-            branch_id=storylet_outcome_request.branchId,
-            outcome_info=storylet_outcome_request.endStorylet,
-            messages=storylet_outcome_request.messages,
-            redirect=storylet_outcome_request.redirect,
-            area_id=area_id,
-            setting_id=setting_id,
+    record_area_storylets(
+        session, area_id, setting_id, storylet_list_request.storylets
+    )
+    return SubmitResponse(success=True)
+
+
+def submit_storylet_view(
+        session: Session,
+        user: User,
+        storylet_view_request: StoryletViewRequest
+) -> SubmitResponse:
+    area_id, setting_id = get_location(user, storylet_view_request)
+    logging.info(
+        f"{{{user.name}}} Submitting storylet "
+        f"{storylet_view_request.storylet.name} "
+        f"({storylet_view_request.storylet.id}) in "
+        f"area {storylet_view_request.areaId}/"
+        f"setting {storylet_view_request.settingId}"
+    )
+    prefetch_storylets(
+        session, [storylet_view_request.storylet], area_id, setting_id
+    )
+    storylet = record_storylet(
+        session, storylet_view_request.storylet, area_id, setting_id,
+    )
+    if storylet_view_request.isLinkingFromOutcomeObservation is not None:
+        observation = session.query(OutcomeObservation).get(
+            storylet_view_request.isLinkingFromOutcomeObservation
         )
-        if storylet_outcome_request.isLinkingFromOutcomeObservation is not None:
-            # TODO Test this, does it have the branch ID?
-            observation = session.query(OutcomeObservation).get(
-                storylet_outcome_request.isLinkingFromOutcomeObservation
-            )
-            if observation:
-                observation.redirect_outcome = outcome
-        if outcome.redirect_area_id is not None:
-            user.current_area_id = outcome.redirect_area_id
-        if outcome.redirect_setting_id is not None:
-            user.current_setting_id = outcome.redirect_setting_id
+        if observation:
+            observation.redirect = storylet
+    return SubmitResponse(success=True)
+
+
+def submit_storylet_outcome(
+        session: Session,
+        user: User,
+        storylet_outcome_request: StoryletBranchOutcomeRequest,
+) -> OutcomeSubmitResponse:
+    outcome = record_storylet_outcome(
+        session, user, storylet_outcome_request
+    )
+    if is_bulk(session):
+        # Nothing reads the response, so the outcome can wait for the next
+        # flush to be assigned an ID
+        return OutcomeSubmitResponse(success=True)
+    # Make sure the outcome has been assigned an ID
+    session.flush()
     return OutcomeSubmitResponse(
         success=True,
         outcomeObservationId=outcome.id,
-        newAreaId=outcome.redirect_area_id,
-        newSettingId=outcome.redirect_setting_id,
+        newAreaId=outcome.redirect_area.id if outcome.redirect_area else None,
+        newSettingId=outcome.redirect_setting.id
+        if outcome.redirect_setting else None,
     )
 
 
+def record_storylet_outcome(
+        session: Session,
+        user: User,
+        storylet_outcome_request: StoryletBranchOutcomeRequest,
+) -> OutcomeObservation:
+    """
+    Records an outcome and moves the user to where it leads.
+    """
+    area_id, setting_id = get_location(user, storylet_outcome_request)
+    logging.info(
+        f"{{{user.name}}} Submitting storylet outcome in "
+        f"area {storylet_outcome_request.areaId}/"
+        f"setting {storylet_outcome_request.settingId}"
+    )
+    outcome = record_outcome(
+        user=user,
+        session=session,
+        branch_id=storylet_outcome_request.branchId,
+        outcome_info=storylet_outcome_request.endStorylet,
+        messages=storylet_outcome_request.messages,
+        redirect=storylet_outcome_request.redirect,
+        area_id=area_id,
+        setting_id=setting_id,
+    )
+    if storylet_outcome_request.isLinkingFromOutcomeObservation is not None:
+        # TODO Test this, does it have the branch ID?
+        observation = session.query(OutcomeObservation).get(
+            storylet_outcome_request.isLinkingFromOutcomeObservation
+        )
+        if observation:
+            observation.redirect_outcome = outcome
+    # The redirect IDs of a new outcome are only set once it is flushed
+    new_area_id = outcome.redirect_area.id if outcome.redirect_area else None
+    new_setting_id = outcome.redirect_setting.id \
+        if outcome.redirect_setting else None
+    if new_area_id is not None:
+        user.current_area_id = new_area_id
+    if new_setting_id is not None:
+        user.current_setting_id = new_setting_id
+    return outcome
+
+
+def get_outcome_redirect(
+        storylet_outcome_request: StoryletBranchOutcomeRequest,
+) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Gets the area and setting an outcome moves the player to, without
+    recording it.
+    """
+    area_id = setting_id = None
+    for message_info in storylet_outcome_request.messages or ():
+        if message_info.message is None:
+            continue
+        if message_info.area:
+            area_id = message_info.area.id
+        elif message_info.setting:
+            setting_id = message_info.setting.id
+    return area_id, setting_id
+
+
 def get_location(
         user: User, submit_request
 ) -> Tuple[Optional[int], Optional[int]]:
@@ -201,3 +455,22 @@ def get_location(
         if user.current_setting_id == submit_request.settingId \
         else None
     return area_id, setting_id
+
+
+SUBMIT_HANDLERS: Dict[
+    str,
+    Tuple[
+        Type[SubmitRequest],
+        Callable[[Session, User, SubmitRequest], SubmitResponse]
+    ]
+] = {
+    "possessions": (PossessionsRequest, submit_possessions),
+    "area": (AreaRequest, submit_area),
+    "setting": (SettingRequest, submit_setting),
+    "opportunities": (OpportunitiesRequest, submit_opportunities),
+    "storylet/list": (StoryletListRequest, submit_storylet_list),
+    "storylet/view": (StoryletViewRequest, submit_storylet_view),
+    "storylet/outcome": (
+        StoryletBranchOutcomeRequest, submit_storylet_outcome
+    ),
+}
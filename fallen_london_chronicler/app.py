@@ -5,11 +5,15 @@ from fastapi import FastAPI
 from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 
-from fallen_london_chronicler.api import submit
+from fallen_london_chronicler.api import status, submit
+from fallen_london_chronicler.capture import submission_capture
 from fallen_london_chronicler.config import config
-from fallen_london_chronicler.db import engine, get_session
-from fallen_london_chronicler.images import get_or_cache_image, ImageType
-from fallen_london_chronicler.model import User
+from fallen_london_chronicler.db import setup_db
+from fallen_london_chronicler.export.background import background_exports
+from fallen_london_chronicler.images import get_or_cache_image, \
+    image_cache, ImageType
+from fallen_london_chronicler.ingestion import start_ingestion, \
+    stop_ingestion
 from fallen_london_chronicler.web import setup_web
 
 APP_TITLE = "Fallen London Chronicler"
@@ -17,20 +21,7 @@ APP_TITLE = "Fallen London Chronicler"
 
 def setup_api(api: FastAPI) -> None:
     api.include_router(submit.router, prefix="/api/submit", tags=["submit"])
-
-
-def setup_db():
-    from fallen_london_chronicler import model
-    model.Base.metadata.create_all(engine)
-    # Create a default admin user in case one doesn't exist
-    # The user will not be usable unless config.require_api_key is false
-    with get_session() as session:
-        if not config.require_api_key and not User.get_by_api_key(session, ""):
-            user = User.create(session, "Administrator", True)
-            user.api_key = ""
-            logging.info(
-                "Created default administrator user with empty API key"
-            )
+    api.include_router(status.router, prefix="/api/status", tags=["status"])
 
 
 def setup_monitoring(api: FastAPI) -> None:
@@ -99,5 +90,15 @@ app = create_app()
 @app.on_event("startup")
 def on_startup():
     get_or_cache_image(ImageType.ICON, "question")
+    start_ingestion(submit.SUBMIT_HANDLERS)
+    background_exports.setup()
     if not config.debug:
         webbrowser.open(config.root_url, 2)
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    stop_ingestion()
+    submission_capture.close()
+    image_cache.shutdown()
+    background_exports.shutdown()
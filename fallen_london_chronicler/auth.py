@@ -1,12 +1,87 @@
-from typing import Optional
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
 
 from fallen_london_chronicler.config import config
 from fallen_london_chronicler.db import Session
 from fallen_london_chronicler.model import User
 
+# The maximum number of API keys whose authorization is kept in memory
+AUTH_CACHE_SIZE = 1024
+
+
+@dataclass(frozen=True)
+class AuthorizedUser:
+    id: int
+    name: str
+    is_admin: bool
+    is_active: bool
+
+
+class AuthorizationCache:
+    """
+    Remembers which user, if any, each API key belongs to for a short time.
+
+    Other processes do not see invalidations, so changes made to users
+    through one worker can take up to the TTL to reach the other workers.
+    """
+
+    def __init__(self, ttl: float, max_size: int = AUTH_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[float, Optional[AuthorizedUser]]] = {}
+
+    def get(self, session: Session, api_key: str) -> Optional[AuthorizedUser]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(api_key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+        user = User.get_by_api_key(session, api_key)
+        authorized_user = AuthorizedUser(
+            id=user.id,
+            name=user.name,
+            is_admin=user.is_admin,
+            is_active=user.is_active,
+        ) if user else None
+        if self.ttl > 0:
+            with self._lock:
+                if len(self._entries) >= self.max_size:
+                    self._evict(now)
+                self._entries[api_key] = (now + self.ttl, authorized_user)
+        return authorized_user
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _evict(self, now: float) -> None:
+        self._entries = {
+            api_key: entry
+            for api_key, entry in self._entries.items()
+            if entry[0] > now
+        }
+        if len(self._entries) >= self.max_size:
+            self._entries.clear()
+
+
+authorization_cache = AuthorizationCache(config.auth_cache_ttl)
+
 
 def authorize(session: Session, api_key: str) -> Optional[User]:
     if config.require_api_key and not api_key:
         return None
-    user = User.get_by_api_key(session, api_key)
-    return user if user.is_active else None
+    authorized_user = authorization_cache.get(session, api_key)
+    if not authorized_user or not authorized_user.is_active:
+        return None
+    # Load the user by its primary key, which is cheap, to get its current
+    # location and whether it has been deactivated since it was cached
+    user = session.query(User).get(authorized_user.id)
+    return user if user and user.is_active else None
+
+
+def invalidate_authorizations() -> None:
+    authorization_cache.invalidate()
@@ -0,0 +1,130 @@
+import gzip
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional
+
+from pydantic import BaseModel
+
+from fallen_london_chronicler.config import config
+from fallen_london_chronicler.model import User
+
+CAPTURE_FILE_SUFFIX = ".ndjson.gz"
+
+
+@dataclass
+class CapturedSubmission:
+    time: float
+    endpoint: str
+    user_id: int
+    user_name: str
+    payload: Dict[str, Any]
+    # The ID of the outcome observation the submission recorded, which later
+    # submissions may link from
+    outcome_observation_id: Optional[int] = None
+
+
+class SubmissionCapture:
+    """
+    Appends every validated submission to a compressed NDJSON log.
+
+    Each process writes to its own file, so that workers never interleave
+    partial lines; the files are merged by timestamp when they are read.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file: Optional[IO[str]] = None
+
+    def write(
+            self,
+            endpoint: str,
+            user: User,
+            submit_request: BaseModel,
+            outcome_observation_id: Optional[int] = None,
+    ) -> None:
+        fields = {
+            "time": time.time(),
+            "endpoint": endpoint,
+            "user_id": user.id,
+            "user_name": user.name,
+        }
+        if outcome_observation_id is not None:
+            fields["outcome_observation_id"] = outcome_observation_id
+        header = json.dumps(fields)
+        # The payload is already serialized by pydantic, so it is appended to
+        # the header's JSON object rather than decoded and encoded again
+        payload = submit_request.json(exclude={"apiKey"})
+        line = f'{header[:-1]}, "payload": {payload}}}\n'
+        with self._lock:
+            if self._file is None:
+                self._file = self._open()
+            self._file.write(line)
+            # Flush every record so that a crash loses at most the last one
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _open(self) -> IO[str]:
+        os.makedirs(self.path, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        file_name = \
+            f"submissions-{timestamp}-{os.getpid()}{CAPTURE_FILE_SUFFIX}"
+        return gzip.open(
+            os.path.join(self.path, file_name), "at", encoding="utf-8"
+        )
+
+
+def capture_submission(
+        endpoint: str,
+        user: User,
+        submit_request: BaseModel,
+        outcome_observation_id: Optional[int] = None,
+) -> None:
+    if config.capture_enable:
+        submission_capture.write(
+            endpoint, user, submit_request, outcome_observation_id
+        )
+
+
+def find_capture_files(paths: Iterable[str]) -> List[str]:
+    """
+    Gets the capture files at the given paths, including those inside the
+    given directories.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name)
+                for name in sorted(os.listdir(path))
+                if name.endswith(CAPTURE_FILE_SUFFIX)
+            )
+        else:
+            files.append(path)
+    return files
+
+
+def read_capture_file(file_path: str) -> Iterator[CapturedSubmission]:
+    with gzip.open(file_path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                if not line.endswith("\n"):
+                    # The last record of a file being written or of a
+                    # process which crashed while writing it
+                    break
+                yield CapturedSubmission(**json.loads(line))
+        except EOFError:
+            # The file was not closed properly
+            return
+
+
+submission_capture = SubmissionCapture(config.capture_path)
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Literal, Optional
 
 from pydantic import BaseSettings
 
@@ -13,10 +13,31 @@ class AppConfig(BaseSettings):
     reset_data_enable: bool = True
     require_api_key: bool = False
     session_secret: str = "please_change_me"
+    auth_cache_ttl: float = 60.0
+    html_parser: str = "html.parser"
+    page_cache_size: int = 2048
+
+    ingestion_mode: Literal["direct", "queued"] = "direct"
+    ingestion_queue_path: str = "./ingestion_queue.db"
+    ingestion_batch_size: int = 100
+    ingestion_poll_interval: float = 0.5
+    ingestion_leader_timeout: float = 30.0
+
+    capture_enable: bool = False
+    capture_path: str = "captures"
+
+    image_fetch_workers: int = 4
+    image_fetch_queue_size: int = 1000
+    image_fetch_timeout: float = 10.0
+    image_fetch_retries: int = 3
 
     html_export_enable: bool = True
     html_export_path: str = "export/html"
     html_export_url: str = ""
+    html_export_incremental: bool = True
+    html_export_workers: int = 0
+    html_export_format: str = "directory"
+    html_export_precompress: bool = False
 
     google_docs_export_enable: bool = True
     google_credentials_path: str = "credentials.json"
@@ -24,6 +45,11 @@ class AppConfig(BaseSettings):
     google_docs_template_id: Optional[str] = \
         "1HFak7enwGuiuOiHkX-3lnf-_pgUC7zj0kIZShqhvEUM"
 
+    export_jobs_path: str = "./export_jobs.db"
+    export_jobs_timeout: float = 30.0
+    export_jobs_retained: int = 20
+    export_jobs_results_path: str = "./export_jobs"
+
     sentry_dsn: Optional[str] = None
 
     class Config:
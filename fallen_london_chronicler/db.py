@@ -1,7 +1,8 @@
+import logging
 from contextlib import contextmanager
 from typing import ContextManager
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, Session as BaseSession
 
 from fallen_london_chronicler.config import config
@@ -10,6 +11,18 @@ engine = create_engine(config.db_url)
 Session = sessionmaker(bind=engine, expire_on_commit=False)
 
 
+if engine.dialect.name == "sqlite":
+    # pysqlite only begins a transaction before a data-modifying statement,
+    # so that a SAVEPOINT made beforehand would be the outermost one and
+    # releasing it would commit. Begin the transaction first instead, so that
+    # savepoints nest within the session's transaction.
+    @event.listens_for(engine, "savepoint")
+    def _begin_before_savepoint(connection, name) -> None:
+        dbapi_connection = connection.connection.connection
+        if not dbapi_connection.in_transaction:
+            dbapi_connection.execute("BEGIN")
+
+
 @contextmanager
 def get_session() -> ContextManager[BaseSession]:
     session = Session()
@@ -21,3 +34,23 @@ def get_session() -> ContextManager[BaseSession]:
         raise ex
     finally:
         session.close()
+
+
+def setup_db() -> None:
+    from fallen_london_chronicler import model
+    from fallen_london_chronicler.model.migrations import upgrade_data, \
+        upgrade_schema
+    model.Base.metadata.create_all(engine)
+    upgrade_schema(engine)
+    with get_session() as session:
+        upgrade_data(session)
+    # Create a default admin user in case one doesn't exist
+    # The user will not be usable unless config.require_api_key is false
+    with get_session() as session:
+        if not config.require_api_key \
+                and not model.User.get_by_api_key(session, ""):
+            user = model.User.create(session, "Administrator", True)
+            user.api_key = ""
+            logging.info(
+                "Created default administrator user with empty API key"
+            )
@@ -0,0 +1,188 @@
+"""
+Writes exports into a single zip or gzipped tar archive, as they are rendered.
+
+The archive is written to a stream, which may be a file or the body of a
+response: nothing is written anywhere else, and only the files being written
+are held in memory.
+"""
+import io
+import os
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+from typing import BinaryIO, Callable, Iterator, Optional
+
+from fallen_london_chronicler.export.manifest import walk_files
+from fallen_london_chronicler.export.targets import ExportTarget, \
+    GZIP_EXTENSION, gzip_content, is_compressible
+
+# The media type of each archive format, by file extension
+ARCHIVE_FORMATS = {
+    "zip": "application/zip",
+    "tar.gz": "application/gzip",
+}
+# The size of the chunks in which an archive is streamed
+STREAM_CHUNK_SIZE = 64 * 1024
+# The number of chunks which may be waiting to be streamed before writing the
+# archive blocks
+STREAM_QUEUE_SIZE = 16
+
+
+class ArchiveTarget(ExportTarget):
+    """
+    Adds the files to a zip or gzipped tar archive. In zip archives, each
+    text file is deflated, unless it is also precompressed.
+    """
+
+    def __init__(
+            self, stream: BinaryIO, archive_format: str, precompress: bool
+    ):
+        if archive_format not in ARCHIVE_FORMATS:
+            raise ValueError(f"Unknown archive format: {archive_format}")
+        self.precompress = precompress
+        self._zip: Optional[zipfile.ZipFile] = None
+        self._tar: Optional[tarfile.TarFile] = None
+        if archive_format == "zip":
+            self._zip = zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED)
+        else:
+            self._tar = tarfile.open(fileobj=stream, mode="w|gz")
+
+    def exists(self, name: str) -> bool:
+        return False
+
+    def write(
+            self, name: str, content: bytes, mtime: Optional[float] = None
+    ) -> None:
+        if mtime is None:
+            mtime = time.time()
+        compressible = is_compressible(name)
+        self._add(name, content, mtime, compressible)
+        if self.precompress and compressible:
+            self._add(
+                name + GZIP_EXTENSION, gzip_content(content), mtime, False
+            )
+
+    def copy(self, name: str, source_path: str) -> None:
+        with open(source_path, "rb") as f:
+            content = f.read()
+        self.write(name, content, os.path.getmtime(source_path))
+
+    def close(self) -> None:
+        if self._zip:
+            self._zip.close()
+        if self._tar:
+            self._tar.close()
+
+    def __enter__(self) -> "ArchiveTarget":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _add(
+            self, name: str, content: bytes, mtime: float, deflate: bool
+    ) -> None:
+        if self._zip:
+            info = zipfile.ZipInfo(name, time.localtime(mtime)[:6])
+            info.compress_type = \
+                zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED
+            info.external_attr = 0o644 << 16
+            self._zip.writestr(info, content)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mtime = int(mtime)
+            info.mode = 0o644
+            self._tar.addfile(info, io.BytesIO(content))
+
+
+def write_directory(
+        stream: BinaryIO, archive_format: str, source_dir: str
+) -> None:
+    """
+    Writes the files of a previous export into an archive, as they are.
+    """
+    with ArchiveTarget(stream, archive_format, False) as target:
+        for name, source_path, _ in walk_files(source_dir, ""):
+            target.copy(name, source_path)
+
+
+class StreamClosed(Exception):
+    pass
+
+
+class QueueStream(io.RawIOBase):
+    """
+    A stream which can only be written to, whose content is passed in chunks
+    through a queue, so that another thread can read it as it is written.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.chunks: "queue.Queue[Optional[bytes]]" = \
+            queue.Queue(STREAM_QUEUE_SIZE)
+        self.abandoned = threading.Event()
+        self._buffer = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        self._buffer.extend(data)
+        if len(self._buffer) >= STREAM_CHUNK_SIZE:
+            self._send(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def finish(self) -> None:
+        if self._buffer:
+            self._send(bytes(self._buffer))
+            self._buffer.clear()
+        self._send(None)
+
+    def _send(self, chunk: Optional[bytes]) -> None:
+        # Stop writing if the stream is no longer read, such as when the
+        # client went away
+        while not self.abandoned.is_set():
+            try:
+                self.chunks.put(chunk, timeout=1)
+                return
+            except queue.Full:
+                pass
+        raise StreamClosed()
+
+
+def stream_archive(write: Callable[[BinaryIO], None]) -> Iterator[bytes]:
+    """
+    Writes an archive to a stream in another thread, and yields its content as
+    it is written. Errors while writing are raised once everything written
+    before them was yielded.
+    """
+    stream = QueueStream()
+    errors = []
+
+    def run() -> None:
+        try:
+            write(stream)
+        except StreamClosed:
+            return
+        except Exception as e:
+            errors.append(e)
+        try:
+            stream.finish()
+        except StreamClosed:
+            pass
+
+    threading.Thread(target=run, name="archive-writer", daemon=True).start()
+    try:
+        while True:
+            chunk = stream.chunks.get()
+            if chunk is None:
+                break
+            yield chunk
+        if errors:
+            raise errors[0]
+    finally:
+        stream.abandoned.set()
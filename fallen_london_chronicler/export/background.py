@@ -0,0 +1,364 @@
+"""
+Runs exports in the background, recording their progress.
+
+Exports take minutes, so rather than in the request starting them, they run in
+a thread of the worker which received the request. Their progress is recorded
+in a small SQLite database of its own, so that any worker can report it, and
+so that only one export of each format runs at a time across all workers.
+
+The worker running an export records its progress every second. If it stops
+doing so for longer than the timeout, such as when it was killed, the export
+is considered to have failed and another one may start.
+
+An export may keep what it produced in a directory named after its ID, which
+is deleted along with the export's record once it is no longer retained.
+"""
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, Text, \
+    and_, create_engine, event, exists, func, literal, select
+from sqlalchemy.exc import OperationalError
+
+from fallen_london_chronicler.config import config
+from fallen_london_chronicler.export.base import ExportProgress
+
+EXPORT_FORMAT_HTML = "html"
+EXPORT_FORMAT_GOOGLE_DOCS = "google_docs"
+
+EXPORT_RUNNING = "running"
+EXPORT_SUCCEEDED = "succeeded"
+EXPORT_FAILED = "failed"
+
+# The number of seconds between two records of a running export's progress
+PROGRESS_INTERVAL = 1.0
+
+# Runs an export given its ID and the progress to update, and returns the path
+# or URL of what it produced, if it was kept
+Export = Callable[[str, ExportProgress], Optional[str]]
+
+metadata = MetaData()
+
+export_jobs_table = Table(
+    "export_jobs",
+    metadata,
+    Column("id", String(32), primary_key=True),
+    Column("format", String(31), nullable=False, index=True),
+    Column("owner", String(127), nullable=False),
+    Column("status", String(15), nullable=False),
+    Column("started_at", Float, nullable=False),
+    Column("heartbeat", Float, nullable=False),
+    Column("finished_at", Float),
+    Column("entities", Integer, nullable=False, default=0),
+    Column("total_entities", Integer, nullable=False, default=0),
+    Column("written", Integer, nullable=False, default=0),
+    # The path or URL of what the export produced, once it succeeded
+    Column("result", Text),
+    Column("error", Text),
+)
+
+
+@dataclass
+class ExportJobStatus:
+    id: str
+    format: str
+    status: str
+    elapsed: float
+    entities: int
+    total_entities: int
+    written: int
+    result: Optional[str]
+    error: Optional[str]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class ExportAlreadyRunning(Exception):
+    def __init__(self, export_format: str, job: Optional[ExportJobStatus]):
+        super().__init__(f"An export to {export_format} is already running")
+        self.job = job
+
+
+class BackgroundExports:
+    """
+    Starts exports in a pool of threads, one for each export format, and
+    records their progress.
+    """
+
+    def __init__(
+            self, path: str, results_path: str, timeout: float, retained: int
+    ):
+        self.engine = create_engine(
+            f"sqlite:///{path}", connect_args={"timeout": 30}
+        )
+        event.listen(self.engine, "connect", _set_sqlite_pragmas)
+        self.results_path = results_path
+        self.timeout = timeout
+        self.retained = retained
+        self.owner = \
+            f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def setup(self) -> None:
+        try:
+            metadata.create_all(self.engine)
+        except OperationalError:
+            # Another worker created the tables at the same time
+            metadata.create_all(self.engine)
+        self._executor = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="export"
+        )
+
+    def start(self, export_format: str, export: Export) -> ExportJobStatus:
+        """
+        Starts running the export in the background, unless an export of the
+        same format is already running.
+        """
+        if not self._executor:
+            raise RuntimeError("Background exports are not set up")
+        job = self.claim(export_format)
+        self._executor.submit(self._run_in_background, job.id, export)
+        return job
+
+    def claim(self, export_format: str) -> ExportJobStatus:
+        """
+        Records a new running export, unless an export of the same format is
+        already running; it is then run by the caller, with run.
+        """
+        self.expire()
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        running = export_jobs_table.alias()
+        # Check and insert in a single statement, so that two workers cannot
+        # both start an export
+        result = self.engine.execute(
+            export_jobs_table.insert().from_select(
+                ["id", "format", "owner", "status", "started_at",
+                 "heartbeat", "entities", "total_entities", "written"],
+                select([
+                    literal(job_id), literal(export_format),
+                    literal(self.owner), literal(EXPORT_RUNNING),
+                    literal(now), literal(now),
+                    literal(0), literal(0), literal(0),
+                ]).where(~exists().where(and_(
+                    running.c.format == export_format,
+                    running.c.status == EXPORT_RUNNING,
+                )))
+            )
+        )
+        if result.rowcount != 1:
+            raise ExportAlreadyRunning(
+                export_format, self.get_running(export_format)
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[ExportJobStatus]:
+        self.expire()
+        row = self.engine.execute(
+            select([export_jobs_table])
+            .where(export_jobs_table.c.id == job_id)
+        ).first()
+        return _to_status(row) if row else None
+
+    def get_running(self, export_format: str) -> Optional[ExportJobStatus]:
+        row = self.engine.execute(
+            select([export_jobs_table])
+            .where(export_jobs_table.c.format == export_format)
+            .where(export_jobs_table.c.status == EXPORT_RUNNING)
+        ).first()
+        return _to_status(row) if row else None
+
+    def is_superseded(self, job: ExportJobStatus) -> bool:
+        """
+        Whether a later export of the same format succeeded with the same
+        result, such as by exporting to the same directory again.
+        """
+        finished_at = select([export_jobs_table.c.finished_at]) \
+            .where(export_jobs_table.c.id == job.id) \
+            .as_scalar()
+        return self.engine.execute(
+            select([func.count()])
+            .where(export_jobs_table.c.format == job.format)
+            .where(export_jobs_table.c.status == EXPORT_SUCCEEDED)
+            .where(export_jobs_table.c.result == job.result)
+            .where(export_jobs_table.c.finished_at > finished_at)
+        ).scalar() > 0
+
+    def get_result_dir(self, job_id: str) -> str:
+        """
+        Gets the directory in which an export keeps what it produced, which is
+        deleted along with the export's record.
+        """
+        path = os.path.join(self.results_path, job_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def get_all(self) -> List[ExportJobStatus]:
+        self.expire()
+        return [
+            _to_status(row)
+            for row in self.engine.execute(
+                select([export_jobs_table])
+                .order_by(export_jobs_table.c.started_at.desc())
+            )
+        ]
+
+    def expire(self) -> None:
+        """
+        Fails the running exports whose progress has not been recorded within
+        the timeout, and forgets the oldest finished exports beyond those
+        retained, deleting what they kept.
+        """
+        now = time.time()
+        with self.engine.begin() as connection:
+            connection.execute(
+                export_jobs_table.update()
+                .where(export_jobs_table.c.status == EXPORT_RUNNING)
+                .where(export_jobs_table.c.heartbeat < now - self.timeout)
+                .values(
+                    status=EXPORT_FAILED,
+                    finished_at=now,
+                    error="The export stopped responding",
+                )
+            )
+            retained = select([export_jobs_table.c.id]) \
+                .where(export_jobs_table.c.status != EXPORT_RUNNING) \
+                .order_by(export_jobs_table.c.finished_at.desc()) \
+                .limit(self.retained)
+            forgotten = [
+                row.id
+                for row in connection.execute(
+                    select([export_jobs_table.c.id])
+                    .where(export_jobs_table.c.status != EXPORT_RUNNING)
+                    .where(export_jobs_table.c.id.notin_(retained))
+                )
+            ]
+            if forgotten:
+                connection.execute(
+                    export_jobs_table.delete()
+                    .where(export_jobs_table.c.id.in_(forgotten))
+                )
+        for job_id in forgotten:
+            # Another worker may have deleted it at the same time
+            shutil.rmtree(
+                os.path.join(self.results_path, job_id), ignore_errors=True
+            )
+
+    def shutdown(self) -> None:
+        if self._executor:
+            self._executor.shutdown(wait=False)
+
+    def run(self, job_id: str, export: Export) -> Optional[str]:
+        """
+        Runs a claimed export, recording its progress and result, and raises
+        its error if it failed.
+        """
+        progress = ExportProgress()
+        finished = threading.Event()
+        reporter = threading.Thread(
+            target=self._report,
+            args=(job_id, progress, finished),
+            name="export-progress",
+            daemon=True,
+        )
+        reporter.start()
+        try:
+            result = export(job_id, progress)
+        except Exception as e:
+            self._finish(
+                job_id,
+                progress,
+                finished,
+                reporter,
+                status=EXPORT_FAILED,
+                error=f"{type(e).__name__}: {e}",
+            )
+            raise
+        self._finish(
+            job_id,
+            progress,
+            finished,
+            reporter,
+            status=EXPORT_SUCCEEDED,
+            result=result,
+        )
+        return result
+
+    def _run_in_background(self, job_id: str, export: Export) -> None:
+        try:
+            self.run(job_id, export)
+        except Exception:
+            logging.exception(f"Export {job_id} failed")
+
+    def _finish(
+            self,
+            job_id: str,
+            progress: ExportProgress,
+            finished: threading.Event,
+            reporter: threading.Thread,
+            **values: Any
+    ) -> None:
+        finished.set()
+        reporter.join()
+        self._update(job_id, progress, finished_at=time.time(), **values)
+
+    def _report(
+            self,
+            job_id: str,
+            progress: ExportProgress,
+            finished: threading.Event,
+    ) -> None:
+        while not finished.wait(PROGRESS_INTERVAL):
+            try:
+                self._update(job_id, progress)
+            except Exception:
+                logging.exception(f"Failed to record progress of {job_id}")
+
+    def _update(
+            self, job_id: str, progress: ExportProgress, **values: Any
+    ) -> None:
+        self.engine.execute(
+            export_jobs_table.update()
+            .where(export_jobs_table.c.id == job_id)
+            .where(export_jobs_table.c.owner == self.owner)
+            .values(heartbeat=time.time(), **asdict(progress), **values)
+        )
+
+
+def _to_status(row: Any) -> ExportJobStatus:
+    end = row.finished_at if row.finished_at is not None else time.time()
+    return ExportJobStatus(
+        id=row.id,
+        format=row.format,
+        status=row.status,
+        elapsed=max(end - row.started_at, 0.0),
+        entities=row.entities,
+        total_entities=row.total_entities,
+        written=row.written,
+        result=row.result,
+        error=row.error,
+    )
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    # Let progress be read while it is recorded
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+background_exports = BackgroundExports(
+    config.export_jobs_path,
+    config.export_jobs_results_path,
+    timeout=config.export_jobs_timeout,
+    retained=config.export_jobs_retained,
+)
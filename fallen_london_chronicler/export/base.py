@@ -1,9 +1,22 @@
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
 
 from fallen_london_chronicler.db import Session
 
 
+@dataclass
+class ExportProgress:
+    # The areas and storylets exported so far, and in total if known
+    entities: int = 0
+    total_entities: int = 0
+    # The pages written so far, or the paragraphs of a document once they are
+    # all written at the end
+    written: int = 0
+
+
 class Exporter(ABC):
+    progress: ExportProgress
+
     @abstractmethod
     def export_all(self, session: Session) -> str:  # pragma: no cover
         raise NotImplementedError
@@ -4,13 +4,15 @@ from datetime import datetime
 from typing import Iterable, List, Dict, Tuple, Optional
 
 from bs4 import BeautifulSoup, Tag
-from sqlalchemy.orm import selectinload
 
 from fallen_london_chronicler.db import Session
-from fallen_london_chronicler.export.base import Exporter
+from fallen_london_chronicler.export.base import Exporter, ExportProgress
+from fallen_london_chronicler.export.traversal import get_area_storylet_ids, \
+    iter_areas, iter_storylets
 from fallen_london_chronicler.google_docs import GoogleDocsService, FormattedText, \
     FormattedParagraph, NamedStyle, Alignment, BulletStyle
 from fallen_london_chronicler.images import BASE_IMAGE_URL
+from fallen_london_chronicler.loaders import AREAS_PAGE, FULL_EXPORT
 from fallen_london_chronicler.model import Storylet, Branch, OutcomeObservation, \
     OutcomeMessageType, Area, QualityRequirement
 
@@ -21,11 +23,13 @@ class GoogleDocsExporter(Exporter):
             google_credentials_path: str,
             google_credentials_cache_path: str,
             template_document_id: Optional[str],
+            progress: Optional[ExportProgress] = None,
     ):
         self.service = GoogleDocsService(
             google_credentials_path, google_credentials_cache_path
         )
         self.template_document_id = template_document_id
+        self.progress = progress or ExportProgress()
 
     def export_all(self, session: Session) -> str:
         date_string = datetime.now().strftime('%Y-%m-%d %H:%M')
@@ -36,21 +40,35 @@ class GoogleDocsExporter(Exporter):
             )
         else:
             document_id = self.service.create_document(title)
-        paragraphs = []
-        for area in session.query(Area).options(
-                selectinload(Area.storylets).selectinload(Storylet.branches)
-        ):
-            paragraphs.extend(render_area(area))
-            for storylet in area.storylets:
-                paragraphs.extend(render_storylet(storylet))
-        self.service.insert_text(
+        # Nothing is written to the document until all the paragraphs are
+        # sent in a single update, so only then are they counted as written
+        self.progress.written = self.service.insert_text(
             document_id,
-            paragraphs,
+            render_all(session, self.progress),
             1
         )
         return f"https://docs.google.com/document/d/{document_id}/edit"
 
 
+def render_all(
+        session: Session, progress: Optional[ExportProgress] = None
+) -> Iterable[FormattedParagraph]:
+    if progress is None:
+        progress = ExportProgress()
+    storylet_ids = get_area_storylet_ids(session)
+    progress.entities = 0
+    progress.total_entities = session.query(Area).count() \
+        + sum(len(ids) for ids in storylet_ids.values())
+    for area in iter_areas(session, AREAS_PAGE):
+        yield from render_area(area)
+        progress.entities += 1
+        for storylet in iter_storylets(
+                session, storylet_ids[area.id], FULL_EXPORT
+        ):
+            yield from render_storylet(storylet)
+            progress.entities += 1
+
+
 def render_area(area: Area) -> Iterable[FormattedParagraph]:
     yield FormattedParagraph(
         text_segments=convert_to_formatted_text(
@@ -1,100 +1,567 @@
+import hashlib
+import logging
 import os
 import os.path
 import shutil
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from multiprocessing import get_context
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, \
+    List, Optional, Tuple, Union
 
-from sqlalchemy.orm import selectinload
+from markupsafe import Markup
 from starlette.templating import Jinja2Templates
 
-from area import render_area
-from areas import render_areas
-from branch import render_branch
-from fallen_london_chronicler.db import Session
-from fallen_london_chronicler.export.base import Exporter
+from fallen_london_chronicler.config import config
+from fallen_london_chronicler.db import Session, get_session
+from fallen_london_chronicler.export.archive import ArchiveTarget
+from fallen_london_chronicler.export.base import Exporter, ExportProgress
+from fallen_london_chronicler.export.manifest import ExportManifest, \
+    ExportStats, delete_file, get_content_hash, get_version, sync_files, \
+    walk_files
+from fallen_london_chronicler.export.targets import BufferTarget, \
+    DirectoryTarget, ExportTarget
+from fallen_london_chronicler.export.traversal import \
+    get_area_storylet_ids, iter_areas, iter_storylets
+from fallen_london_chronicler.loaders import AREAS_PAGE, AREA_PAGE, \
+    HTML_EXPORT, get_loader_options
 from fallen_london_chronicler.model import Area, Storylet, Branch
+from fallen_london_chronicler.model.generation import get_generation
 from fallen_london_chronicler.web import STATIC_FILES_PATH, CACHED_IMAGES_PATH
-from storylet import render_storylet
-from templates import make_templates
+from fallen_london_chronicler.web.area import render_area
+from fallen_london_chronicler.web.areas import render_areas
+from fallen_london_chronicler.web.branch import render_branch
+from fallen_london_chronicler.web.storylet import render_storylet
+from fallen_london_chronicler.web.templates import TEMPLATES_DIR, \
+    make_templates
+
+# The maximum number of storylets exported by a single job, either with their
+# branches or listed on the pages of the job's areas
+EXPORT_JOB_SIZE = 200
+# Stands for the ID of the area in the parts of pages shared by all areas
+AREA_ID_PLACEHOLDER = "@@area_id@@"
+
+PagesManifest = Dict[str, Dict[str, str]]
+JobResult = Tuple[PagesManifest, ExportStats, List[Tuple[str, bytes]]]
+
+_templates: Dict[str, Jinja2Templates] = {}
+
+
+@dataclass(frozen=True)
+class ExportContext:
+    # If there is none, the pages are kept in memory and returned by each job
+    export_dir: Optional[str]
+    root_url: str
+    renderer: str
+    precompress: bool = False
+
+
+@dataclass
+class ExportJob:
+    """
+    A part of an export which can be rendered independently: the pages of
+    some areas, or the pages of some storylets and of their branches in each
+    of the areas listing them.
+    """
+    area_ids: List[int] = field(default_factory=list)
+    storylet_areas: Dict[int, List[int]] = field(default_factory=dict)
+
+    @property
+    def entities(self) -> int:
+        return len(self.area_ids) + len(self.storylet_areas)
+
+
+@dataclass(frozen=True)
+class AreaPlaceholder:
+    """
+    Stands for any area in the parts of pages shared by all areas.
+    """
+    id: str = AREA_ID_PLACEHOLDER
+
+    @property
+    def url(self) -> str:
+        return f"/area/{self.id}"
 
 
 class HTMLExporter(Exporter):
-    def __init__(self, export_dir: str, root_url: str):
+    """
+    Exports every page as static HTML.
+
+    In incremental mode, the pages and files written by the previous export
+    into the same directory are recorded in a manifest, and only the pages
+    showing entities whose version changed since are rendered again.
+
+    The pages are rendered by a pool of worker processes, each loading the
+    entities it needs in its own session, unless there is only one worker.
+
+    The export can also be written into a single archive instead, which is
+    always written entirely.
+    """
+
+    def __init__(
+            self,
+            export_dir: str,
+            root_url: str,
+            incremental: bool = True,
+            workers: int = 1,
+            precompress: bool = False,
+            progress: Optional[ExportProgress] = None,
+    ):
         self.export_dir = export_dir
         self.root_url = root_url
+        self.incremental = incremental
+        self.workers = workers
+        self.precompress = precompress
+        self.stats = ExportStats()
+        self.progress = progress or ExportProgress()
 
     def export_all(self, session: Session) -> str:
+        os.makedirs(self.export_dir, exist_ok=True)
+        self.stats = ExportStats()
+        previous = ExportManifest()
+        if self.incremental:
+            previous = ExportManifest.load(self.export_dir)
+        context = ExportContext(
+            export_dir=self.export_dir,
+            root_url=self.root_url,
+            renderer=self.get_renderer(session),
+            precompress=self.precompress,
+        )
+        manifest = ExportManifest(renderer=context.renderer)
+        target = DirectoryTarget(self.export_dir, self.precompress)
+
+        writer = PageWriter(context, target, previous.pages, self.stats)
+        export_areas(session, writer)
+        manifest.pages.update(writer.pages)
+
+        for pages, stats, _ in self.run_jobs(
+                context,
+                get_export_jobs(session),
+                group_pages(session, previous.pages),
+        ):
+            manifest.pages.update(pages)
+            self.stats.add(stats)
+        for name in previous.pages:
+            if name not in manifest.pages:
+                delete_file(self.export_dir, name, self.stats)
+
+        for source_dir, prefix in (
+                (STATIC_FILES_PATH, "static/"),
+                (CACHED_IMAGES_PATH, "images/"),
+        ):
+            if not self.incremental:
+                target_dir = os.path.join(self.export_dir, prefix)
+                if os.path.exists(target_dir):
+                    shutil.rmtree(target_dir)
+            sync_files(
+                source_dir,
+                self.export_dir,
+                prefix,
+                previous,
+                manifest,
+                self.stats,
+                self.precompress,
+            )
+        manifest.save(self.export_dir)
+        logging.info(f"Exported HTML to {self.export_dir}: {self.stats}")
+
+        return self.export_dir
+
+    def export_archive(
+            self, session: Session, stream: BinaryIO, archive_format: str
+    ) -> None:
+        """
+        Writes every page and file into an archive of the given format, as
+        they are rendered.
+        """
+        self.stats = ExportStats()
+        context = ExportContext(
+            export_dir=None,
+            root_url=self.root_url,
+            renderer=self.get_renderer(session),
+            precompress=self.precompress,
+        )
+        with ArchiveTarget(stream, archive_format, self.precompress) \
+                as target:
+            writer = PageWriter(context, target, {}, self.stats)
+            export_areas(session, writer)
+            for _, stats, files in self.run_jobs(
+                    context, get_export_jobs(session), {}, target
+            ):
+                for name, content in files:
+                    target.write(name, content)
+                self.stats.add(stats)
+            for source_dir, prefix in (
+                    (STATIC_FILES_PATH, "static/"),
+                    (CACHED_IMAGES_PATH, "images/"),
+            ):
+                for name, source_path, _ in walk_files(source_dir, prefix):
+                    target.copy(name, source_path)
+                    self.stats.copied += 1
+        logging.info(f"Exported HTML to a {archive_format} archive: "
+                     f"{self.stats}")
+
+    def run_jobs(
+            self,
+            context: ExportContext,
+            jobs: List[ExportJob],
+            previous_pages: Dict[Tuple[str, int], PagesManifest],
+            target: Optional[ExportTarget] = None,
+    ) -> Iterator[JobResult]:
+        """
+        Runs the jobs, yielding their results as they complete. Jobs run in
+        this process write their pages to the target, if any.
+        """
+        self.progress.entities = 0
+        self.progress.total_entities = sum(job.entities for job in jobs)
+        self.progress.written = self.stats.written
+        # Each job only needs to know about the pages it renders
+        job_pages = [
+            {
+                name: page
+                for key in (
+                    *(("area", area_id) for area_id in job.area_ids),
+                    *(("storylet", s_id) for s_id in job.storylet_areas),
+                )
+                for name, page in previous_pages.get(key, {}).items()
+            }
+            for job in jobs
+        ]
+
+        if self.workers <= 1 or len(jobs) <= 1:
+            for job, pages in zip(jobs, job_pages):
+                result = run_export_job(context, job, pages, target)
+                self.record_progress(job, result)
+                yield result
+            return
+        # New processes are started rather than forked, as forking a server
+        # process with running threads is unsafe
+        with ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=get_context("spawn")
+        ) as pool:
+            futures = {
+                pool.submit(run_export_job, context, job, pages): job
+                for job, pages in zip(jobs, job_pages)
+            }
+            for future in as_completed(futures):
+                result = future.result()
+                self.record_progress(futures[future], result)
+                yield result
+
+    def record_progress(self, job: ExportJob, result: JobResult) -> None:
+        _, stats, _ = result
+        self.progress.entities += job.entities
+        self.progress.written += stats.written
+
+    def get_renderer(self, session: Session) -> str:
+        """
+        Identifies what pages are rendered with besides the data they show,
+        including the generation of the data, as versions start over once it
+        is reset.
+        """
+        renderer = hashlib.sha1()
+        renderer.update(
+            f"{config.app_version}\n{self.root_url}\n{self.precompress}\n"
+            f"{get_generation(session)}\n"
+            .encode()
+        )
+        for dir_path, dir_names, file_names in os.walk(TEMPLATES_DIR):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                with open(os.path.join(dir_path, file_name), "rb") as f:
+                    renderer.update(f.read())
+        return renderer.hexdigest()
+
+
+def get_export_jobs(session: Session) -> List[ExportJob]:
+    """
+    Splits the export into jobs of similar sizes, those exporting storylets
+    and branches first as they take longest, so that they finish at about the
+    same time.
+
+    Each storylet is exported by a single job, whatever the number of areas
+    listing it, so that the parts of its pages which are the same in every
+    area are only rendered once.
+    """
+    area_storylet_ids = get_area_storylet_ids(session)
+    storylet_areas: Dict[int, List[int]] = defaultdict(list)
+    for area_id, storylet_ids in sorted(area_storylet_ids.items()):
+        for storylet_id in storylet_ids:
+            storylet_areas[storylet_id].append(area_id)
+    storylet_ids = sorted(storylet_areas)
+    jobs = [
+        ExportJob(storylet_areas={
+            storylet_id: storylet_areas[storylet_id]
+            for storylet_id in storylet_ids[i:i + EXPORT_JOB_SIZE]
+        })
+        for i in range(0, len(storylet_ids), EXPORT_JOB_SIZE)
+    ]
+
+    # Areas are grouped so that their pages list about as many storylets as
+    # a job exports otherwise
+    area_job = ExportJob()
+    listed = 0
+    for area_id, in session.query(Area.id).order_by(Area.id):
+        if area_job.area_ids and \
+                listed + len(area_storylet_ids[area_id]) > EXPORT_JOB_SIZE:
+            jobs.append(area_job)
+            area_job = ExportJob()
+            listed = 0
+        area_job.area_ids.append(area_id)
+        listed += len(area_storylet_ids[area_id])
+    if area_job.area_ids:
+        jobs.append(area_job)
+    return jobs
+
+
+def group_pages(
+        session: Session, pages: PagesManifest
+) -> Dict[Tuple[str, int], PagesManifest]:
+    """
+    Groups the pages by the area or storylet whose job renders them.
+    """
+    branch_storylets = dict(session.query(Branch.id, Branch.storylet_id))
+    grouped: Dict[Tuple[str, int], PagesManifest] = defaultdict(dict)
+    for name, page in pages.items():
+        parts = name.split("/")
+        if len(parts) < 3:
+            continue
+        kind, entity_id = parts[0], int(parts[-2])
+        if kind == "branch":
+            if entity_id not in branch_storylets:
+                continue
+            kind, entity_id = "storylet", branch_storylets[entity_id]
+        grouped[(kind, entity_id)][name] = page
+    return grouped
+
+
+def run_export_job(
+        context: ExportContext,
+        job: ExportJob,
+        previous_pages: PagesManifest,
+        target: Optional[ExportTarget] = None,
+) -> JobResult:
+    """
+    Renders the pages of a job, and returns the manifest of the pages, the
+    stats and the pages themselves if they were kept in memory.
+    """
+    if target is None:
+        if context.export_dir is None:
+            target = BufferTarget()
+        else:
+            target = DirectoryTarget(context.export_dir, context.precompress)
+    stats = ExportStats()
+    writer = PageWriter(context, target, previous_pages, stats)
+    with get_session() as session:
+        areas = {
+            area.id: area
+            for area in session.query(Area).filter(Area.id.in_({
+                area_id
+                for area_ids in job.storylet_areas.values()
+                for area_id in area_ids
+            }))
+        }
+        for storylet in iter_storylets(
+                session, sorted(job.storylet_areas), HTML_EXPORT
+        ):
+            storylet_areas = [
+                areas[area_id] for area_id in job.storylet_areas[storylet.id]
+            ]
+            export_storylet(writer, storylet_areas, storylet)
+            for branch in storylet.branches:
+                export_branch(writer, storylet_areas, branch)
+        for area in iter_areas(session, AREA_PAGE, job.area_ids):
+            export_area(writer, area)
+    files = target.files if isinstance(target, BufferTarget) else []
+    return writer.pages, stats, files
+
+
+def get_templates(root_url: str) -> Jinja2Templates:
+    """
+    Gets the export templates, which are created once in each process.
+    """
+    if root_url not in _templates:
         templates = make_templates()
-        templates.env.globals["root_url"] = self.root_url
+        templates.env.globals["root_url"] = root_url
         templates.env.globals["is_export"] = True
+        _templates[root_url] = templates
+    return _templates[root_url]
 
-        areas = session.query(Area).options(
-            selectinload(Area.storylets).selectinload(Storylet.branches)
-        ).all()
 
-        os.makedirs(self.export_dir, exist_ok=True)
-        index_path = os.path.join(self.export_dir, "index.html")
-        with open(index_path, "w") as f:
-            areas_template = templates.get_template("areas.html")
-            f.write(areas_template.render({**render_areas(areas)}))
-
-        areas_dir = os.path.join(self.export_dir, "area")
-        storylets_dir = os.path.join(self.export_dir, "storylet")
-        branches_dir = os.path.join(self.export_dir, "branch")
-        for area in areas:
-            export_area(templates, areas_dir, area)
-            for storylet in area.storylets:
-                export_storylet(templates, storylets_dir, area, storylet)
-                for branch in storylet.branches:
-                    export_branch(templates, branches_dir, area, branch)
-
-        static_dir = os.path.join(self.export_dir, "static")
-        if os.path.exists(static_dir):
-            shutil.rmtree(static_dir)
-        shutil.copytree(STATIC_FILES_PATH, static_dir)
-
-        images_dir = os.path.join(self.export_dir, "images")
-        if os.path.exists(images_dir):
-            shutil.rmtree(images_dir)
-        shutil.copytree(CACHED_IMAGES_PATH, images_dir)
+class PageWriter:
+    def __init__(
+            self,
+            context: ExportContext,
+            target: ExportTarget,
+            previous_pages: PagesManifest,
+            stats: ExportStats,
+    ):
+        self.templates = get_templates(context.root_url)
+        self.target = target
+        self.previous_pages = previous_pages
+        self.stats = stats
+        self.pages: PagesManifest = {}
+        self.renderer = context.renderer
 
-        return self.export_dir
+    def write(
+            self,
+            name: str,
+            template_file: str,
+            version: str,
+            get_context: Callable[[], Dict[str, Any]],
+    ) -> None:
+        """
+        Renders a page and writes it, unless it is known to be unchanged.
+        """
+        version = f"{self.renderer}:{version}"
+        previous = self.previous_pages.get(name)
+        if previous and previous["version"] == version \
+                and self.target.exists(name):
+            self.pages[name] = previous
+            self.stats.skipped += 1
+            return
+
+        content = self.templates.get_template(template_file) \
+            .render(get_context()) \
+            .encode("utf-8")
+        self.stats.rendered += 1
+        content_hash = get_content_hash(content)
+        if previous and previous["hash"] == content_hash \
+                and self.target.exists(name):
+            self.stats.unchanged += 1
+        else:
+            self.target.write(name, content)
+            self.stats.written += 1
+        self.pages[name] = {"version": version, "hash": content_hash}
 
 
-def export_area(templates: Jinja2Templates, areas_dir: str, area: Area) -> None:
-    area_template = templates.get_template("area.html")
-    area_dir = os.path.join(areas_dir, str(area.id))
-    os.makedirs(area_dir, exist_ok=True)
-    area_path = os.path.join(area_dir, "index.html")
-    with open(area_path, "w") as f:
-        f.write(area_template.render(render_area(area)))
+class SharedFragment:
+    """
+    The part of a storylet's or branch's pages which is the same in every
+    area, rendered at most once, with a placeholder for the area's ID.
+    """
+
+    def __init__(
+            self,
+            writer: PageWriter,
+            template_file: str,
+            get_context: Callable[[], Dict[str, Any]],
+    ):
+        self.writer = writer
+        self.template_file = template_file
+        self.get_context = get_context
+        self.html: Optional[str] = None
+
+    def render(self, area_id: int) -> Markup:
+        if self.html is None:
+            self.html = self.writer.templates \
+                .get_template(self.template_file) \
+                .render(self.get_context())
+        return Markup(self.html.replace(AREA_ID_PLACEHOLDER, str(area_id)))
+
+
+def export_areas(session: Session, writer: PageWriter) -> None:
+    areas = session.query(Area) \
+        .options(*get_loader_options(AREAS_PAGE)) \
+        .all()
+    writer.write(
+        "index.html",
+        "areas.html",
+        get_version(*((a.id, a.version) for a in areas)),
+        lambda: render_areas(areas),
+    )
+
+
+def export_area(writer: PageWriter, area: Area) -> None:
+    writer.write(
+        f"area/{area.id}/index.html",
+        "area.html",
+        get_version(
+            area.version,
+            area.order_version,
+            [(s.id, s.version) for s in area.storylets],
+            [(s.id, s.version) for s in area.settings],
+            get_quality_versions(area.storylets),
+        ),
+        lambda: render_area(area),
+    )
+
+
+def get_quality_versions(
+        entities: Iterable[Union[Storylet, Branch]]
+) -> List[Tuple[int, int]]:
+    """
+    Gets the versions of the qualities the storylets or branches require,
+    whose names their requirements show.
+    """
+    return [
+        (qr.quality.id, qr.quality.version)
+        for entity in entities
+        for qr in entity.quality_requirements
+    ]
+
+
+def get_redirect_versions(branch: Branch) -> List[Tuple[str, int, int]]:
+    """
+    Gets the versions of the storylets, branches and areas the branch's
+    outcomes redirect to, whose names and links its page shows.
+    """
+    return [
+        (type(entity).__name__, entity.id, entity.version)
+        for outcome in branch.outcome_observations
+        for entity in (
+            outcome.redirect, outcome.redirect_branch, outcome.redirect_area
+        )
+        if entity is not None
+    ]
 
 
 def export_storylet(
-        templates: Jinja2Templates,
-        storylets_dir: str,
-        area: Area,
-        storylet: Storylet,
+        writer: PageWriter, areas: List[Area], storylet: Storylet
 ) -> None:
-    storylet_template = templates.get_template("storylet.html")
-    area_storylet_dir = os.path.join(
-        storylets_dir, str(area.id), str(storylet.id)
+    body = SharedFragment(
+        writer,
+        "storylet_body.html",
+        lambda: render_storylet(AreaPlaceholder(), storylet),
     )
-    os.makedirs(area_storylet_dir, exist_ok=True)
-    storylet_path = os.path.join(area_storylet_dir, "index.html")
-    with open(storylet_path, "w") as f:
-        f.write(storylet_template.render(render_storylet(area, storylet)))
+    for area in areas:
+        writer.write(
+            f"storylet/{area.id}/{storylet.id}/index.html",
+            "storylet.html",
+            get_version(
+                area.version,
+                storylet.version,
+                [(b.id, b.version) for b in storylet.branches],
+                get_quality_versions(storylet.branches),
+            ),
+            lambda: {
+                **render_storylet(area, storylet),
+                "body": body.render(area.id),
+            },
+        )
 
 
 def export_branch(
-        templates: Jinja2Templates,
-        branches_dir: str,
-        area: Area,
-        branch: Branch,
-):
-    branch_template = templates.get_template("branch.html")
-    area_branch_dir = os.path.join(
-        branches_dir, str(area.id), str(branch.id)
+        writer: PageWriter, areas: List[Area], branch: Branch
+) -> None:
+    body = SharedFragment(
+        writer,
+        "branch_body.html",
+        lambda: render_branch(AreaPlaceholder(), branch),
     )
-    os.makedirs(area_branch_dir, exist_ok=True)
-    branch_path = os.path.join(area_branch_dir, "index.html")
-    with open(branch_path, "w") as f:
-        f.write(branch_template.render(render_branch(area, branch)))
+    for area in areas:
+        writer.write(
+            f"branch/{area.id}/{branch.id}/index.html",
+            "branch.html",
+            get_version(
+                area.version,
+                branch.version,
+                branch.storylet.version,
+                get_redirect_versions(branch),
+            ),
+            lambda: {
+                **render_branch(area, branch),
+                "body": body.render(area.id),
+            },
+        )
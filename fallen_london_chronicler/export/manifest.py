@@ -0,0 +1,156 @@
+import hashlib
+import json
+import logging
+import os
+import os.path
+import shutil
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, Iterator, Tuple
+
+from fallen_london_chronicler.export.targets import GZIP_EXTENSION, \
+    is_compressible, write_gzipped
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_FORMAT = 1
+
+
+@dataclass
+class ExportManifest:
+    """
+    Records what an export wrote, so that the next export into the same
+    directory only writes what changed.
+
+    Pages are recorded with the version of what they show and the hash of
+    their content, and copied files with their size and modification time.
+    The renderer identifies the templates and settings the pages were
+    rendered with; if it changes, every page is rendered again.
+    """
+    renderer: str = ""
+    pages: Dict[str, Dict[str, str]] = field(default_factory=dict)
+    files: Dict[str, Tuple[int, int]] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, export_dir: str) -> "ExportManifest":
+        path = os.path.join(export_dir, MANIFEST_FILE)
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls()
+        except ValueError:
+            logging.warning(f"Ignoring invalid export manifest {path}")
+            return cls()
+        if data.get("format") != MANIFEST_FORMAT:
+            return cls()
+        return cls(
+            renderer=data["renderer"],
+            pages=data["pages"],
+            files={
+                name: (size, mtime)
+                for name, (size, mtime) in data["files"].items()
+            },
+        )
+
+    def save(self, export_dir: str) -> None:
+        path = os.path.join(export_dir, MANIFEST_FILE)
+        # Replace the manifest atomically, so that an interrupted export never
+        # leaves one which does not match the files
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "format": MANIFEST_FORMAT,
+                "renderer": self.renderer,
+                "pages": self.pages,
+                "files": self.files,
+            }, f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+
+
+@dataclass
+class ExportStats:
+    rendered: int = 0
+    skipped: int = 0
+    written: int = 0
+    unchanged: int = 0
+    copied: int = 0
+    deleted: int = 0
+
+    def add(self, other: "ExportStats") -> None:
+        for stat in fields(self):
+            setattr(
+                self,
+                stat.name,
+                getattr(self, stat.name) + getattr(other, stat.name),
+            )
+
+
+def get_version(*parts: Any) -> str:
+    """
+    Gets a short, stable identifier for the versions of everything a page
+    shows.
+    """
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+
+def get_content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def sync_files(
+        source_dir: str,
+        export_dir: str,
+        prefix: str,
+        previous: ExportManifest,
+        manifest: ExportManifest,
+        stats: ExportStats,
+        precompress: bool = False,
+) -> None:
+    """
+    Copies the files in the source directory to the export directory under the
+    prefix, skipping those which have not changed since the previous export,
+    and deletes those which no longer exist.
+    """
+    for name, source_path, entry in walk_files(source_dir, prefix):
+        target_path = os.path.join(export_dir, name)
+        gzipped = precompress and is_compressible(name)
+        if previous.files.get(name) != entry \
+                or not os.path.exists(target_path) \
+                or gzipped != os.path.exists(target_path + GZIP_EXTENSION):
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            shutil.copy2(source_path, target_path)
+            if is_compressible(name):
+                with open(source_path, "rb") as f:
+                    write_gzipped(target_path, f.read(), precompress)
+            stats.copied += 1
+        manifest.files[name] = entry
+    for name in previous.files:
+        if name.startswith(prefix) and name not in manifest.files:
+            delete_file(export_dir, name, stats)
+
+
+def walk_files(
+        source_dir: str, prefix: str
+) -> Iterator[Tuple[str, str, Tuple[int, int]]]:
+    for dir_path, _, file_names in os.walk(source_dir):
+        for file_name in file_names:
+            source_path = os.path.join(dir_path, file_name)
+            relative_path = os.path.relpath(source_path, source_dir)
+            stat = os.stat(source_path)
+            yield (
+                prefix + relative_path.replace(os.sep, "/"),
+                source_path,
+                (stat.st_size, stat.st_mtime_ns),
+            )
+
+
+def delete_file(export_dir: str, name: str, stats: ExportStats) -> None:
+    path = os.path.join(export_dir, name)
+    try:
+        os.remove(path)
+        stats.deleted += 1
+    except FileNotFoundError:
+        pass
+    # Along with its precompressed copy, if any
+    try:
+        os.remove(path + GZIP_EXTENSION)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,94 @@
+"""
+Where the files of an export are written: a directory, an archive, or memory.
+
+When precompressing, a gzipped copy of each text file is written alongside it,
+named like it with a .gz extension, so that a static host can serve it without
+compressing it on every request.
+"""
+import gzip
+import os
+import os.path
+from abc import ABC, abstractmethod
+from typing import List, Tuple
+
+# The files which are also written gzipped when precompressing; the others,
+# such as images, are already compressed
+COMPRESSIBLE_EXTENSIONS = (".html", ".css", ".js", ".json", ".svg", ".txt")
+GZIP_EXTENSION = ".gz"
+
+
+def is_compressible(name: str) -> bool:
+    return name.endswith(COMPRESSIBLE_EXTENSIONS)
+
+
+def gzip_content(content: bytes) -> bytes:
+    # Without a modification time, the same content is always compressed to
+    # the same bytes
+    return gzip.compress(content, mtime=0)
+
+
+class ExportTarget(ABC):
+    @abstractmethod
+    def exists(self, name: str) -> bool:  # pragma: no cover
+        """
+        Whether the file was written by a previous export, and so can be kept
+        if it has not changed.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def write(self, name: str, content: bytes) -> None:  # pragma: no cover
+        raise NotImplementedError
+
+
+class DirectoryTarget(ExportTarget):
+    def __init__(self, export_dir: str, precompress: bool):
+        self.export_dir = export_dir
+        self.precompress = precompress
+
+    def exists(self, name: str) -> bool:
+        # A page is written again if it was not precompressed as it should be
+        path = os.path.join(self.export_dir, name)
+        if not is_compressible(name):
+            return os.path.exists(path)
+        return os.path.exists(path) and self.precompress \
+            == os.path.exists(path + GZIP_EXTENSION)
+
+    def write(self, name: str, content: bytes) -> None:
+        path = os.path.join(self.export_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
+        write_gzipped(path, content, self.precompress)
+
+
+class BufferTarget(ExportTarget):
+    """
+    Keeps the files in memory, for another process to write them.
+    """
+
+    def __init__(self):
+        self.files: List[Tuple[str, bytes]] = []
+
+    def exists(self, name: str) -> bool:
+        return False
+
+    def write(self, name: str, content: bytes) -> None:
+        self.files.append((name, content))
+
+
+def write_gzipped(path: str, content: bytes, precompress: bool) -> None:
+    """
+    Writes the gzipped copy of a file if precompressing, or deletes the one
+    written by a previous export otherwise.
+    """
+    if not is_compressible(path):
+        return
+    if precompress:
+        with open(path + GZIP_EXTENSION, "wb") as f:
+            f.write(gzip_content(content))
+    else:
+        try:
+            os.remove(path + GZIP_EXTENSION)
+        except FileNotFoundError:
+            pass
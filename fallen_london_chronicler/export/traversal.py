@@ -0,0 +1,109 @@
+"""
+Walks through the world for exports, a chunk of entities at a time.
+
+Loading every area with its storylets and branches at once keeps the whole
+world in memory until the export is done. Instead, the IDs are read first,
+then the entities are loaded a chunk at a time and expunged from the session
+once the caller is done with them, so that memory use depends on the size of
+a chunk rather than of the world.
+
+Exports only read the database: anything changed on an entity is lost when it
+is expunged.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, TypeVar
+
+from sqlalchemy import select
+from sqlalchemy.orm import Query, Session
+
+from fallen_london_chronicler.loaders import get_loader_options
+from fallen_london_chronicler.model import Area, Storylet
+from fallen_london_chronicler.model.secondaries import areas_storylets
+
+# The number of areas or storylets loaded at once
+EXPORT_CHUNK_SIZE = 100
+
+T = TypeVar("T")
+
+
+def get_area_storylet_ids(session: Session) -> Dict[int, List[int]]:
+    """
+    Gets the IDs of the storylets listed in each area, in ID order.
+    """
+    storylet_ids: Dict[int, List[int]] = defaultdict(list)
+    for area_id, storylet_id in session.execute(
+            select([areas_storylets.c.area_id, areas_storylets.c.storylet_id])
+            .order_by(areas_storylets.c.storylet_id)
+    ):
+        storylet_ids[area_id].append(storylet_id)
+    return storylet_ids
+
+
+def iter_areas(
+        session: Session,
+        strategy: str,
+        area_ids: Optional[Sequence[int]] = None,
+        chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> Iterator[Area]:
+    """
+    Loads the areas, or all of them, in order, with the named loader
+    strategy.
+    """
+    if area_ids is None:
+        area_ids = [
+            area_id for area_id, in session.query(Area.id).order_by(Area.id)
+        ]
+    for chunk in chunked(sorted(area_ids), chunk_size):
+        yield from iter_chunk(
+            session,
+            session.query(Area)
+            .options(*get_loader_options(strategy))
+            .filter(Area.id.in_(chunk))
+            .order_by(Area.id),
+        )
+
+
+def iter_storylets(
+        session: Session,
+        storylet_ids: Sequence[int],
+        strategy: str,
+        chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> Iterator[Storylet]:
+    """
+    Loads the storylets in order, with the named loader strategy.
+    """
+    for chunk in chunked(storylet_ids, chunk_size):
+        yield from iter_chunk(
+            session,
+            session.query(Storylet)
+            .options(*get_loader_options(strategy))
+            .filter(Storylet.id.in_(chunk))
+            .order_by(Storylet.id),
+        )
+
+
+def iter_chunk(session: Session, query: Query) -> Iterator[T]:
+    with expunging(session):
+        yield from query.all()
+
+
+@contextmanager
+def expunging(session: Session) -> Iterator[None]:
+    """
+    Expunges every entity loaded into the session within the block, including
+    those loaded lazily through others, so that they can be freed.
+    """
+    previous_keys = set(session.identity_map.keys())
+    try:
+        yield
+    finally:
+        for key, entity in list(session.identity_map.items()):
+            # Entities may already have been expunged along with others
+            if key not in previous_keys and entity in session:
+                session.expunge(entity)
+
+
+def chunked(ids: Sequence[int], chunk_size: int) -> Iterator[Sequence[int]]:
+    for i in range(0, len(ids), chunk_size):
+        yield ids[i:i + chunk_size]
@@ -195,12 +195,18 @@ class GoogleDocsService:
             document_id: str,
             paragraphs: Iterable[FormattedParagraph],
             starting_idx: int
-    ) -> None:
+    ) -> int:
+        """
+        Inserts the paragraphs in a single update, and returns how many there
+        were.
+        """
+        count = 0
         all_content_requests = []
         pre_format_requests = []
         post_format_requests = []
         idx = starting_idx
         for paragraph in paragraphs:
+            count += 1
             paragraph_start_idx = idx
             for text_segment in paragraph.text_segments:
                 idx, content_requests, format_requests = \
@@ -221,6 +227,7 @@ class GoogleDocsService:
                 *reversed(post_format_requests)
             ]
         )
+        return count
 
     def set_document_properties(
             self,
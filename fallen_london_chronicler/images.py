@@ -1,52 +1,175 @@
+import logging
 import os
 import os.path
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from enum import Enum
-from typing import Optional
+from typing import Optional, Set
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from fallen_london_chronicler.config import config
 from fallen_london_chronicler.web import CACHED_IMAGES_PATH
 
 BASE_IMAGE_URL = "https://images.fallenlondon.com"
-HEADERS_URL = f"{BASE_IMAGE_URL}/headers/{{0}}.png"
-ICONS_URL = f"{BASE_IMAGE_URL}/icons/{{0}}.png"
-ICONS_SMALL_URL = f"{BASE_IMAGE_URL}/icons/{{0}}small.png"
 
 
 class ImageType(Enum):
-    HEADER = HEADERS_URL
-    ICON = ICONS_URL
-    ICON_SMALL = ICONS_SMALL_URL
+    HEADER = "/headers/{0}.png"
+    ICON = "/icons/{0}.png"
+    ICON_SMALL = "/icons/{0}small.png"
+
+
+@dataclass
+class ImageCacheStats:
+    hits: int = 0
+    misses: int = 0
+    fetched: int = 0
+    failed: int = 0
+    dropped: int = 0
+    queue_depth: int = 0
+
+
+class ImageCache:
+    """
+    Caches game images on disk, fetching missing ones in the background.
+
+    Lookups never wait on the network: the path of an image is deterministic,
+    so it is returned immediately and the image itself is downloaded by a
+    bounded pool of worker threads sharing a single pooled HTTP session.
+    """
+
+    def __init__(
+            self,
+            cache_dir: str,
+            base_url: str = BASE_IMAGE_URL,
+            workers: int = 4,
+            max_pending: int = 1000,
+            timeout: float = 10.0,
+            retries: int = 3,
+    ):
+        self.cache_dir = cache_dir
+        self.base_url = base_url
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.enabled = True
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=workers,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+            ),
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="image-fetch"
+        )
+        self._lock = threading.Lock()
+        self._pending: Set[str] = set()
+        self._stats = ImageCacheStats()
+
+    def get_or_cache(
+            self, image_type: ImageType, image_id: Optional[str]
+    ) -> Optional[str]:
+        if not image_id:
+            return None
+        path = get_path(image_type, image_id)
+        if not self.enabled:
+            # Nothing would be fetched, so there is no need to check the disk
+            return path
+        if os.path.exists(self.cache_dir + path):
+            with self._lock:
+                self._stats.hits += 1
+            return path
+        with self._lock:
+            self._stats.misses += 1
+            if path in self._pending:
+                return path
+            if len(self._pending) >= self.max_pending:
+                # The image will be requested again the next time it is seen
+                self._stats.dropped += 1
+                return path
+            self._pending.add(path)
+        try:
+            self._executor.submit(self._fetch, path)
+        except RuntimeError:
+            # The executor has been shut down
+            with self._lock:
+                self._pending.discard(path)
+        return path
+
+    def stats(self) -> ImageCacheStats:
+        with self._lock:
+            return ImageCacheStats(
+                hits=self._stats.hits,
+                misses=self._stats.misses,
+                fetched=self._stats.fetched,
+                failed=self._stats.failed,
+                dropped=self._stats.dropped,
+                queue_depth=len(self._pending),
+            )
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._executor.shutdown(wait=wait)
+        self._session.close()
+
+    def _fetch(self, path: str) -> None:
+        try:
+            response = self._session.get(
+                self.base_url + path, timeout=self.timeout
+            )
+            response.raise_for_status()
+            self._write(path, response.content)
+        except (requests.RequestException, OSError) as e:
+            logging.warning(f"Failed to cache image {path}: {e}")
+            with self._lock:
+                self._stats.failed += 1
+        else:
+            with self._lock:
+                self._stats.fetched += 1
+        finally:
+            with self._lock:
+                self._pending.discard(path)
+
+    def _write(self, path: str, content: bytes) -> None:
+        full_path = self.cache_dir + path
+        image_dir = os.path.dirname(full_path)
+        os.makedirs(image_dir, exist_ok=True)
+        # Write to a temporary file first so that a partially downloaded image
+        # is never served
+        fd, tmp_path = tempfile.mkstemp(dir=image_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, full_path)
+        except OSError:
+            os.remove(tmp_path)
+            raise
 
 
 def get_or_cache_image(
         image_type: ImageType, image_id: Optional[str]
 ) -> Optional[str]:
-    if not image_id:
-        return None
-    path = get_path(image_type, image_id)
-    if os.path.exists(path):
-        return path
-    return cache_image(image_type, image_id)
+    return image_cache.get_or_cache(image_type, image_id)
 
 
-def cache_image(image_type: ImageType, image_id: str) -> str:
-    response = requests.get(image_type.value.format(image_id))
-    path = get_path(image_type, image_id)
-    full_path = CACHED_IMAGES_PATH + path
-    image_dir = os.path.dirname(full_path)
-    os.makedirs(image_dir, exist_ok=True)
-    with open(full_path, "wb") as f:
-        f.write(response.content)
-    return path
+def get_path(image_type: ImageType, image_id: str) -> str:
+    return image_type.value.format(image_id)
 
 
-def get_path(image_type: ImageType, image_id: str) -> str:
-    if image_type == ImageType.HEADER:
-        return f"/headers/{image_id}.png"
-    elif image_type == ImageType.ICON:
-        return f"/icons/{image_id}.png"
-    elif image_type == ImageType.ICON_SMALL:
-        return f"/icons/{image_id}small.png"
-    else:
-        raise ValueError(f"Unknown image type: {image_type.value}")
+image_cache = ImageCache(
+    CACHED_IMAGES_PATH,
+    workers=config.image_fetch_workers,
+    max_pending=config.image_fetch_queue_size,
+    timeout=config.image_fetch_timeout,
+    retries=config.image_fetch_retries,
+)
@@ -0,0 +1,493 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, \
+    Type, Union
+
+from pydantic import BaseModel
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, Text, \
+    create_engine, event, func, or_, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from fallen_london_chronicler.config import config
+from fallen_london_chronicler.db import get_session
+from fallen_london_chronicler.model import AppliedSubmission, User
+
+INGESTION_MODE_DIRECT = "direct"
+INGESTION_MODE_QUEUED = "queued"
+
+SubmitHandlers = Dict[
+    str,
+    Tuple[Type[BaseModel], Callable[[Session, User, Any], Any]]
+]
+
+metadata = MetaData()
+
+submissions_table = Table(
+    "submissions",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    # Identifies the submission in the main database once it is applied
+    Column("key", String(32), nullable=False, unique=True),
+    Column("endpoint", String(63), nullable=False),
+    Column("user_id", Integer, nullable=False),
+    Column("payload", Text, nullable=False),
+    Column("received_at", Float, nullable=False),
+    # Set once the submission could not be applied; it is then kept for
+    # inspection but never retried
+    Column("error", Text),
+)
+
+leader_table = Table(
+    "leader",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("owner", String(127)),
+    Column("heartbeat", Float, nullable=False),
+)
+
+
+@dataclass
+class QueuedSubmission:
+    id: int
+    endpoint: str
+    user_id: int
+    # The request as raw JSON, or already decoded
+    payload: Union[str, Dict[str, Any]]
+    received_at: float
+    # Set for submissions from the queue, which are recorded once applied
+    key: Optional[str] = None
+
+
+@dataclass
+class IngestionStats:
+    mode: str
+    is_leader: bool = False
+    queue_depth: int = 0
+    failed: int = 0
+    lag: float = 0.0
+    applied: int = 0
+    rejected: int = 0
+    batches: int = 0
+
+
+class SubmissionQueue:
+    """
+    A durable queue of submissions waiting to be applied to the database.
+
+    The queue is kept in its own SQLite database so that enqueuing a
+    submission only holds its write lock for a single small insert, however
+    long the submission itself takes to apply.
+    """
+
+    def __init__(self, path: str):
+        self.engine = create_engine(
+            f"sqlite:///{path}", connect_args={"timeout": 30}
+        )
+        event.listen(self.engine, "connect", _set_sqlite_pragmas)
+
+    def setup(self) -> None:
+        try:
+            metadata.create_all(self.engine)
+        except OperationalError:
+            # Another worker created the tables at the same time
+            metadata.create_all(self.engine)
+        self.engine.execute(
+            leader_table.insert().prefix_with("OR IGNORE"),
+            id=1, owner=None, heartbeat=0.0,
+        )
+
+    def enqueue(
+            self, items: Iterable[Tuple[str, int, str]]
+    ) -> None:
+        now = time.time()
+        rows = [
+            {
+                "key": uuid.uuid4().hex,
+                "endpoint": endpoint,
+                "user_id": user_id,
+                "payload": payload,
+                "received_at": now,
+            }
+            for endpoint, user_id, payload in items
+        ]
+        if rows:
+            with self.engine.begin() as connection:
+                connection.execute(submissions_table.insert(), rows)
+
+    def fetch(self, limit: int) -> List[QueuedSubmission]:
+        query = (
+            select([submissions_table])
+            .where(submissions_table.c.error.is_(None))
+            .order_by(submissions_table.c.id)
+            .limit(limit)
+        )
+        return [
+            QueuedSubmission(
+                id=row.id,
+                endpoint=row.endpoint,
+                user_id=row.user_id,
+                payload=row.payload,
+                received_at=row.received_at,
+                key=row.key,
+            )
+            for row in self.engine.execute(query)
+        ]
+
+    def complete(
+            self,
+            owner: str,
+            submission_ids: List[int],
+            errors: Dict[int, str],
+    ) -> bool:
+        """
+        Removes applied submissions and marks the ones which failed, unless
+        the owner no longer leads, in which case nothing is changed and False
+        is returned.
+        """
+        with self.engine.begin() as connection:
+            # Updating the leader first holds the write lock, so leadership
+            # cannot change before the submissions are removed
+            if not self._heartbeat(connection, owner):
+                return False
+            applied_ids = [i for i in submission_ids if i not in errors]
+            if applied_ids:
+                connection.execute(
+                    submissions_table.delete()
+                    .where(submissions_table.c.id.in_(applied_ids))
+                )
+            for submission_id, error in errors.items():
+                connection.execute(
+                    submissions_table.update()
+                    .where(submissions_table.c.id == submission_id)
+                    .values(error=error)
+                )
+        return True
+
+    def try_lead(self, owner: str, timeout: float) -> bool:
+        """
+        Becomes or remains the only writer, unless another writer has sent a
+        heartbeat within the timeout.
+        """
+        now = time.time()
+        result = self.engine.execute(
+            leader_table.update()
+            .where(leader_table.c.id == 1)
+            .where(or_(
+                leader_table.c.owner == owner,
+                leader_table.c.owner.is_(None),
+                leader_table.c.heartbeat < now - timeout,
+            ))
+            .values(owner=owner, heartbeat=now)
+        )
+        return result.rowcount == 1
+
+    def heartbeat(self, owner: str) -> bool:
+        """
+        Keeps leading, if the owner still leads.
+        """
+        with self.engine.begin() as connection:
+            return self._heartbeat(connection, owner)
+
+    def _heartbeat(self, connection: Any, owner: str) -> bool:
+        result = connection.execute(
+            leader_table.update()
+            .where(leader_table.c.id == 1)
+            .where(leader_table.c.owner == owner)
+            .values(heartbeat=time.time())
+        )
+        return result.rowcount == 1
+
+    def resign(self, owner: str) -> None:
+        self.engine.execute(
+            leader_table.update()
+            .where(leader_table.c.id == 1)
+            .where(leader_table.c.owner == owner)
+            .values(owner=None, heartbeat=0.0)
+        )
+
+    def stats(self) -> Tuple[int, int, float]:
+        """
+        Gets the number of pending and failed submissions, and how long the
+        oldest pending one has been waiting.
+        """
+        depth, oldest = self.engine.execute(
+            select([
+                func.count(submissions_table.c.id),
+                func.min(submissions_table.c.received_at),
+            ]).where(submissions_table.c.error.is_(None))
+        ).first()
+        failed = self.engine.execute(
+            select([func.count(submissions_table.c.id)])
+            .where(submissions_table.c.error.isnot(None))
+        ).scalar()
+        lag = max(time.time() - oldest, 0.0) if oldest is not None else 0.0
+        return depth, failed, lag
+
+
+class IngestionWriter:
+    """
+    Applies queued submissions in order, in batches sharing a transaction.
+
+    Every worker runs a writer, but only the one which holds the queue's
+    leadership applies submissions; the others take over if it stops sending
+    heartbeats.
+    """
+
+    def __init__(
+            self,
+            queue: SubmissionQueue,
+            handlers: SubmitHandlers,
+            batch_size: int,
+            poll_interval: float,
+            leader_timeout: float,
+    ):
+        self.queue = queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.leader_timeout = leader_timeout
+        self.owner = \
+            f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self.is_leader = False
+        self.applied = self.rejected = self.batches = 0
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="ingestion-writer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+        if self.is_leader:
+            self.queue.resign(self.owner)
+            self.is_leader = False
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                self.is_leader = self.queue.try_lead(
+                    self.owner, self.leader_timeout
+                )
+                submissions = self.queue.fetch(self.batch_size) \
+                    if self.is_leader else []
+                if submissions:
+                    self.apply_batch(submissions)
+                    continue
+            except Exception:
+                logging.exception("Failed to process submission queue")
+            self._stopping.wait(self.poll_interval)
+
+    def apply_batch(self, submissions: List[QueuedSubmission]) -> None:
+        # Keep leading while the batch is applied, however long it takes, so
+        # that no other worker applies the same submissions meanwhile
+        applied = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._send_heartbeats,
+            args=(applied,),
+            name="ingestion-heartbeat",
+            daemon=True,
+        )
+        heartbeat.start()
+        try:
+            errors = apply_submissions(self.handlers, submissions)
+        finally:
+            applied.set()
+            heartbeat.join()
+        if not self.queue.complete(
+                self.owner, [s.id for s in submissions], errors
+        ):
+            # Another worker took over, and skips the submissions which were
+            # recorded as applied
+            logging.warning(
+                f"Lost leadership while applying {len(submissions)} "
+                f"submissions, leaving them to the new leader"
+            )
+            self.is_leader = False
+            return
+        self.applied += len(submissions) - len(errors)
+        self.rejected += len(errors)
+        self.batches += 1
+        forget_applied(submissions)
+
+    def _send_heartbeats(self, applied: threading.Event) -> None:
+        while not applied.wait(self.leader_timeout / 3):
+            try:
+                if not self.queue.heartbeat(self.owner):
+                    return
+            except Exception:
+                logging.exception("Failed to send ingestion heartbeat")
+
+    def stats(self) -> IngestionStats:
+        depth, failed, lag = self.queue.stats()
+        return IngestionStats(
+            mode=INGESTION_MODE_QUEUED,
+            is_leader=self.is_leader,
+            queue_depth=depth,
+            failed=failed,
+            lag=lag,
+            applied=self.applied,
+            rejected=self.rejected,
+            batches=self.batches,
+        )
+
+
+def apply_submissions(
+        handlers: SubmitHandlers, submissions: List[QueuedSubmission]
+) -> Dict[int, str]:
+    """
+    Applies submissions in order in a single transaction, and returns the
+    reason each rejected submission was rejected, by ID.
+
+    If the transaction fails, the submissions are applied again one at a
+    time so that a single bad submission does not reject the others.
+    """
+    try:
+        with get_session() as session:
+            return apply_once(handlers, session, submissions)
+    except Exception:
+        logging.exception(
+            f"Failed to apply batch of {len(submissions)} submissions, "
+            f"applying them one at a time"
+        )
+    errors = {}
+    for submission in submissions:
+        try:
+            with get_session() as session:
+                errors.update(apply_once(handlers, session, [submission]))
+        except Exception as e:
+            logging.exception(f"Failed to apply submission {submission.id}")
+            errors[submission.id] = f"{type(e).__name__}: {e}"
+    return errors
+
+
+def apply_once(
+        handlers: SubmitHandlers,
+        session: Session,
+        submissions: List[QueuedSubmission],
+) -> Dict[int, str]:
+    """
+    Applies the submissions which were not applied yet, recording them in the
+    same transaction, and returns the reason each rejected submission was
+    rejected, by ID.
+
+    A submission stays in the queue until the writer which applied it
+    removes it, so a writer which took over meanwhile would otherwise apply
+    it again.
+    """
+    keys = [s.key for s in submissions if s.key is not None]
+    previous_errors = dict(
+        session.query(AppliedSubmission.key, AppliedSubmission.error)
+        .filter(AppliedSubmission.key.in_(keys))
+    ) if keys else {}
+    errors = {}
+    for submission in submissions:
+        if submission.key in previous_errors:
+            error = previous_errors[submission.key]
+        else:
+            error = apply_submission(handlers, session, submission)
+            if submission.key is not None:
+                session.add(
+                    AppliedSubmission(key=submission.key, error=error)
+                )
+        if error:
+            errors[submission.id] = error
+    return errors
+
+
+def forget_applied(submissions: List[QueuedSubmission]) -> None:
+    """
+    Deletes the records of applied submissions once they have left the
+    queue, and so can no longer be applied again.
+    """
+    keys = [s.key for s in submissions if s.key is not None]
+    with get_session() as session:
+        session.query(AppliedSubmission) \
+            .filter(AppliedSubmission.key.in_(keys)) \
+            .delete(synchronize_session=False)
+
+
+def apply_submission(
+        handlers: SubmitHandlers,
+        session: Session,
+        submission: QueuedSubmission,
+) -> Optional[str]:
+    """
+    Applies a submission and returns the reason it was rejected, if any.
+    """
+    handler = handlers.get(submission.endpoint)
+    if not handler:
+        return f"Unknown endpoint: {submission.endpoint}"
+    user = session.query(User).get(submission.user_id)
+    if not user:
+        return f"Unknown user: {submission.user_id}"
+    request_cls, submit = handler
+    if isinstance(submission.payload, str):
+        submit_request = request_cls.parse_raw(submission.payload)
+    else:
+        submit_request = request_cls.parse_obj(submission.payload)
+    response = submit(session, user, submit_request)
+    return response.error if not response.success else None
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    # Let readers and the writer work concurrently
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+def is_queued() -> bool:
+    return config.ingestion_mode == INGESTION_MODE_QUEUED
+
+
+def enqueue_submissions(
+        items: Iterable[Tuple[str, int, BaseModel]]
+) -> None:
+    """
+    Durably queues validated submissions to be applied by the writer.
+    """
+    submission_queue.enqueue(
+        (endpoint, user_id, request.json(exclude={"apiKey"}))
+        for endpoint, user_id, request in items
+    )
+
+
+def start_ingestion(handlers: SubmitHandlers) -> None:
+    global ingestion_writer
+    if not is_queued():
+        return
+    submission_queue.setup()
+    ingestion_writer = IngestionWriter(
+        submission_queue,
+        handlers,
+        batch_size=config.ingestion_batch_size,
+        poll_interval=config.ingestion_poll_interval,
+        leader_timeout=config.ingestion_leader_timeout,
+    )
+    ingestion_writer.start()
+
+
+def stop_ingestion() -> None:
+    if ingestion_writer:
+        ingestion_writer.stop()
+
+
+def get_ingestion_stats() -> IngestionStats:
+    if not ingestion_writer:
+        return IngestionStats(mode=config.ingestion_mode)
+    return ingestion_writer.stats()
+
+
+submission_queue = SubmissionQueue(config.ingestion_queue_path)
+ingestion_writer: Optional[IngestionWriter] = None
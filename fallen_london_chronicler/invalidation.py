@@ -0,0 +1,297 @@
+"""
+Works out which pages a transaction changed.
+
+The aggregator notes each area, setting, storylet and branch whose shown
+content changed (see model.base.record_change). When the transaction is
+committed, these changes are followed through the relationships between
+entities to every page which shows them, and subscribers are told about these
+pages once the transaction is committed.
+"""
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Set, Tuple
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import ColumnElement
+
+from fallen_london_chronicler.model import Area, Branch, OutcomeObservation, \
+    Setting, Storylet
+from fallen_london_chronicler.model.base import PREFETCH_CHUNK_SIZE, \
+    get_changed_entities
+from fallen_london_chronicler.model.secondaries import areas_settings, \
+    areas_storylets, settings_storylets
+
+# Pages are identified like in the page cache: ("areas",), ("area", area_id),
+# ("storylet", area_id, storylet_id) and ("branch", area_id, branch_id)
+Page = Tuple[Any, ...]
+AREAS_PAGE: Page = ("areas",)
+
+
+@dataclass
+class Invalidation:
+    """
+    The entities changed by a transaction, the settings listing the changed
+    storylets, and the pages showing any of them.
+    """
+    areas: Set[int] = field(default_factory=set)
+    settings: Set[int] = field(default_factory=set)
+    storylets: Set[int] = field(default_factory=set)
+    branches: Set[int] = field(default_factory=set)
+    pages: Set[Page] = field(default_factory=set)
+
+    def __bool__(self) -> bool:
+        return bool(self.pages or self.settings)
+
+
+Subscriber = Callable[[Invalidation], None]
+
+_subscribers: List[Subscriber] = []
+
+
+def subscribe(subscriber: Subscriber) -> None:
+    """
+    Calls the subscriber after each committed transaction which changed any
+    pages. It is called in the thread which committed the transaction, and
+    should not take long.
+    """
+    _subscribers.append(subscriber)
+
+
+def unsubscribe(subscriber: Subscriber) -> None:
+    _subscribers.remove(subscriber)
+
+
+def get_invalidation(session: Session) -> Invalidation:
+    """
+    Gets the pages showing the entities changed so far in the session's
+    transaction, which must have been flushed.
+    """
+    invalidation = Invalidation()
+    changed_ids = {
+        Area: invalidation.areas,
+        Setting: invalidation.settings,
+        Storylet: invalidation.storylets,
+        Branch: invalidation.branches,
+    }
+    for entity_cls, entity_id in get_changed_entities(session):
+        if entity_cls in changed_ids:
+            changed_ids[entity_cls].add(entity_id)
+    pages = invalidation.pages
+
+    # An area's name and image are shown in the areas index and at the top of
+    # each of its pages
+    if invalidation.areas:
+        pages.add(AREAS_PAGE)
+        area_storylets = get_pairs(
+            session, areas_storylets.c.area_id, areas_storylets.c.storylet_id,
+            invalidation.areas,
+        )
+        storylet_branches = get_grouped(
+            session, Branch.storylet_id, Branch.id,
+            {storylet_id for _, storylet_id in area_storylets},
+        )
+        for area_id in invalidation.areas:
+            pages.add(("area", area_id))
+        for area_id, storylet_id in area_storylets:
+            pages.add(("storylet", area_id, storylet_id))
+            for branch_id in storylet_branches.get(storylet_id, ()):
+                pages.add(("branch", area_id, branch_id))
+
+    # Settings group the storylets on their areas' pages
+    for _, area_id in get_pairs(
+            session, areas_settings.c.setting_id, areas_settings.c.area_id,
+            invalidation.settings,
+    ):
+        pages.add(("area", area_id))
+
+    # A storylet is listed on its areas' pages, has its own page in each
+    # area it can be reached from, and is named on the pages of its branches
+    listing_areas = get_grouped(
+        session, areas_storylets.c.storylet_id, areas_storylets.c.area_id,
+        invalidation.storylets,
+    )
+    storylet_areas = get_storylet_areas(session, invalidation.storylets)
+    storylet_branches = get_grouped(
+        session, Branch.storylet_id, Branch.id, invalidation.storylets
+    )
+    for storylet_id in invalidation.storylets:
+        for area_id in listing_areas.get(storylet_id, ()):
+            pages.add(("area", area_id))
+        for area_id in storylet_areas.get(storylet_id, ()):
+            pages.add(("storylet", area_id, storylet_id))
+            for branch_id in storylet_branches.get(storylet_id, ()):
+                pages.add(("branch", area_id, branch_id))
+    invalidation.settings.update(
+        setting_id for _, setting_id in get_pairs(
+            session,
+            settings_storylets.c.storylet_id,
+            settings_storylets.c.setting_id,
+            invalidation.storylets,
+        )
+    )
+
+    # A branch is shown on its storylet's pages and has its own pages, which
+    # link to the storylets and branches its outcomes lead to
+    branch_storylets = get_pairs(
+        session, Branch.id, Branch.storylet_id, invalidation.branches
+    )
+    branch_areas = get_storylet_areas(
+        session, {storylet_id for _, storylet_id in branch_storylets}
+    )
+    for branch_id, storylet_id in branch_storylets:
+        for area_id in branch_areas.get(storylet_id, ()):
+            pages.add(("storylet", area_id, storylet_id))
+            pages.add(("branch", area_id, branch_id))
+    for branch_id, storylet_id, area_id, page in get_redirect_pages(
+            session, invalidation.branches
+    ):
+        if area_id is not None:
+            pages.add((page[0], area_id, page[1]))
+        else:
+            for area_id in branch_areas.get(storylet_id, ()):
+                pages.add((page[0], area_id, page[1]))
+    return invalidation
+
+
+def get_storylet_areas(
+        session: Session, storylet_ids: Set[int]
+) -> Dict[int, Set[int]]:
+    """
+    Gets the areas in which each storylet has a page: those which list it,
+    and those it is reached from by an outcome's redirect.
+    """
+    storylet_areas = get_grouped(
+        session, areas_storylets.c.storylet_id, areas_storylets.c.area_id,
+        storylet_ids,
+    )
+    redirects = []
+    for chunk in chunked(storylet_ids):
+        redirects.extend(session.execute(
+            select([
+                OutcomeObservation.redirect_id,
+                OutcomeObservation.redirect_area_id,
+                Branch.storylet_id,
+            ])
+            .select_from(OutcomeObservation.__table__.join(
+                Branch.__table__, Branch.id == OutcomeObservation.branch_id
+            ))
+            .where(OutcomeObservation.redirect_id.in_(chunk))
+            .distinct()
+        ))
+    # Without an area, a redirect stays in the area of the outcome's branch
+    origin_areas = get_grouped(
+        session, areas_storylets.c.storylet_id, areas_storylets.c.area_id,
+        {
+            storylet_id for _, area_id, storylet_id in redirects
+            if area_id is None and storylet_id is not None
+        },
+    )
+    for redirect_id, area_id, storylet_id in redirects:
+        areas = storylet_areas.setdefault(redirect_id, set())
+        if area_id is not None:
+            areas.add(area_id)
+        else:
+            areas.update(origin_areas.get(storylet_id, ()))
+    return storylet_areas
+
+
+def get_redirect_pages(
+        session: Session, branch_ids: Set[int]
+) -> List[Tuple[int, int, Any, Tuple[str, int]]]:
+    """
+    Gets the storylet and branch pages the branches' outcomes lead to, along
+    with the area they lead to, if it is not the branch's own.
+    """
+    pages = []
+    for chunk in chunked(branch_ids):
+        rows = session.execute(
+            select([
+                OutcomeObservation.branch_id,
+                Branch.storylet_id,
+                OutcomeObservation.redirect_area_id,
+                OutcomeObservation.redirect_id,
+                OutcomeObservation.redirect_branch_id,
+            ])
+            .select_from(OutcomeObservation.__table__.join(
+                Branch.__table__, Branch.id == OutcomeObservation.branch_id
+            ))
+            .where(OutcomeObservation.branch_id.in_(chunk))
+            .where(
+                OutcomeObservation.redirect_id.isnot(None)
+                | OutcomeObservation.redirect_branch_id.isnot(None)
+            )
+            .distinct()
+        )
+        for branch_id, storylet_id, area_id, redirect_id, \
+                redirect_branch_id in rows:
+            if redirect_id is not None:
+                page = ("storylet", redirect_id)
+            else:
+                page = ("branch", redirect_branch_id)
+            pages.append((branch_id, storylet_id, area_id, page))
+    return pages
+
+
+def get_pairs(
+        session: Session,
+        key_column: ColumnElement,
+        value_column: ColumnElement,
+        keys: Iterable[int],
+) -> List[Tuple[int, int]]:
+    pairs = []
+    for chunk in chunked(keys):
+        pairs.extend(
+            tuple(row) for row in session.execute(
+                select([key_column, value_column])
+                .where(key_column.in_(chunk))
+            )
+        )
+    return pairs
+
+
+def get_grouped(
+        session: Session,
+        key_column: ColumnElement,
+        value_column: ColumnElement,
+        keys: Iterable[int],
+) -> Dict[int, Set[int]]:
+    grouped = defaultdict(set)
+    for key, value in get_pairs(session, key_column, value_column, keys):
+        grouped[key].add(value)
+    return grouped
+
+
+def chunked(ids: Iterable[int]) -> Iterable[List[int]]:
+    ids = sorted(ids)
+    for i in range(0, len(ids), PREFETCH_CHUNK_SIZE):
+        yield ids[i:i + PREFETCH_CHUNK_SIZE]
+
+
+@event.listens_for(Session, "before_commit")
+def prepare_invalidation(session: Session) -> None:
+    if not _subscribers or not get_changed_entities(session):
+        return
+    # The relationships added in this transaction must be visible
+    session.flush()
+    session.info["invalidation"] = get_invalidation(session)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def discard_invalidation(session: Session, previous_transaction: Any) -> None:
+    if not previous_transaction.nested:
+        session.info.pop("invalidation", None)
+
+
+@event.listens_for(Session, "after_commit")
+def publish_invalidation(session: Session) -> None:
+    session.info.pop("changed_entities", None)
+    invalidation = session.info.pop("invalidation", None)
+    if not invalidation:
+        return
+    for subscriber in list(_subscribers):
+        try:
+            subscriber(invalidation)
+        except Exception:
+            logging.exception(f"Failed to notify {subscriber} of changes")
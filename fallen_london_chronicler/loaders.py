@@ -0,0 +1,74 @@
+"""
+Loader strategies for the entities shown on each page.
+
+Rendering a page without them loads each relationship it shows one row at a
+time, such as the settings of each storylet on an area's page. The web views
+and the exporters load their entities with the strategy named after what they
+render, so that the number of queries does not depend on the number of
+entities shown.
+
+Quality requirements, challenges, outcome messages and redirects are loaded
+eagerly wherever their entities are, by the models themselves.
+"""
+from typing import Dict, Tuple
+
+from sqlalchemy.orm import Load, selectinload
+
+from fallen_london_chronicler.model import Area, Branch, OutcomeObservation, \
+    Storylet
+
+# Loads the areas with everything the index of areas shows
+AREAS_PAGE = "areas page"
+# Loads an area with everything its page shows
+AREA_PAGE = "area page"
+# Loads a storylet with everything its page shows
+STORYLET_PAGE = "storylet page"
+# Loads a branch with everything its page shows
+BRANCH_PAGE = "branch page"
+# Loads storylets with everything their pages and their branches' pages show
+HTML_EXPORT = "html export"
+# Loads storylets with everything observed of them and of their branches
+FULL_EXPORT = "full export"
+
+
+def get_redirect_loaders() -> Tuple[Load, ...]:
+    """
+    Loads the redirects of the outcomes of storylets' branches. They are
+    loaded eagerly by default, except when reached from a storylet, so that
+    storylets are not loaded recursively.
+    """
+    return tuple(
+        selectinload(Storylet.branches)
+        .selectinload(Branch.outcome_observations)
+        .selectinload(redirect)
+        for redirect in (
+            OutcomeObservation.redirect, OutcomeObservation.redirect_branch
+        )
+    )
+
+
+LOADER_STRATEGIES: Dict[str, Tuple[Load, ...]] = {
+    AREAS_PAGE: (),
+    AREA_PAGE: (
+        selectinload(Area.settings),
+        selectinload(Area.storylets).selectinload(Storylet.settings),
+    ),
+    STORYLET_PAGE: (
+        selectinload(Storylet.branches),
+    ),
+    BRANCH_PAGE: (
+        selectinload(Branch.storylet),
+        selectinload(Branch.outcome_observations)
+        .selectinload(OutcomeObservation.redirect_branch),
+    ),
+    HTML_EXPORT: get_redirect_loaders(),
+    FULL_EXPORT: (
+        selectinload(Storylet.observations),
+        selectinload(Storylet.branches).selectinload(Branch.observations),
+        *get_redirect_loaders(),
+    ),
+}
+
+
+def get_loader_options(strategy: str) -> Tuple[Load, ...]:
+    return LOADER_STRATEGIES[strategy]
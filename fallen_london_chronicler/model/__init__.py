@@ -2,6 +2,7 @@ from .area import Area, AreaType
 from .base import Base
 from .branch import Branch, BranchObservation
 from .challenge import Challenge, ChallengeNature, ChallengeType
+from .generation import data_generation
 from .outcome import OutcomeObservation, OutcomeMessage, OutcomeMessageType
 from .quality import BranchQualityRequirement, Quality, QualityNature, \
     QualityRequirement, StoryletQualityRequirement
@@ -9,5 +10,6 @@ from .setting import Setting
 from .storylet import Storylet, StoryletCategory, \
     StoryletObservation, StoryletDistribution, StoryletFrequency, \
     StoryletUrgency
+from .submission import AppliedSubmission
 from .user import User, UserPossession
 from .utils import record_observation
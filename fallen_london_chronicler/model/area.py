@@ -2,10 +2,10 @@ from __future__ import annotations
 
 from enum import Enum
 
-from sqlalchemy import Column, Enum as EnumType, String, Text
+from sqlalchemy import Column, Enum as EnumType, Integer, String, Text
 from sqlalchemy.orm import relationship
 
-from fallen_london_chronicler.model.base import GameEntity
+from fallen_london_chronicler.model.base import VersionedEntity
 from fallen_london_chronicler.model.secondaries import areas_storylets, areas_settings
 
 
@@ -17,13 +17,17 @@ class AreaType(Enum):
     ROOT = "Root"
 
 
-class Area(GameEntity):
+class Area(VersionedEntity):
     __tablename__ = "areas"
 
     name = Column(String(1023))
     description = Column(Text)
     image = Column(String(1023))
     type = Column(EnumType(AreaType, length=127))
+    # Incremented whenever the order of the area's storylets changes
+    order_version = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
     storylets = relationship(
         "Storylet",
         secondary=areas_storylets,
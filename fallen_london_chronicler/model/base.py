@@ -1,14 +1,28 @@
-from typing import TypeVar, Type, Optional, Any
+import sqlite3
+from typing import TypeVar, Type, Optional, Any, Dict, Iterable, Set, \
+    Tuple
 
-from sqlalchemy import Column, Integer
+from sqlalchemy import Column, Integer, bindparam, event, func, inspect, \
+    or_, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, make_transient_to_detached, \
+    object_session
+from sqlalchemy.orm.attributes import set_committed_value
 
 Base = declarative_base()
 
 
 T = TypeVar("T", bound="GameEntity")
 
+# Maximum number of IDs in a single IN (...) clause, to stay well below
+# SQLite's limit on the number of bound parameters
+PREFETCH_CHUNK_SIZE = 500
+
+# First SQLite version to support INSERT ... ON CONFLICT DO UPDATE
+SQLITE_UPSERT_VERSION = (3, 24, 0)
+
 
 class GameEntity(Base):
     __abstract__ = True
@@ -19,7 +33,90 @@ class GameEntity(Base):
     def get(
             cls: Type[T], session: Session, entity_id: int
     ) -> Optional[T]:
-        return session.query(cls).get(entity_id)
+        cache = get_entity_cache(session)
+        key = (cls, entity_id)
+        if key in cache:
+            return cache[key]
+        obj = session.query(cls).get(entity_id)
+        if obj:
+            cache[key] = obj
+        return obj
+
+    @classmethod
+    def get_many(
+            cls: Type[T], session: Session, entity_ids: Iterable[int]
+    ) -> Dict[int, T]:
+        """
+        Loads the entities with the given IDs in as few queries as possible.
+
+        The result, including which IDs do not exist yet, is kept in the
+        session's entity cache so that later calls to get or get_or_create for
+        these IDs do not query the database again.
+        """
+        cache = get_entity_cache(session)
+        entity_ids = set(entity_ids)
+        missing_ids = sorted(
+            entity_id for entity_id in entity_ids
+            if (cls, entity_id) not in cache
+        )
+        # Entities created in this session are always in the cache, so
+        # pending changes do not need to be flushed in bulk mode, and only
+        # the entities stored before need to be queried
+        autoflush = not is_bulk(session)
+        stored_ids = missing_ids
+        if not autoflush:
+            stored_ids = [
+                entity_id for entity_id in missing_ids
+                if entity_id in get_stored_ids(session, cls)
+            ]
+        for i in range(0, len(stored_ids), PREFETCH_CHUNK_SIZE):
+            chunk = stored_ids[i:i + PREFETCH_CHUNK_SIZE]
+            query = session.query(cls).filter(cls.id.in_(chunk))
+            for obj in query.autoflush(autoflush):
+                cache[(cls, obj.id)] = obj
+        for entity_id in missing_ids:
+            cache.setdefault((cls, entity_id), None)
+        return {
+            entity_id: cache[(cls, entity_id)]
+            for entity_id in entity_ids
+            if cache[(cls, entity_id)] is not None
+        }
+
+    @classmethod
+    def upsert(
+            cls: Type[T], session: Session, entity_id: int, **values: Any
+    ) -> T:
+        """
+        Creates or updates the entity with the given ID and column values.
+
+        Entities which are not already loaded in this session are written
+        with a single INSERT ... ON CONFLICT statement, which is safe against
+        concurrent inserts of the same entity by other workers. In bulk mode,
+        where there are no other writers, they are inserted on flush instead.
+
+        The version of a versioned entity is incremented if any of the values
+        changed.
+        """
+        cache = get_entity_cache(session)
+        obj = cache.get((cls, entity_id))
+        if obj is None and is_bulk(session):
+            obj = _bulk_get_or_add(session, cls, entity_id, values)
+            cache[(cls, entity_id)] = obj
+        elif obj is None:
+            obj, written = _insert_or_update(session, cls, entity_id, values)
+            cache[(cls, entity_id)] = obj
+            if written:
+                # The row already holds the values, and its version was
+                # incremented along with them
+                return obj
+        changed = False
+        for name, value in values.items():
+            if getattr(obj, name) != value:
+                setattr(obj, name, value)
+                changed = True
+        if changed and isinstance(obj, VersionedEntity):
+            obj.increment_version()
+        return obj
 
     @classmethod
     def get_or_create(
@@ -29,4 +126,262 @@ class GameEntity(Base):
         if not obj:
             obj = cls(id=entity_id)
             session.add(obj)
+            get_entity_cache(session)[(cls, entity_id)] = obj
+            record_change(session, obj)
         return obj
+
+
+class VersionedEntity(GameEntity):
+    """
+    A game entity shown on pages which are cached until the entity's version
+    changes.
+    """
+    __abstract__ = True
+
+    # Incremented whenever what is shown of the entity changes
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+
+    def increment_version(self) -> None:
+        if inspect(self).persistent:
+            # Increment in SQL so that concurrent changes are all counted
+            self.version = type(self).version + 1
+        else:
+            self.version = (self.version or 0) + 1
+        session = object_session(self)
+        if session is not None:
+            record_change(session, self)
+
+
+def record_change(session: Session, entity: GameEntity) -> None:
+    """
+    Notes that an entity changed in the session's transaction, so that the
+    pages showing it can be invalidated once it is committed.
+    """
+    session.info.setdefault("changed_entities", set()).add(
+        (type(entity), entity.id)
+    )
+
+
+def get_changed_entities(
+        session: Session
+) -> Set[Tuple[Type[GameEntity], int]]:
+    return session.info.get("changed_entities", set())
+
+
+def _insert_or_update(
+        session: Session,
+        entity_cls: Type[T],
+        entity_id: int,
+        values: Dict[str, Any],
+) -> Tuple[T, bool]:
+    """
+    Atomically inserts or updates an entity's row and returns the entity, and
+    whether the row was written with the values.
+
+    This relies on the database's native upsert where available, as a SELECT
+    followed by an INSERT would race with other workers recording the same
+    entity. Rows are only updated if one of the values differs, in which case
+    the version of a versioned entity is incremented.
+    """
+    table = entity_cls.__table__
+    insert_values = {"id": entity_id, **values}
+    # Column defaults are normally applied by the ORM on insert
+    for column in table.columns:
+        if column.name not in insert_values and column.default is not None \
+                and column.default.is_scalar:
+            insert_values[column.name] = column.default.arg
+
+    is_versioned = issubclass(entity_cls, VersionedEntity)
+
+    dialect = session.bind.dialect
+    if dialect.name == "postgresql":
+        stmt = postgresql.insert(table).values(**insert_values)
+        if values:
+            updates = {name: stmt.excluded[name] for name in values}
+            if is_versioned:
+                updates["version"] = table.c.version + 1
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.id],
+                set_=updates,
+                where=or_(*(
+                    table.c[name].is_distinct_from(stmt.excluded[name])
+                    for name in values
+                )),
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=[table.c.id])
+        changed = session.execute(stmt).rowcount > 0
+    elif dialect.name == "sqlite" \
+            and sqlite3.sqlite_version_info >= SQLITE_UPSERT_VERSION:
+        quote = dialect.identifier_preparer.quote
+        columns = ", ".join(quote(name) for name in insert_values)
+        params = ", ".join(f":{name}" for name in insert_values)
+        if values:
+            updates = [
+                f"{quote(name)} = excluded.{quote(name)}" for name in values
+            ]
+            if is_versioned:
+                updates.append(f"{quote('version')} = {quote('version')} + 1")
+            conflict_action = "UPDATE SET " + ", ".join(updates) \
+                + " WHERE " + " OR ".join(
+                    f"{quote(name)} IS NOT excluded.{quote(name)}"
+                    for name in values
+                )
+        else:
+            conflict_action = "NOTHING"
+        stmt = text(
+            f"INSERT INTO {quote(table.name)} ({columns}) VALUES ({params}) "
+            f"ON CONFLICT ({quote('id')}) DO {conflict_action}"
+        ).bindparams(*(
+            bindparam(name, type_=table.c[name].type)
+            for name in insert_values
+        ))
+        changed = session.execute(stmt, insert_values).rowcount > 0
+    else:
+        obj = session.query(entity_cls).get(entity_id)
+        if obj:
+            return obj, False
+        try:
+            with session.begin_nested():
+                obj = entity_cls(**insert_values)
+                session.add(obj)
+            record_change(session, obj)
+            return obj, True
+        except IntegrityError:
+            # Another worker created the entity first
+            return session.query(entity_cls).get(entity_id), False
+    obj = session.identity_map.get(session.identity_key(entity_cls, entity_id))
+    if obj is None:
+        # The row now holds these values, so there is no need to load it; any
+        # other column is loaded if and when it is accessed
+        obj = entity_cls(id=entity_id, **values)
+        make_transient_to_detached(obj)
+        session.add(obj)
+    else:
+        # The entity was loaded before the row was written
+        for name, value in values.items():
+            set_committed_value(obj, name, value)
+        if changed and is_versioned:
+            session.expire(obj, ["version"])
+    if changed:
+        # The row was inserted, or updated along with its version
+        record_change(session, obj)
+    return obj, True
+
+
+def _bulk_get_or_add(
+        session: Session,
+        entity_cls: Type[T],
+        entity_id: int,
+        values: Dict[str, Any],
+) -> T:
+    obj = None
+    if (entity_cls, entity_id) not in get_entity_cache(session) \
+            and entity_id in get_stored_ids(session, entity_cls):
+        obj = session.query(entity_cls).autoflush(False).get(entity_id)
+    if obj is None:
+        obj = entity_cls(id=entity_id, **values)
+        session.add(obj)
+        record_change(session, obj)
+    return obj
+
+
+def is_bulk(session: Session) -> bool:
+    """
+    Whether the session is the only one writing to the database, and defers
+    writes for as long as possible; see start_bulk.
+    """
+    return session.info.get("bulk", False)
+
+
+def start_bulk(session: Session) -> None:
+    """
+    Switches the session to bulk mode, meant for a single long-lived session
+    recording a large number of submissions while nothing else writes to the
+    database.
+
+    Game entities and observations are kept in memory for the whole session,
+    so that they are only looked up once, and new entities are inserted by the
+    next flush rather than one by one.
+
+    The session is not flushed before loading a relationship or running a
+    query either, as what it looks up was either created by the session, and
+    so is already in memory, or flushed before. Otherwise, most submissions
+    would flush everything recorded since the previous one.
+
+    New rows are given their IDs before being flushed, so that each table's
+    rows are inserted with a single statement rather than one by one to get
+    their generated IDs back.
+    """
+    session.info["bulk"] = True
+    session.info["observations"] = {}
+    session.autoflush = False
+
+
+def get_stored_ids(session: Session, entity_cls: Type[T]) -> Set[int]:
+    """
+    Gets the IDs of the stored entities of the given type, for a session in
+    bulk mode, loading them the first time they are needed.
+
+    Entities stored later were created by the session, and so are in its
+    entity cache. New entities are then not looked up one by one.
+    """
+    stored_ids = session.info.setdefault("stored_ids", {})
+    if entity_cls not in stored_ids:
+        stored_ids[entity_cls] = {
+            entity_id for entity_id, in
+            session.query(entity_cls.id).autoflush(False)
+        }
+    return stored_ids[entity_cls]
+
+
+@event.listens_for(Session, "before_flush")
+def assign_bulk_ids(
+        session: Session, flush_context: Any, instances: Any
+) -> None:
+    if not is_bulk(session):
+        return
+    next_ids = session.info.setdefault("next_ids", {})
+    for obj in session.new:
+        mapper = inspect(obj).mapper
+        if len(mapper.primary_key) != 1:
+            continue
+        column = mapper.primary_key[0]
+        if not isinstance(column.type, Integer) \
+                or mapper.primary_key_from_instance(obj)[0] is not None:
+            continue
+        if column.table not in next_ids:
+            # Nothing else writes to the database in bulk mode, so every ID
+            # after the largest one is free
+            next_ids[column.table] = session.query(
+                func.coalesce(func.max(column), 0)
+            ).scalar() + 1
+        key = mapper.get_property_by_column(column).key
+        setattr(obj, key, next_ids[column.table])
+        next_ids[column.table] += 1
+
+
+def get_entity_cache(
+        session: Session
+) -> Dict[Tuple[Type[GameEntity], int], Optional[GameEntity]]:
+    """
+    Gets the game entities loaded or created by this session, by type and ID.
+
+    Unlike the session's identity map, this also holds entities which have
+    not been flushed yet and IDs which are known not to exist.
+    """
+    return session.info.setdefault("game_entities", {})
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def clear_entity_cache(session: Session, previous_transaction: Any) -> None:
+    # Entities created in the rolled back transaction no longer exist
+    session.info.pop("game_entities", None)
+    session.info.pop("next_ids", None)
+    session.info.pop("stored_ids", None)
+    if "observations" in session.info:
+        session.info["observations"] = {}
+    if not previous_transaction.nested:
+        # Changes rolled back with a savepoint may still have been made before
+        # it, so they are only forgotten along with the whole transaction
+        session.info.pop("changed_entities", None)
@@ -1,31 +1,62 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import List
 
 from sqlalchemy import Integer, Column, ForeignKey, String, DateTime, func, Text
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm.collections import InstrumentedList
 
-from fallen_london_chronicler.model.base import Base, GameEntity
+from fallen_london_chronicler.model.base import Base, VersionedEntity
 from fallen_london_chronicler.model.outcome import OutcomeObservation
-from fallen_london_chronicler.model.utils import latest_observation_property
 
 
-class Branch(GameEntity):
+class Branch(VersionedEntity):
     __tablename__ = "branches"
+    LATEST_OBSERVATION_FIELDS = ("name", "description")
 
     action_cost = Column(Integer, default=0)
     button_text = Column(String(1023), default="Go")
     image = Column(String(1023), nullable=False)
     ordering = Column(Integer, default=0)
 
+    # Copied from the latest observation, so that branches can be listed
+    # without loading their observations
+    name = Column(String(1023))
+    description = Column(Text)
+    latest_observation_id = Column(Integer, ForeignKey(
+        "branches_observations.id",
+        name="fk_branches_latest_observation_id",
+        use_alter=True,
+    ))
+    latest_observation = relationship(
+        "BranchObservation",
+        foreign_keys=latest_observation_id,
+        post_update=True,
+    )
+    challenges = relationship(
+        "Challenge",
+        primaryjoin="foreign(Challenge.branch_observation_id) "
+                    "== Branch.latest_observation_id",
+        order_by="Challenge.id",
+        lazy="selectin",
+        viewonly=True,
+    )
+    quality_requirements = relationship(
+        "BranchQualityRequirement",
+        primaryjoin="foreign(BranchQualityRequirement"
+                    ".branch_observation_id) "
+                    "== Branch.latest_observation_id",
+        order_by="BranchQualityRequirement.id",
+        lazy="selectin",
+        viewonly=True,
+    )
+
     observations: InstrumentedList[BranchObservation] = relationship(
         "BranchObservation",
         back_populates="branch",
-        lazy="selectin",
         cascade="all, delete, delete-orphan",
         order_by="desc(BranchObservation.last_modified)",
+        foreign_keys="BranchObservation.branch_id",
     )
     outcome_observations: InstrumentedList[OutcomeObservation] = relationship(
         "OutcomeObservation",
@@ -46,35 +77,22 @@ class Branch(GameEntity):
     def url(self, area_id: int) -> str:
         return f"/branch/{area_id}/{self.id}"
 
-    @property
-    def name(self) -> str:
-        return latest_observation_property(self.observations, "name")
-
-    @property
-    def description(self) -> str:
-        return latest_observation_property(self.observations, "description")
-
-    @property
-    def challenges(self) -> str:
-        return latest_observation_property(self.observations, "challenges")
-
-    @property
-    def quality_requirements(self) -> List:
-        return latest_observation_property(
-            self.observations, "quality_requirements"
-        )
-
     def __repr__(self) -> str:
         return f"<Branch id={self.id} name={self.name}>"
 
 
 class BranchObservation(Base):
     __tablename__ = "branches_observations"
+    CONTENT_HASH_FIELDS = (
+        "name", "description", "currency_cost", "challenges",
+        "quality_requirements"
+    )
 
     id = Column(Integer, primary_key=True)
     last_modified = Column(
         DateTime, server_default=func.now(), onupdate=datetime.utcnow
     )
+    content_hash = Column(String(64), index=True)
     name = Column(String(1023), nullable=False)
     description = Column(Text, nullable=False)
     currency_cost = Column(Integer, nullable=False)
@@ -92,4 +110,6 @@ class BranchObservation(Base):
         back_populates="branch_observation"
     )
     branch_id = Column(Integer, ForeignKey("branches.id"), nullable=False)
-    branch = relationship("Branch", back_populates="observations")
+    branch = relationship(
+        "Branch", back_populates="observations", foreign_keys=branch_id
+    )
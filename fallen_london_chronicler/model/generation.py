@@ -0,0 +1,42 @@
+import uuid
+from typing import Any, Optional
+
+from sqlalchemy import Column, Integer, String, Table, select
+from sqlalchemy.orm import Session
+
+from fallen_london_chronicler.model.base import Base
+
+# Identifies the data since it was last reset. Versions start over along with
+# the data, so anything cached by version also depends on the generation
+data_generation = Table(
+    "data_generation",
+    Base.metadata,
+    Column("id", Integer, primary_key=True),
+    Column("generation", String(32), nullable=False),
+)
+
+
+def generation_column() -> Any:
+    """
+    Gets the current generation, to be selected along with versions.
+    """
+    return _select_generation().as_scalar()
+
+
+def get_generation(session: Session) -> Optional[str]:
+    return session.execute(_select_generation()).scalar()
+
+
+def _select_generation() -> Any:
+    return select([data_generation.c.generation]) \
+        .where(data_generation.c.id == 1)
+
+
+def start_generation(connection: Any) -> None:
+    """
+    Starts a new generation, once the data was reset.
+    """
+    connection.execute(data_generation.delete())
+    connection.execute(
+        data_generation.insert(), id=1, generation=uuid.uuid4().hex
+    )
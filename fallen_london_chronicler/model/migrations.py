@@ -0,0 +1,120 @@
+import logging
+
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn
+
+from fallen_london_chronicler.model.base import Base
+from fallen_london_chronicler.model.branch import Branch, BranchObservation
+from fallen_london_chronicler.model.outcome import OutcomeObservation
+from fallen_london_chronicler.model.storylet import Storylet, \
+    StoryletObservation
+from fallen_london_chronicler.model.utils import get_content_hash, \
+    set_latest_observation
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def upgrade_schema(engine: Engine) -> None:
+    """
+    Adds the columns and indexes which are missing from existing tables.
+
+    Tables which do not exist yet are left to create_all; this only covers
+    the additions made to existing tables since they were created.
+    """
+    inspector = inspect(engine)
+    table_names = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in table_names:
+            continue
+        column_names = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in column_names:
+                continue
+            logging.info(f"Adding column {table.name}.{column.name}")
+            column_ddl = CreateColumn(column).compile(dialect=engine.dialect)
+            engine.execute(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}")
+        index_names = {i["name"] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in index_names:
+                logging.info(f"Creating index {index.name}")
+                try:
+                    index.create(engine)
+                except IntegrityError as e:
+                    # Existing rows violate a new unique index
+                    logging.error(f"Could not create index {index.name}: {e}")
+
+
+def upgrade_data(session: Session) -> None:
+    """
+    Fills in the values of columns added by upgrade_schema.
+    """
+    for observation_cls in (
+            StoryletObservation, BranchObservation, OutcomeObservation
+    ):
+        backfill_content_hashes(session, observation_cls)
+    backfill_latest_observations(
+        session, Storylet, StoryletObservation.storylet_id
+    )
+    backfill_latest_observations(session, Branch, BranchObservation.branch_id)
+
+
+def backfill_content_hashes(session: Session, observation_cls) -> None:
+    while True:
+        observations = (
+            session.query(observation_cls)
+            .filter(observation_cls.content_hash.is_(None))
+            .limit(BACKFILL_BATCH_SIZE)
+            .all()
+        )
+        if not observations:
+            break
+        logging.info(
+            f"Computing content hashes of {len(observations)} "
+            f"{observation_cls.__name__} rows"
+        )
+        for observation in observations:
+            observation.content_hash = get_content_hash({
+                name: getattr(observation, name)
+                for name in observation_cls.CONTENT_HASH_FIELDS
+            })
+        session.flush()
+
+
+def backfill_latest_observations(
+        session: Session, entity_cls, owner_id_column
+) -> None:
+    observation_cls = owner_id_column.class_
+    last_id = 0
+    while True:
+        entities = (
+            session.query(entity_cls)
+            .filter(entity_cls.latest_observation_id.is_(None))
+            .filter(entity_cls.id > last_id)
+            .order_by(entity_cls.id)
+            .limit(BACKFILL_BATCH_SIZE)
+            .all()
+        )
+        if not entities:
+            break
+        last_id = entities[-1].id
+        latest_observations = {}
+        observations = (
+            session.query(observation_cls)
+            .filter(owner_id_column.in_([entity.id for entity in entities]))
+            .order_by(observation_cls.last_modified, observation_cls.id)
+        )
+        for observation in observations:
+            # Later observations replace earlier ones
+            owner_id = getattr(observation, owner_id_column.key)
+            latest_observations[owner_id] = observation
+        logging.info(
+            f"Setting the latest observations of {len(latest_observations)} "
+            f"{entity_cls.__name__} rows"
+        )
+        for entity in entities:
+            if entity.id in latest_observations:
+                set_latest_observation(entity, latest_observations[entity.id])
+        session.flush()
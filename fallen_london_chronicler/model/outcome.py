@@ -27,11 +27,13 @@ class OutcomeMessageType(Enum):
 
 class OutcomeObservation(Base):
     __tablename__ = "outcome_observations"
+    CONTENT_HASH_FIELDS = ("image", "is_success", "messages")
 
     id = Column(Integer, primary_key=True)
     last_modified = Column(
         DateTime, server_default=func.now(), onupdate=datetime.utcnow
     )
+    content_hash = Column(String(64), index=True)
     name = Column(String(1023))
     description = Column(Text)
     image = Column(String(1023))
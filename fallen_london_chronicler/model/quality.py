@@ -8,7 +8,7 @@ from sqlalchemy import Integer, Column, Enum as EnumType, ForeignKey, String, \
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.orm import relationship
 
-from fallen_london_chronicler.model.base import Base, GameEntity
+from fallen_london_chronicler.model.base import Base, VersionedEntity
 
 
 class QualityNature(Enum):
@@ -16,7 +16,7 @@ class QualityNature(Enum):
     THING = "Thing"
 
 
-class Quality(GameEntity):
+class Quality(VersionedEntity):
     __tablename__ = "qualities"
 
     name = Column(String(1023), nullable=False)
@@ -1,12 +1,12 @@
 from sqlalchemy import String, Column, Boolean
 from sqlalchemy.orm import relationship
 
-from fallen_london_chronicler.model.base import GameEntity
+from fallen_london_chronicler.model.base import VersionedEntity
 from fallen_london_chronicler.model.secondaries import areas_settings, \
     settings_storylets
 
 
-class Setting(GameEntity):
+class Setting(VersionedEntity):
     __tablename__ = "settings"
 
     name = Column(String(1023))
@@ -2,17 +2,14 @@ from __future__ import annotations
 
 from datetime import datetime
 from enum import Enum
-from typing import List
-
 from sqlalchemy import Integer, Column, Enum as EnumType, ForeignKey, Boolean, \
     String, DateTime, func, Table, Text
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm.collections import InstrumentedList
 
-from fallen_london_chronicler.model.base import Base, GameEntity
+from fallen_london_chronicler.model.base import Base, VersionedEntity
 from fallen_london_chronicler.model.secondaries import areas_storylets, \
     settings_storylets
-from fallen_london_chronicler.model.utils import latest_observation_property
 
 storylets_order = Table(
     "storylets_order",
@@ -68,8 +65,9 @@ class StoryletStickiness(Enum):
     STICKY = "Sticky"
 
 
-class Storylet(GameEntity):
+class Storylet(VersionedEntity):
     __tablename__ = "storylets"
+    LATEST_OBSERVATION_FIELDS = ("name", "teaser", "description")
 
     can_go_back = Column(Boolean)
     category = Column(EnumType(StoryletCategory, length=127))
@@ -82,12 +80,37 @@ class Storylet(GameEntity):
     is_card = Column(Boolean, default=False)
     is_top_level = Column(Boolean, default=False)
 
+    # Copied from the latest observation, so that storylets can be listed
+    # without loading their observations
+    name = Column(String(1023))
+    teaser = Column(Text)
+    description = Column(Text)
+    latest_observation_id = Column(Integer, ForeignKey(
+        "storylets_observations.id",
+        name="fk_storylets_latest_observation_id",
+        use_alter=True,
+    ))
+    latest_observation = relationship(
+        "StoryletObservation",
+        foreign_keys=latest_observation_id,
+        post_update=True,
+    )
+    quality_requirements = relationship(
+        "StoryletQualityRequirement",
+        primaryjoin="foreign(StoryletQualityRequirement"
+                    ".storylet_observation_id) "
+                    "== Storylet.latest_observation_id",
+        order_by="StoryletQualityRequirement.id",
+        lazy="selectin",
+        viewonly=True,
+    )
+
     observations: InstrumentedList[StoryletObservation] = relationship(
         "StoryletObservation",
         back_populates="storylet",
         cascade="all, delete, delete-orphan",
-        lazy="selectin",
-        order_by="desc(StoryletObservation.last_modified)"
+        order_by="desc(StoryletObservation.last_modified)",
+        foreign_keys="StoryletObservation.storylet_id",
     )
     outcome_redirects = relationship(
         "OutcomeObservation", back_populates="redirect"
@@ -144,35 +167,19 @@ class Storylet(GameEntity):
             return "purple"
         return "white"
 
-    @property
-    def name(self) -> str:
-        return latest_observation_property(self.observations, "name")
-
-    @property
-    def teaser(self) -> str:
-        return latest_observation_property(self.observations, "teaser")
-
-    @property
-    def description(self) -> str:
-        return latest_observation_property(self.observations, "description")
-
-    @property
-    def quality_requirements(self) -> List:
-        return latest_observation_property(
-            self.observations, "quality_requirements"
-        )
-
     def __repr__(self) -> str:
         return f"<Storylet id={self.id} name={self.name}>"
 
 
 class StoryletObservation(Base):
     __tablename__ = "storylets_observations"
+    CONTENT_HASH_FIELDS = ("name", "teaser", "quality_requirements")
 
     id = Column(Integer, primary_key=True)
     last_modified = Column(
         DateTime, server_default=func.now(), onupdate=datetime.utcnow
     )
+    content_hash = Column(String(64), index=True)
     name = Column(String(1023))
     description = Column(Text)
     teaser = Column(Text)
@@ -184,7 +191,9 @@ class StoryletObservation(Base):
         back_populates="storylet_observation"
     )
     storylet_id = Column(Integer, ForeignKey("storylets.id"))
-    storylet = relationship("Storylet", back_populates="observations")
+    storylet = relationship(
+        "Storylet", back_populates="observations", foreign_keys=storylet_id
+    )
 
     def __repr__(self) -> str:
         quality_requirements = ", ".join(
@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, String, Text
+
+from fallen_london_chronicler.model.base import Base
+
+
+class AppliedSubmission(Base):
+    """
+    A queued submission which was applied, recorded in the same transaction
+    so that no other writer applies it again before it leaves the queue.
+    """
+    __tablename__ = "applied_submissions"
+
+    key = Column(String(32), primary_key=True)
+    # The reason the submission was rejected, if it was
+    error = Column(Text)
+    applied_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self) -> str:
+        return f"<AppliedSubmission key={self.key}>"
@@ -3,11 +3,11 @@ from __future__ import annotations
 import random
 import string
 from dataclasses import dataclass
-from typing import Optional
+from typing import Dict, Optional
 
 from sqlalchemy import Column, Integer, String, ForeignKey, Boolean
 from sqlalchemy.orm import relationship, Session
-from sqlalchemy.orm.collections import InstrumentedList
+from sqlalchemy.orm.collections import attribute_mapped_collection
 
 from fallen_london_chronicler.model import Base, Quality
 
@@ -17,7 +17,7 @@ class User(Base):
 
     id = Column(Integer, primary_key=True)
     name = Column(String(127), nullable=False)
-    api_key = Column(String(127), nullable=False)
+    api_key = Column(String(127), nullable=False, unique=True, index=True)
     is_admin = Column(Boolean, nullable=False, default=False)
     is_active = Column(Boolean, nullable=False, default=True)
 
@@ -25,22 +25,16 @@ class User(Base):
     current_area = relationship("Area")
     current_setting_id = Column(Integer, ForeignKey("settings.id"))
     current_setting = relationship("Setting")
-    possessions: InstrumentedList[UserPossession] = relationship(
+    possessions: Dict[int, UserPossession] = relationship(
         "UserPossession",
-        lazy="selectin",
+        lazy="select",
         back_populates="user",
         cascade="all, delete, delete-orphan",
+        collection_class=attribute_mapped_collection("quality_id"),
     )
 
     def get_possession(self, quality_id: int) -> Optional[UserPossession]:
-        return next(
-            (
-                possession
-                for possession in self.possessions
-                if possession.quality_id == quality_id
-            ),
-            None
-        )
+        return self.possessions.get(quality_id)
 
     @staticmethod
     def get_by_api_key(session: Session, api_key: str) -> Optional[User]:
@@ -1,57 +1,222 @@
+import hashlib
+import json
 from datetime import datetime
-from typing import Any, Iterable, Type, TypeVar, Dict, List
+from enum import Enum
+from typing import Any, Iterable, Type, TypeVar, Dict, List, Set, Tuple
 
 from sqlalchemy import inspect
-from sqlalchemy.orm.collections import InstrumentedList
-
-T = TypeVar("T")
+from sqlalchemy.orm import Session, lazyload
 
+from fallen_london_chronicler.model.base import VersionedEntity
 
-def latest_observation_property(
-        observations: Iterable[Any], attr_name: str
-) -> Any:
-    observation = next((o for o in observations), None)
-    value = None
-    if observation:
-        value = getattr(observation, attr_name, None)
-    return value
+T = TypeVar("T")
 
 
 def record_observation(
-        observations: InstrumentedList,
+        session: Session,
+        owner: Any,
+        relationship_name: str,
         observation_cls: Type[T],
         **values: Any
 ) -> T:
-    for observation in observations:
-        for name, value in values.items():
-            if value is None:
-                continue
+    """
+    Records an observation of the owner, reusing a matching one if it exists.
+
+    An existing observation matches if it has the same content hash, computed
+    over the observation class's CONTENT_HASH_FIELDS, and if every other
+    submitted value is either equal to the observed one or unknown on either
+    side. The owner's version is incremented if an observation is added or
+    filled in.
+
+    A missing value or an empty list (e.g. of quality requirements) is
+    unknown rather than compared, as the game often leaves them out: the
+    observation then matches on its other CONTENT_HASH_FIELDS, and keeps its
+    own values. Only a new observation is hashed with the unknown values.
+    """
+    content_hash = get_content_hash({
+        name: values.get(name) for name in observation_cls.CONTENT_HASH_FIELDS
+    })
+    known_values = {
+        name: values[name] for name in observation_cls.CONTENT_HASH_FIELDS
+        if values.get(name) is not None and values[name] != []
+    }
+    unknown_fields = \
+        set(observation_cls.CONTENT_HASH_FIELDS) - set(known_values)
+    index = session.info.get("observations")
+    indexed = None
+    if index is not None:
+        indexed = get_indexed_observations(
+            session, index, owner, relationship_name, observation_cls
+        )
+        if unknown_fields:
+            candidates = sorted(
+                (o for observations in indexed.values() for o in observations),
+                key=lambda o: o.last_modified or datetime.max,
+                reverse=True,
+            )
+        else:
+            candidates = indexed.get(content_hash, [])
+    else:
+        candidates = (
+            session.query(observation_cls)
+            .options(lazyload("*"))
+            .with_parent(owner, relationship_name)
+            .order_by(observation_cls.last_modified.desc())
+        )
+        if unknown_fields:
+            # Without the full content hash, compare the known columns
+            for name, value in known_values.items():
+                if not isinstance(value, list):
+                    candidates = candidates \
+                        .filter(getattr(observation_cls, name) == value)
+        else:
+            candidates = candidates \
+                .filter(observation_cls.content_hash == content_hash)
+    if unknown_fields:
+        candidates = (
+            o for o in candidates
+            if has_content(o, values, observation_cls, unknown_fields)
+        )
+    other_values = {
+        name: value for name, value in values.items()
+        if value is not None
+        and name not in observation_cls.CONTENT_HASH_FIELDS
+    }
+    for observation in candidates:
+        for name, value in other_values.items():
             observed_value = getattr(observation, name)
-            if observed_value is not None:
-                if isinstance(value, list) and value:
-                    diffable_value = \
-                        get_diffable_observation_relationship_values(value)
-                    diffable_observed_value = \
-                        get_diffable_observation_relationship_values(observed_value)
-                    if diffable_value != diffable_observed_value:
-                        break
-                elif observed_value != value:
-                    break
+            if observed_value is not None and observed_value != value:
+                break
         else:
-            for name, value in values.items():
-                if value is None:
-                    continue
-                setattr(observation, name, value)
+            changed = False
+            for name, value in other_values.items():
+                if getattr(observation, name) != value:
+                    setattr(observation, name, value)
+                    changed = True
+            if changed:
+                increment_version(owner)
             observation.last_modified = datetime.utcnow()
+            if indexed is not None:
+                # Keep the most recently modified observation first
+                observations = indexed[observation.content_hash]
+                observations.remove(observation)
+                observations.insert(0, observation)
             return observation
-    new_observation = observation_cls(**values)
-    observations.append(new_observation)
+    new_observation = observation_cls(content_hash=content_hash, **values)
+    back_populates = \
+        getattr(type(owner), relationship_name).property.back_populates
+    if back_populates:
+        # Setting the owner does not load the owner's other observations,
+        # unlike appending to them
+        setattr(new_observation, back_populates, owner)
+    else:
+        getattr(owner, relationship_name).append(new_observation)
+    if indexed is not None:
+        indexed.setdefault(content_hash, []).insert(0, new_observation)
+    increment_version(owner)
     return new_observation
 
 
-def get_diffable_observation_relationship_values(
-        values: Iterable[Any]
-) -> List[Dict[str, Any]]:
+def has_content(
+        observation: Any,
+        values: Dict[str, Any],
+        observation_cls: Type[T],
+        unknown_fields: Set[str],
+) -> bool:
+    """
+    Whether the observation has the submitted values of the known
+    CONTENT_HASH_FIELDS, as a matching content hash would imply.
+    """
+    for name in observation_cls.CONTENT_HASH_FIELDS:
+        if name in unknown_fields:
+            continue
+        value = values.get(name)
+        observed_value = getattr(observation, name)
+        if isinstance(value, list):
+            if get_diffable_values(value) \
+                    != get_diffable_values(observed_value):
+                return False
+        elif observed_value != value:
+            return False
+    return True
+
+
+def set_latest_observation(owner: Any, observation: Any) -> None:
+    """
+    Copies the values of the owner's most recent observation to the owner.
+    """
+    changed = False
+    if observation.id is None \
+            or observation.id != owner.latest_observation_id:
+        owner.latest_observation = observation
+        changed = True
+    for name in owner.LATEST_OBSERVATION_FIELDS:
+        value = getattr(observation, name)
+        if getattr(owner, name) != value:
+            setattr(owner, name, value)
+            changed = True
+    if changed:
+        increment_version(owner)
+
+
+def increment_version(entity: Any) -> None:
+    if isinstance(entity, VersionedEntity):
+        entity.increment_version()
+
+
+def get_indexed_observations(
+        session: Session,
+        index: Dict[Tuple[Any, str], Dict[str, List[Any]]],
+        owner: Any,
+        relationship_name: str,
+        observation_cls: Type[T],
+) -> Dict[str, List[T]]:
+    """
+    Gets the owner's observations by content hash, most recently modified
+    first, loading them the first time they are needed.
+
+    The index is used by sessions in bulk mode, in which observations are not
+    flushed after each submission and so cannot be queried.
+    """
+    key = (owner, relationship_name)
+    if key not in index:
+        observations = {}
+        if inspect(owner).persistent:
+            query = (
+                session.query(observation_cls)
+                .options(lazyload("*"))
+                .with_parent(owner, relationship_name)
+                .order_by(observation_cls.last_modified.desc())
+            )
+            for observation in query:
+                observations.setdefault(
+                    observation.content_hash, []
+                ).append(observation)
+        index[key] = observations
+    return index[key]
+
+
+def get_content_hash(values: Dict[str, Any]) -> str:
+    """
+    Gets a canonical hash of the given observation values.
+
+    Lists of related objects (e.g. quality requirements) are hashed through
+    their diffable values, in order.
+    """
+    canonical_values = {
+        name: get_diffable_values(value) if isinstance(value, list) else value
+        for name, value in values.items()
+    }
+    content = json.dumps(
+        canonical_values,
+        sort_keys=True,
+        separators=(",", ":"),
+        default=_json_default,
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def get_diffable_values(values: Iterable[Any]) -> List[Dict[str, Any]]:
     """
     Gets a diffable list of dictionaries which excludes observation-specific
     values.
@@ -61,15 +226,21 @@ def get_diffable_observation_relationship_values(
     """
     return [
         {
-            attr.key: attr.value for attr in inspect(v).attrs
+            attr.key: getattr(v, attr.key)
+            for attr in inspect(v).mapper.column_attrs
             if attr.key != "id"
-            and not attr.key.endswith("_observation")
             and not attr.key.endswith("_observation_id")
         }
         for v in values
     ]
 
 
+def _json_default(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"Cannot hash value of type {type(value).__name__}")
+
+
 def pairwise(iterable: Iterable[T]) -> Iterable[T]:
     it = iter(iterable)
     a = next(it, None)
@@ -0,0 +1,156 @@
+import heapq
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, \
+    Tuple
+
+from sqlalchemy import and_, select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import alias
+
+from fallen_london_chronicler.model import Area
+from fallen_london_chronicler.model.generation import get_generation
+from fallen_london_chronicler.model.secondaries import areas_storylets
+from fallen_london_chronicler.model.storylet import storylets_order
+
+# The maximum number of areas whose storylet order is kept in memory
+STORYLET_ORDER_CACHE_SIZE = 1024
+
+
+def topological_order(
+        node_ids: Sequence[int], edges: Iterable[Tuple[int, int]]
+) -> List[int]:
+    """
+    Orders nodes so that each one comes before the nodes it has an edge to.
+
+    Nodes which are not constrained relative to each other keep their order
+    in node_ids. When the remaining nodes form a cycle, the first of them is
+    placed as if its remaining incoming edges did not exist.
+    """
+    positions = {node_id: i for i, node_id in enumerate(node_ids)}
+    successors: Dict[int, List[int]] = {node_id: [] for node_id in node_ids}
+    in_degrees = {node_id: 0 for node_id in node_ids}
+    for before_id, after_id in edges:
+        if before_id in positions and after_id in positions \
+                and before_id != after_id:
+            successors[before_id].append(after_id)
+            in_degrees[after_id] += 1
+
+    ready = [positions[n] for n in node_ids if in_degrees[n] == 0]
+    heapq.heapify(ready)
+    ordered: List[int] = []
+    placed = [False] * len(node_ids)
+    next_unplaced = 0
+    while len(ordered) < len(node_ids):
+        if not ready:
+            while placed[next_unplaced]:
+                next_unplaced += 1
+            logging.debug(
+                f"Breaking storylet order cycle at {node_ids[next_unplaced]}"
+            )
+            in_degrees[node_ids[next_unplaced]] = 0
+            ready.append(next_unplaced)
+        position = heapq.heappop(ready)
+        if placed[position]:
+            continue
+        placed[position] = True
+        node_id = node_ids[position]
+        ordered.append(node_id)
+        for successor_id in successors[node_id]:
+            in_degrees[successor_id] -= 1
+            if in_degrees[successor_id] == 0:
+                heapq.heappush(ready, positions[successor_id])
+    return ordered
+
+
+class StoryletOrderCache:
+    """
+    Remembers the order of each area's storylets.
+
+    An entry is only used if the generation of the data, the area's order
+    version and its storylets are unchanged, so that it is never stale, even
+    when another process recorded the change.
+    """
+
+    def __init__(self, max_size: int = STORYLET_ORDER_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[
+            int, Tuple[Optional[str], int, FrozenSet[int], List[int]]
+        ] = OrderedDict()
+
+    def get_order(self, session: Session, area: Area) -> List[int]:
+        """
+        Gets the IDs of the area's storylets, in display order.
+        """
+        storylet_ids = [storylet.id for storylet in area.storylets]
+        key = (
+            get_generation(session),
+            area.order_version,
+            frozenset(storylet_ids),
+        )
+        with self._lock:
+            entry = self._entries.get(area.id)
+            if entry is not None and entry[:3] == key:
+                self._entries.move_to_end(area.id)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        # Ties are broken by ID, so that the order does not depend on the
+        # order in which the storylets happen to be loaded
+        order = topological_order(
+            sorted(storylet_ids), get_area_order_edges(session, area.id)
+        )
+        with self._lock:
+            self._entries[area.id] = (*key, order)
+            self._entries.move_to_end(area.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return order
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def get_area_order_edges(
+        session: Session, area_id: int
+) -> List[Tuple[int, int]]:
+    """
+    Gets the order constraints between the storylets of an area.
+    """
+    before_areas = alias(areas_storylets)
+    after_areas = alias(areas_storylets)
+    query = (
+        select([storylets_order.c.before_id, storylets_order.c.after_id])
+        .select_from(
+            storylets_order
+            .join(before_areas, and_(
+                before_areas.c.storylet_id == storylets_order.c.before_id,
+                before_areas.c.area_id == area_id,
+            ))
+            .join(after_areas, and_(
+                after_areas.c.storylet_id == storylets_order.c.after_id,
+                after_areas.c.area_id == area_id,
+            ))
+        )
+    )
+    return [tuple(row) for row in session.execute(query)]
+
+
+def get_storylet_order_cache_stats() -> Dict[str, float]:
+    return storylet_order_cache.stats()
+
+
+storylet_order_cache = StoryletOrderCache()
@@ -0,0 +1,306 @@
+"""
+Rebuilds the database from captured submissions.
+
+The submissions are applied to the database configured by DB_URL, which
+should normally be a new one, in the order in which they were received.
+
+Submissions which link from an outcome refer to it by the ID it had in the
+original database. The link is followed to the outcome replayed in its place,
+and dropped if that outcome was not replayed or its ID was not captured.
+"""
+import argparse
+import gzip
+import heapq
+import logging
+import logging.config
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+
+from fallen_london_chronicler.api.submit import SUBMIT_HANDLERS, \
+    record_storylet_outcome, submit_storylet_view
+from fallen_london_chronicler.capture import CapturedSubmission, \
+    find_capture_files, read_capture_file
+from fallen_london_chronicler.config import config
+from fallen_london_chronicler.db import get_session, setup_db
+from fallen_london_chronicler.images import image_cache
+from fallen_london_chronicler.ingestion import QueuedSubmission, \
+    SubmitHandlers, apply_submission, apply_submissions
+from fallen_london_chronicler.log import LOGGING_CONFIG
+from fallen_london_chronicler.model import OutcomeObservation, User
+from fallen_london_chronicler.model.base import start_bulk
+from fallen_london_chronicler.schema import StoryletBranchOutcomeRequest, \
+    StoryletViewRequest, SubmitResponse
+
+
+class ReplayedOutcomeRequest(StoryletBranchOutcomeRequest):
+    # The ID the outcome was recorded with when the submission was captured
+    capturedOutcomeObservationId: Optional[int] = None
+
+
+@dataclass
+class ReplayStats:
+    total: int = 0
+    applied: int = 0
+    rejected: int = 0
+
+
+class Replay:
+    """
+    Applies captured submissions in batches, each in its own transaction.
+
+    In bulk mode, all the submissions are instead recorded by a single
+    session which keeps every entity it has seen in memory, is flushed every
+    flush_interval submissions and is only committed once at the end. This is
+    much faster, but any error aborts the whole replay.
+    """
+
+    def __init__(
+            self,
+            batch_size: int,
+            progress_interval: float,
+            bulk: bool = False,
+            flush_interval: int = 1000,
+    ):
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+        self.bulk = bulk
+        self.flush_interval = flush_interval
+        self.stats = ReplayStats()
+        self._known_user_ids: Set[int] = set()
+        # The replayed outcomes, by the IDs they were captured with
+        self._outcomes: Dict[int, OutcomeObservation] = {}
+        self.handlers: SubmitHandlers = {
+            **SUBMIT_HANDLERS,
+            "storylet/view": (StoryletViewRequest, self.submit_storylet_view),
+            "storylet/outcome": (
+                ReplayedOutcomeRequest, self.submit_storylet_outcome
+            ),
+        }
+        self._start = self._last_progress = time.monotonic()
+
+    def run(self, files: List[str]) -> ReplayStats:
+        self.stats.total = sum(count_records(f) for f in files)
+        logging.info(
+            f"Replaying {self.stats.total} submissions from "
+            f"{len(files)} files"
+        )
+        self._start = self._last_progress = time.monotonic()
+        # Each file is already in order, so merging them by time restores
+        # the order in which the submissions were received
+        records = heapq.merge(
+            *(read_capture_file(f) for f in files), key=lambda r: r.time
+        )
+        if self.bulk:
+            self.run_bulk(records)
+        else:
+            self.run_batches(records)
+        self.report_progress()
+        return self.stats
+
+    def run_batches(self, records: Iterable[CapturedSubmission]) -> None:
+        batch = []
+        for submission in self.to_submissions(records):
+            batch.append(submission)
+            if len(batch) >= self.batch_size:
+                errors = apply_submissions(self.handlers, batch)
+                self.record_results(len(batch), errors)
+                batch = []
+        if batch:
+            errors = apply_submissions(self.handlers, batch)
+            self.record_results(len(batch), errors)
+
+    def run_bulk(self, records: Iterable[CapturedSubmission]) -> None:
+        with get_session() as session:
+            start_bulk(session)
+            submissions = self.to_submissions(records, session)
+            for i, submission in enumerate(submissions, 1):
+                error = apply_submission(
+                    self.handlers, session, submission
+                )
+                self.record_results(
+                    1, {submission.id: error} if error else {}
+                )
+                if i % self.flush_interval == 0:
+                    session.flush()
+            logging.info("Committing replayed submissions")
+
+    def to_submissions(
+            self,
+            records: Iterable[CapturedSubmission],
+            session: Optional[Session] = None,
+    ) -> Iterator[QueuedSubmission]:
+        """
+        Creates the users who made the submissions as they are first seen, so
+        that each user's location is tracked separately as it was originally.
+        """
+        for i, record in enumerate(records):
+            if record.user_id not in self._known_user_ids:
+                if session:
+                    self.ensure_user(session, record)
+                else:
+                    with get_session() as user_session:
+                        self.ensure_user(user_session, record)
+                self._known_user_ids.add(record.user_id)
+            payload = record.payload
+            if record.outcome_observation_id is not None:
+                payload = {
+                    **payload,
+                    "capturedOutcomeObservationId":
+                        record.outcome_observation_id,
+                }
+            yield QueuedSubmission(
+                id=i,
+                endpoint=record.endpoint,
+                user_id=record.user_id,
+                payload=payload,
+                received_at=record.time,
+            )
+
+    def submit_storylet_view(
+            self,
+            session: Session,
+            user: User,
+            storylet_view_request: StoryletViewRequest,
+    ) -> SubmitResponse:
+        storylet_view_request.isLinkingFromOutcomeObservation = \
+            self.follow_link(
+                session, storylet_view_request.isLinkingFromOutcomeObservation
+            )
+        return submit_storylet_view(session, user, storylet_view_request)
+
+    def submit_storylet_outcome(
+            self,
+            session: Session,
+            user: User,
+            storylet_outcome_request: ReplayedOutcomeRequest,
+    ) -> SubmitResponse:
+        storylet_outcome_request.isLinkingFromOutcomeObservation = \
+            self.follow_link(
+                session,
+                storylet_outcome_request.isLinkingFromOutcomeObservation,
+            )
+        outcome = record_storylet_outcome(
+            session, user, storylet_outcome_request
+        )
+        captured_id = storylet_outcome_request.capturedOutcomeObservationId
+        if captured_id is not None:
+            self._outcomes[captured_id] = outcome
+        return SubmitResponse(success=True)
+
+    def follow_link(
+            self, session: Session, outcome_id: Optional[int]
+    ) -> Optional[int]:
+        """
+        Gets the ID of the replayed outcome which was captured with the given
+        ID, if any.
+        """
+        if outcome_id is None:
+            return None
+        outcome = self._outcomes.get(outcome_id)
+        if outcome is None or inspect(outcome).transient:
+            # Not replayed, or rolled back along with its batch
+            return None
+        if outcome.id is None:
+            # Recorded in bulk mode since the last flush
+            session.flush()
+        return outcome.id
+
+    @staticmethod
+    def ensure_user(session: Session, record: CapturedSubmission) -> None:
+        if not session.query(User).get(record.user_id):
+            user = User.create(session, record.user_name, False)
+            user.id = record.user_id
+            logging.info(f"Created user {user.name} ({user.id})")
+
+    def record_results(self, count: int, errors: Dict[int, str]) -> None:
+        for submission_id, error in errors.items():
+            logging.warning(f"Submission {submission_id} rejected: {error}")
+        self.stats.applied += count - len(errors)
+        self.stats.rejected += len(errors)
+        if time.monotonic() - self._last_progress >= self.progress_interval:
+            self.report_progress()
+
+    def report_progress(self) -> None:
+        self._last_progress = time.monotonic()
+        done = self.stats.applied + self.stats.rejected
+        elapsed = self._last_progress - self._start
+        rate = done / elapsed if elapsed else 0.0
+        percentage = done / self.stats.total * 100 if self.stats.total else 100
+        logging.info(
+            f"Replayed {done}/{self.stats.total} submissions "
+            f"({percentage:.1f}%, {rate:.0f}/s), "
+            f"{self.stats.rejected} rejected"
+        )
+
+
+def count_records(file_path: str) -> int:
+    count = 0
+    with gzip.open(file_path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                if line.endswith("\n"):
+                    count += 1
+        except EOFError:
+            pass
+    return count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        default=[config.capture_path],
+        help="Capture files or directories containing them (default: "
+             "CAPTURE_PATH)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=500,
+        help="The number of submissions applied in each transaction",
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=5.0,
+        help="The number of seconds between progress reports",
+    )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Record all the submissions in a single transaction, which is "
+             "much faster but stops at the first error",
+    )
+    parser.add_argument(
+        "--flush-interval",
+        type=int,
+        default=1000,
+        help="The number of submissions between flushes in bulk mode",
+    )
+    args = parser.parse_args()
+
+    logging.config.dictConfig(LOGGING_CONFIG)
+    files = find_capture_files(args.paths)
+    if not files:
+        parser.error("No capture files found")
+    setup_db()
+    # The images are fetched by the server the next time they are seen
+    image_cache.enabled = False
+    try:
+        Replay(
+            args.batch_size,
+            args.progress_interval,
+            bulk=args.bulk,
+            flush_interval=args.flush_interval,
+        ).run(files)
+    finally:
+        image_cache.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import logging
+from functools import lru_cache
+from typing import Dict, Optional
+
+from bs4 import BeautifulSoup, FeatureNotFound
+
+from fallen_london_chronicler.config import config
+
+# The number of distinct texts whose normalized HTML is kept in memory
+HTML_CACHE_SIZE = 4096
+
+DEFAULT_HTML_PARSER = "html.parser"
+
+# Characters without which a text cannot contain any markup or entities, and
+# is therefore already normalized
+MARKUP_CHARACTERS = frozenset("<>&")
+
+
+def get_html_parser(name: str) -> str:
+    """
+    Gets the BeautifulSoup parser to use, falling back to the built-in one if
+    the configured parser is not installed.
+    """
+    try:
+        BeautifulSoup("", name)
+    except FeatureNotFound:
+        logging.warning(
+            f"HTML parser {name} is not installed, "
+            f"using {DEFAULT_HTML_PARSER} instead"
+        )
+        return DEFAULT_HTML_PARSER
+    return name
+
+
+HTML_PARSER = get_html_parser(config.html_parser)
+
+
+def normalize_html(text: Optional[str]) -> Optional[str]:
+    """
+    Normalizes HTML submitted by the game so that the same markup is always
+    stored the same way.
+    """
+    if text is None:
+        return None
+    if MARKUP_CHARACTERS.isdisjoint(text):
+        return text
+    return _normalize_markup(text)
+
+
+@lru_cache(maxsize=HTML_CACHE_SIZE)
+def _normalize_markup(text: str) -> str:
+    soup = BeautifulSoup(text, HTML_PARSER)
+    if HTML_PARSER != DEFAULT_HTML_PARSER and soup.body is not None:
+        # Other parsers wrap fragments in a full document
+        return soup.body.decode_contents()
+    return str(soup)
+
+
+def get_html_cache_stats() -> Dict[str, float]:
+    info = _normalize_markup.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "max_size": info.maxsize,
+        "hit_rate": info.hits / lookups if lookups else 0.0,
+    }
@@ -1,8 +1,10 @@
 from .area import AreaInfo
 from .misc import ChallengeInfo, QualityRequirementInfo
-from .requests import AreaRequest, PossessionsRequest, StoryletListRequest, \
-    SettingRequest, StoryletBranchOutcomeRequest, StoryletViewRequest
-from .response import OutcomeSubmitResponse, SubmitResponse
+from .requests import AreaRequest, BatchSubmitRequest, PossessionsRequest, \
+    StoryletListRequest, SettingRequest, StoryletBranchOutcomeRequest, \
+    StoryletViewRequest
+from .response import BatchSubmitResponse, OutcomeSubmitResponse, \
+    SubmitResponse
 from .storylet import StoryletInfo, BranchInfo, \
     StoryletBranchOutcomeInfo, StoryletBranchOutcomeMessageInfo, \
     PossessionInfo
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel
 
@@ -56,3 +56,11 @@ class StoryletBranchOutcomeRequest(SubmitRequest):
     isLinkingFromOutcomeObservation: Optional[int] = None
     redirect: Optional[StoryletInfo]
 
+
+class BatchSubmitItem(BaseModel):
+    endpoint: str
+    data: Dict[str, Any]
+
+
+class BatchSubmitRequest(SubmitRequest):
+    items: List[BatchSubmitItem]
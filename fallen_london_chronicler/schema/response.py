@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 
 from pydantic.main import BaseModel
 
@@ -12,3 +12,7 @@ class OutcomeSubmitResponse(SubmitResponse):
     outcomeObservationId: Optional[int] = None
     newAreaId: Optional[int] = None
     newSettingId: Optional[int] = None
+
+
+class BatchSubmitResponse(SubmitResponse):
+    results: List[SubmitResponse] = []
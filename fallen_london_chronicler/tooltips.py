@@ -0,0 +1,255 @@
+import re
+from dataclasses import dataclass
+from enum import Enum
+from functools import lru_cache
+from re import Pattern
+from typing import Dict, Iterable, Optional, Tuple
+
+# The number of distinct tooltips whose parsed requirement is kept in memory;
+# the game only has a few thousand distinct tooltips in practice
+TOOLTIP_CACHE_SIZE = 8192
+
+TOOLTIPS_NONE = (
+    re.compile(
+        r"^You unlocked this by not having any "
+        r"<span class='quality-name'>(?P<quality>.+)</span>$"
+    ),
+    re.compile(
+        r"^You can't do this when you have "
+        r"<span class='quality-name'>(?P<quality>.+)</span>$"
+    ),
+    re.compile(
+        r"^Unlocked when you do not have "
+        r"<span class='quality-name'>(?P<quality>.+)</span>$"
+    ),
+    re.compile(
+        r"^You unlocked this by having no "
+        r"<span class='quality-name'>(?P<quality>.+)</span>$"
+    )
+)
+TOOLTIPS_AT_LEAST_ONE = (
+    re.compile(
+        r"^You need (?:an? )?<span class='quality-name'>(?P<quality>.+)</span>$"
+    ),
+    re.compile(
+        r"^Unlocked when you have <span class='quality-name'>(?P<quality>.+)"
+        r"</span>$"
+    ),
+    re.compile(
+        r"^You need to be <span class='quality-name'>(?P<quality>.+)</span> "
+        r"someone$"
+    ),
+    re.compile(
+        r"^You unlocked this with (?:an? )?"
+        r"<span class='quality-name'>(?P<quality>.+)</span>\s*"
+        r"<em>\s*\(you have (?P<current>\d+) in all\)\s*</em>$"
+    ),
+    re.compile(
+        r"^You can't do this when you have any "
+        r"<span class='quality-name'>(?P<quality>.+)</span>$"
+    ),
+    re.compile(r"^You must be (?P<quality>.+)\.$"),
+    re.compile(r"^This is unlocked because you have the (?P<quality>.+)\.$")
+)
+TOOLTIPS_MINIMUM = (
+    re.compile(
+        r"^You unlocked this with "
+        r"<span class='quality-name'>(?P<quality>.+)</span> (?P<current>\d+)\s*"
+        r"<em>\s*\(you needed (?P<quantity_min>\d+)\)\s*</em>$"
+    ),
+    re.compile(
+        r"^You unlocked this with (?P<current>\d+) "
+        r"<span class='quality-name'>(?P<quality>.+)</span>\s*"
+        r"<em>\s*\(you needed (?P<quantity_min>\d+)\)\s*</em>$"
+    ),
+    re.compile(
+        r"^You need <span class='quality-name'>(?P<quality>.+)</span>\s*"
+        r"(?P<quantity_min>\d+)<em>\s*\(you have (?P<current>\d+)\)\s*</em>$"
+    ),
+    re.compile(
+        r"^You need (?P<quantity_min>\d+) "
+        r"<span class='quality-name'>(?P<quality>.+)</span>\s*"
+        r"<em>\s*\(you have (?P<current>\d+)\)\s*</em>$"
+    ),
+    re.compile(
+        r"^You need (?P<quantity_min>\d+) "
+        r"<span class='quality-name'>(?P<quality>.+)</span>$"
+    ),
+    re.compile(
+        r"^You need <span class='quality-name'>(?P<quality>.+)</span> "
+        r"(?P<quantity_min>\d+)$"
+    ),
+)
+TOOLTIPS_MAXIMUM = (
+    re.compile(
+        r"^You can't do this when you have <span class='quality-name'>"
+        r"(?P<quality>.+)</span> higher than (?P<quantity_max>\d+)\s*"
+        r"<em>\s*\(you have (?P<current>\d+)\)\s*</em>$"
+    ),
+    re.compile(
+        r"^You unlocked this with "
+        r"<span class='quality-name'>(?P<quality>.+)</span> (?P<current>\d+)\s*"
+        r"<em>\s*\(you needed (?P<quantity_max>\d+) at most\)\s*</em>$"
+    ),
+    re.compile(
+        r"^You unlocked this by not having "
+        r"<span class='quality-name'>(?P<quality>.+)</span>\s*"
+        r"<em>\s*\(you needed (?P<quantity_max>\d+) at most\)\s*</em>$"
+    )
+)
+TOOLTIPS_EXACTLY = (
+    re.compile(
+        r"^You unlocked this with (?:an? )?"
+        r"<span class='quality-name'>(?P<quality>.+)</span> (?P<current>\d+)\s*"
+        r"<em>\s*\(you needed exactly (?P<quantity>\d+)\)\s*</em>$"
+    ),
+    re.compile(
+        r"^You need exactly "
+        r"<span class='quality-name'>(?P<quality>.+)</span> (?P<quantity>\d+)\s*"
+        r"(?:<em>\s*\(you have (?P<current>\d+)\)\s*</em>)?$"
+    ),
+    re.compile(
+        r"^You need <span class='quality-name'>(?P<quality>.+)</span>\s*"
+        r"exactly (?P<quantity>\d+)$"
+    ),
+    re.compile(
+        r"^You unlocked this with any "
+        r"<span class='quality-name'>(?P<quality>.+)</span>\s*"
+        r"<em>\s*\(you needed exactly (?P<quantity>\d+)\)\s*</em>$"
+    ),
+)
+TOOLTIPS_RANGE = (
+    re.compile(
+        r"^You unlocked this with "
+        r"<span class='quality-name'>(?P<quality>.+)</span> (?P<current>\d+)\s*"
+        r"<em>\s*\(you needed (?P<quantity_min>\d+)-(?P<quantity_max>\d+)\)\s*</em>$"
+    ),
+    re.compile(
+        r"^You need <span class='quality-name'>(?P<quality>.+)</span> "
+        r"(?P<quantity_min>\d+)-(?P<quantity_max>\d+)\s*"
+        r"(?:<em>\s*\(you have (?P<current>\d+)\)\s*</em>)?$"
+    )
+)
+TOOLTIPS_WORDY = (
+    re.compile(
+        r"^Unlocked when <span class='quality-name'>(?P<quality>.+)</span> is:"
+        r"<ul class='wordy-list'>(?P<requirements>.+)</ul>$"
+    ),
+)
+TOOLTIPS_WORDY_ITEM = re.compile(
+    r"<li(?: class='current')?>(?:<em>)?(.*?)(?:</em>)?</li>"
+)
+
+
+class TooltipKind(Enum):
+    NONE = "None"
+    AT_LEAST_ONE = "AtLeastOne"
+    MINIMUM = "Minimum"
+    MAXIMUM = "Maximum"
+    EXACTLY = "Exactly"
+    RANGE = "Range"
+    WORDY = "Wordy"
+
+
+# The patterns of each kind of tooltip, in the order in which they are tried
+TOOLTIP_PATTERNS: Tuple[Tuple[TooltipKind, Tuple[Pattern, ...]], ...] = (
+    (TooltipKind.NONE, TOOLTIPS_NONE),
+    (TooltipKind.AT_LEAST_ONE, TOOLTIPS_AT_LEAST_ONE),
+    (TooltipKind.MINIMUM, TOOLTIPS_MINIMUM),
+    (TooltipKind.MAXIMUM, TOOLTIPS_MAXIMUM),
+    (TooltipKind.EXACTLY, TOOLTIPS_EXACTLY),
+    (TooltipKind.RANGE, TOOLTIPS_RANGE),
+    (TooltipKind.WORDY, TOOLTIPS_WORDY),
+)
+
+
+@dataclass(frozen=True)
+class TooltipRequirement:
+    quantity_min: Optional[int] = None
+    quantity_max: Optional[int] = None
+    required_values: Optional[Tuple[str, ...]] = None
+
+
+@dataclass(frozen=True)
+class _Alternative:
+    kind: TooltipKind
+    group_prefix: str
+
+
+def combine_patterns(
+        patterns: Iterable[Tuple[TooltipKind, Iterable[Pattern]]]
+) -> Tuple[Pattern, Dict[str, _Alternative]]:
+    """
+    Combines anchored patterns into a single pattern which dispatches on the
+    first one to match.
+
+    Each pattern becomes a named alternative, and its own named groups are
+    prefixed with the alternative's name since group names must be unique.
+    Alternatives are tried in order, so the combined pattern matches exactly
+    as trying each pattern in turn would.
+    """
+    alternatives = {}
+    sources = []
+    for kind, kind_patterns in patterns:
+        for pattern in kind_patterns:
+            name = f"a{len(alternatives)}"
+            source = pattern.pattern
+            if not source.startswith("^") or not source.endswith("$"):
+                raise ValueError(f"Pattern is not anchored: {source}")
+            source = re.sub(r"\(\?P<(\w+)>", rf"(?P<{name}_\1>", source[1:-1])
+            sources.append(f"(?P<{name}>{source})")
+            alternatives[name] = _Alternative(kind, f"{name}_")
+    return re.compile("^(?:" + "|".join(sources) + ")$"), alternatives
+
+
+TOOLTIPS_COMBINED, TOOLTIPS_ALTERNATIVES = combine_patterns(TOOLTIP_PATTERNS)
+
+
+@lru_cache(maxsize=TOOLTIP_CACHE_SIZE)
+def parse_tooltip(tooltip: str) -> Optional[TooltipRequirement]:
+    """
+    Gets the requirement described by a quality requirement's tooltip, or None
+    if the tooltip is not recognized.
+    """
+    match = TOOLTIPS_COMBINED.match(tooltip)
+    if not match:
+        return None
+    alternative = TOOLTIPS_ALTERNATIVES[match.lastgroup]
+    kind = alternative.kind
+
+    def group(name: str) -> str:
+        return match.group(alternative.group_prefix + name)
+
+    if kind == TooltipKind.NONE:
+        return TooltipRequirement(quantity_max=0)
+    elif kind == TooltipKind.AT_LEAST_ONE:
+        return TooltipRequirement(quantity_min=1)
+    elif kind == TooltipKind.MINIMUM:
+        return TooltipRequirement(quantity_min=int(group("quantity_min")))
+    elif kind == TooltipKind.MAXIMUM:
+        return TooltipRequirement(quantity_max=int(group("quantity_max")))
+    elif kind == TooltipKind.EXACTLY:
+        quantity = int(group("quantity"))
+        return TooltipRequirement(quantity_min=quantity, quantity_max=quantity)
+    elif kind == TooltipKind.RANGE:
+        return TooltipRequirement(
+            quantity_min=int(group("quantity_min")),
+            quantity_max=int(group("quantity_max")),
+        )
+    else:
+        return TooltipRequirement(required_values=tuple(
+            req.replace(r'\"', '"')
+            for req in TOOLTIPS_WORDY_ITEM.findall(group("requirements"))
+        ))
+
+
+def get_tooltip_cache_stats() -> Dict[str, float]:
+    info = parse_tooltip.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "max_size": info.maxsize,
+        "hit_rate": info.hits / lookups if lookups else 0.0,
+    }
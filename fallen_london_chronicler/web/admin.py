@@ -5,7 +5,8 @@ from sqlalchemy.orm import Session
 from starlette.requests import Request
 from starlette.responses import HTMLResponse
 
-from fallen_london_chronicler.auth import authorize
+from fallen_london_chronicler.auth import authorize, \
+    invalidate_authorizations
 from fallen_london_chronicler.db import get_session
 from fallen_london_chronicler.model import User
 from fallen_london_chronicler.web.templates import templated
@@ -40,6 +41,9 @@ async def area_view(request: Request, api_key: str):
                     session, name=form["name"].strip(), is_admin=is_admin
                 )
             user.is_active = bool(form.get("is_active"))
+            # Commit first so that the change is visible to the next lookup
+            session.commit()
+            invalidate_authorizations()
 
         return render_admin(session)
 
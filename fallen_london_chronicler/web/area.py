@@ -1,30 +1,83 @@
 import logging
-from collections import defaultdict
-from copy import copy
-from typing import List, Any, Dict
+from typing import List, Any, Dict, Optional, Tuple
 
 from fastapi import APIRouter
-from sqlalchemy.orm import selectinload
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session, object_session
 from starlette.requests import Request
-from starlette.responses import HTMLResponse
+from starlette.responses import HTMLResponse, Response
 
 from fallen_london_chronicler.db import get_session
-from fallen_london_chronicler.model import Area, Storylet
-from fallen_london_chronicler.web.templates import templated
+from fallen_london_chronicler.loaders import AREA_PAGE, get_loader_options
+from fallen_london_chronicler.model import Area, Quality, Setting, \
+    Storylet, StoryletQualityRequirement
+from fallen_london_chronicler.model.generation import generation_column
+from fallen_london_chronicler.model.secondaries import areas_settings, \
+    areas_storylets
+from fallen_london_chronicler.ordering import storylet_order_cache
+from fallen_london_chronicler.web.templates import render_page
 
 router = APIRouter()
 
 
-# noinspection PyUnusedLocal
 @router.get("/{area_id}", response_class=HTMLResponse)
-@templated("area.html")
-async def area_view(request: Request, area_id: int):
+async def area_view(request: Request, area_id: int) -> Response:
     with get_session() as session:
-        area = (
-            session.query(Area).options(selectinload(Area.storylets))
-            .get(area_id)
+        return render_page(
+            request,
+            "area.html",
+            ("area", area_id),
+            get_area_page_version(session, area_id),
+            lambda: render_area(
+                session.query(Area)
+                .options(*get_loader_options(AREA_PAGE))
+                .get(area_id)
+            ),
         )
-        return render_area(area)
+
+
+def get_area_page_version(
+        session: Session, area_id: int
+) -> Optional[Tuple[int, ...]]:
+    """
+    Gets the versions of everything shown on an area's page, along with the
+    generation of the data.
+
+    Each storylet and setting adds its version plus one, so that adding one
+    to the area also changes the total. The names of the qualities the
+    storylets require are shown too.
+    """
+    storylets_version = (
+        select([func.sum(Storylet.version + 1)])
+        .where(Storylet.id == areas_storylets.c.storylet_id)
+        .where(areas_storylets.c.area_id == area_id)
+        .as_scalar()
+    )
+    settings_version = (
+        select([func.sum(Setting.version + 1)])
+        .where(Setting.id == areas_settings.c.setting_id)
+        .where(areas_settings.c.area_id == area_id)
+        .as_scalar()
+    )
+    qualities_version = (
+        select([func.sum(Quality.version + 1)])
+        .where(Storylet.id == areas_storylets.c.storylet_id)
+        .where(areas_storylets.c.area_id == area_id)
+        .where(
+            StoryletQualityRequirement.storylet_observation_id
+            == Storylet.latest_observation_id
+        )
+        .where(Quality.id == StoryletQualityRequirement.quality_id)
+        .as_scalar()
+    )
+    return session.query(
+        generation_column(),
+        Area.version,
+        Area.order_version,
+        storylets_version,
+        settings_version,
+        qualities_version,
+    ).filter(Area.id == area_id).first()
 
 
 def render_area(area: Area) -> Dict[str, Any]:
@@ -38,7 +91,7 @@ def render_area(area: Area) -> Dict[str, Any]:
             )
 
         # Add the top-level storylets
-        for storylet in build_storylet_order(area.storylets):
+        for storylet in build_storylet_order(area):
             found_valid_setting = False
             for setting in storylet.settings:
                 if setting.id in settings:
@@ -70,24 +123,14 @@ def render_area(area: Area) -> Dict[str, Any]:
     }
 
 
-def build_storylet_order(storylets: List[Storylet]) -> List[Storylet]:
-    must_be_before = defaultdict(list)
-    for storylet in storylets:
-        for before_storylet in storylet.before:
-            if before_storylet in storylets:
-                must_be_before[before_storylet].append(storylet)
-    ordered_storylets = copy(storylets)
-
-    while True:
-        ordered_storylets_before = copy(ordered_storylets)
-        for storylet in storylets:
-            idx = ordered_storylets.index(storylet)
-            max_idx = idx
-            for after_storylet in must_be_before[storylet]:
-                max_idx = min(max_idx, ordered_storylets.index(after_storylet))
-            if max_idx < idx:
-                ordered_storylets.insert(max_idx, ordered_storylets.pop(idx))
-        if ordered_storylets == ordered_storylets_before:
-            break
-
-    return [storylet for storylet in ordered_storylets if storylet.is_top_level]
+def build_storylet_order(area: Area) -> List[Storylet]:
+    """
+    Gets the area's top-level storylets, in the order in which they were
+    seen in the game.
+    """
+    storylets = {storylet.id: storylet for storylet in area.storylets}
+    order = storylet_order_cache.get_order(object_session(area), area)
+    return [
+        storylets[storylet_id] for storylet_id in order
+        if storylets[storylet_id].is_top_level
+    ]
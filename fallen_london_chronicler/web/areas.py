@@ -1,11 +1,11 @@
 from typing import List, Any, Dict
 
 from fastapi import APIRouter
-from sqlalchemy.orm import selectinload
 from starlette.requests import Request
 from starlette.responses import HTMLResponse
 
 from fallen_london_chronicler.db import get_session
+from fallen_london_chronicler.loaders import AREAS_PAGE, get_loader_options
 from fallen_london_chronicler.model import Area
 from fallen_london_chronicler.web.templates import templated
 
@@ -17,7 +17,9 @@ router = APIRouter()
 @templated("areas.html")
 async def areas_view(request: Request):
     with get_session() as session:
-        areas = session.query(Area).options(selectinload(Area.storylets)).all()
+        areas = session.query(Area) \
+            .options(*get_loader_options(AREAS_PAGE)) \
+            .all()
         return {
             "areas": areas
         }
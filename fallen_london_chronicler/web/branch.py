@@ -1,32 +1,70 @@
-from typing import Any, Dict
+from typing import Any, Dict, Tuple
 
 from fastapi import APIRouter
-from sqlalchemy.orm import selectinload
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
 from starlette.requests import Request
-from starlette.responses import HTMLResponse
+from starlette.responses import HTMLResponse, Response
 
 from fallen_london_chronicler.db import get_session
-from fallen_london_chronicler.model import Area, Branch, OutcomeObservation
-from fallen_london_chronicler.web.templates import templated
+from fallen_london_chronicler.loaders import BRANCH_PAGE, get_loader_options
+from fallen_london_chronicler.model import Area, Branch, \
+    OutcomeObservation, Storylet
+from fallen_london_chronicler.model.generation import generation_column
+from fallen_london_chronicler.web.templates import render_page
 
 router = APIRouter()
 
 
-# noinspection PyUnusedLocal
 @router.get("/{area_id}/{branch_id}", response_class=HTMLResponse)
-@templated("branch.html")
-async def branch_view(request: Request, area_id: int, branch_id: int):
+async def branch_view(
+        request: Request, area_id: int, branch_id: int
+) -> Response:
     with get_session() as session:
-        area = session.query(Area).get(area_id)
-        branch = (
-            session.query(Branch).options(
-                selectinload(Branch.storylet),
-                selectinload(Branch.outcome_observations)
-                .selectinload(OutcomeObservation.redirect_branch)
-            )
-            .get(branch_id)
+        return render_page(
+            request,
+            "branch.html",
+            ("branch", area_id, branch_id),
+            get_branch_page_version(session, area_id, branch_id),
+            lambda: render_branch(
+                session.query(Area).get(area_id),
+                session.query(Branch)
+                .options(*get_loader_options(BRANCH_PAGE))
+                .get(branch_id),
+            ),
         )
-        return render_branch(area, branch)
+
+
+def get_branch_page_version(
+        session: Session, area_id: int, branch_id: int
+) -> Tuple[int, ...]:
+    """
+    Gets the versions of everything shown on a branch's page, which includes
+    the name of its storylet and the storylets, branches and areas its
+    outcomes redirect to, along with the generation of the data.
+    """
+    storylet_id = select([Branch.storylet_id]) \
+        .where(Branch.id == branch_id) \
+        .as_scalar()
+    return session.query(
+        generation_column(),
+        select([Area.version]).where(Area.id == area_id).as_scalar(),
+        select([Branch.version]).where(Branch.id == branch_id).as_scalar(),
+        select([Storylet.version])
+        .where(Storylet.id == storylet_id)
+        .as_scalar(),
+        *(
+            select([func.sum(entity.version + 1)])
+            .where(OutcomeObservation.branch_id == branch_id)
+            .where(entity.id == redirect_id)
+            .as_scalar()
+            for entity, redirect_id in (
+                (Storylet, OutcomeObservation.redirect_id),
+                (Branch, OutcomeObservation.redirect_branch_id),
+                (Area, OutcomeObservation.redirect_area_id),
+            )
+        ),
+    ).one()
 
 
 def render_branch(area: Area, branch: Branch) -> Dict[str, Any]:
@@ -0,0 +1,122 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from fallen_london_chronicler.config import config
+from fallen_london_chronicler.invalidation import Invalidation, subscribe
+
+
+@dataclass(frozen=True)
+class CachedPage:
+    body: bytes
+    etag: str
+
+
+class PageCache:
+    """
+    Keeps the rendered HTML of pages, along with the versions of the entities
+    they show.
+
+    Each worker has its own cache, but the versions are read from the database
+    on every request, so a page is never served once any worker has recorded a
+    change to it.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[
+            Hashable, Tuple[Any, CachedPage]
+        ] = OrderedDict()
+
+    def get(self, key: Hashable, version: Any) -> Optional[CachedPage]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, version: Any, html: str) -> CachedPage:
+        body = html.encode("utf-8")
+        # The same versions always render to the same bytes, so the ETag is
+        # also the same in every worker
+        page = CachedPage(
+            body=body, etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        )
+        if self.max_size <= 0:
+            return page
+        with self._lock:
+            self._entries[key] = (version, page)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return page
+
+    def invalidate(self, invalidation: Invalidation) -> None:
+        """
+        Drops the pages changed by a transaction committed by this worker,
+        which would otherwise only be replaced once requested again.
+        """
+        with self._lock:
+            for page in invalidation.pages:
+                if self._entries.pop(page, None) is not None:
+                    self.invalidated += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidated": self.invalidated,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def page_response(request: Request, page: CachedPage) -> Response:
+    """
+    Responds with the page, or with 304 Not Modified if the client already
+    has it.
+    """
+    # Clients must check that the page has not changed before reusing it
+    headers = {"ETag": page.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), page.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(page.body, media_type="text/html", headers=headers)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag or candidate == "*":
+            return True
+    return False
+
+
+def get_page_cache_stats() -> Dict[str, float]:
+    return page_cache.stats()
+
+
+page_cache = PageCache(config.page_cache_size)
+subscribe(page_cache.invalidate)
@@ -1,15 +1,26 @@
 import os.path
 import urllib.parse
+from typing import Any, BinaryIO, Callable, Dict, Optional, TYPE_CHECKING
 
 from fastapi import APIRouter
 from starlette.requests import Request
-from starlette.responses import HTMLResponse, Response
+from starlette.responses import FileResponse, HTMLResponse, JSONResponse, \
+    RedirectResponse, Response, StreamingResponse
 
 from fallen_london_chronicler.config import config
 from fallen_london_chronicler.db import engine, get_session
+from fallen_london_chronicler.export.background import \
+    EXPORT_FORMAT_GOOGLE_DOCS, EXPORT_FORMAT_HTML, EXPORT_SUCCEEDED, \
+    Export, ExportAlreadyRunning, background_exports
+from fallen_london_chronicler.export.base import ExportProgress
 from fallen_london_chronicler.model import Base
+from fallen_london_chronicler.model.generation import start_generation
+from fallen_london_chronicler.web.cache import page_cache
 from fallen_london_chronicler.web.templates import templated
 
+if TYPE_CHECKING:
+    from fallen_london_chronicler.export.html import HTMLExporter
+
 router = APIRouter()
 
 USERSCRIPT_PATH = os.path.join(
@@ -52,51 +63,233 @@ async def reset():
         return {
             "success": False
         }
-    for tbl in reversed(Base.metadata.sorted_tables):
-        engine.execute(tbl.delete())
+    with engine.begin() as connection:
+        for tbl in reversed(Base.metadata.sorted_tables):
+            connection.execute(tbl.delete())
+        # Versions start over with the new data, so pages cached by any
+        # worker before the reset are told apart by the new generation
+        start_generation(connection)
+    page_cache.clear()
     return {
         "success": True
     }
 
 
+def make_html_exporter(
+        progress: Optional[ExportProgress] = None
+) -> "HTMLExporter":
+    from fallen_london_chronicler.export.html import HTMLExporter
+
+    return HTMLExporter(
+        export_dir=config.html_export_path,
+        root_url=config.html_export_url,
+        incremental=config.html_export_incremental,
+        workers=config.html_export_workers or os.cpu_count() or 1,
+        precompress=config.html_export_precompress,
+        progress=progress,
+    )
+
+
+def get_html_export_name() -> str:
+    name = os.path.basename(os.path.normpath(config.html_export_path))
+    return name or "export"
+
+
+def run_html_export(
+        archive_format: str, job_id: str, progress: ExportProgress
+) -> str:
+    exporter = make_html_exporter(progress)
+    if archive_format == "directory":
+        with get_session() as session:
+            return exporter.export_all(session)
+    # Each export keeps its own archive, so that a retained export can still
+    # be downloaded after the next one
+    path = os.path.join(
+        background_exports.get_result_dir(job_id),
+        f"{get_html_export_name()}.{archive_format}",
+    )
+    with get_session() as session, open(path, "wb") as f:
+        exporter.export_archive(session, f, archive_format)
+    return path
+
+
+def run_google_docs_export(job_id: str, progress: ExportProgress) -> str:
+    from fallen_london_chronicler.export.google_docs import GoogleDocsExporter
+
+    exporter = GoogleDocsExporter(
+        google_credentials_path=config.google_credentials_path,
+        google_credentials_cache_path=config.google_credentials_cache_path,
+        template_document_id=config.google_docs_template_id,
+        progress=progress,
+    )
+    with get_session() as session:
+        return exporter.export_all(session)
+
+
+def start_export(export_format: str, export: Export) -> Dict[str, Any]:
+    try:
+        job = background_exports.start(export_format, export)
+    except ExportAlreadyRunning as e:
+        return already_running(e)
+    return {
+        "success": True,
+        "job": job.to_dict(),
+    }
+
+
+def already_running(e: ExportAlreadyRunning) -> Dict[str, Any]:
+    return {
+        "success": False,
+        "error": str(e),
+        "job": e.job.to_dict() if e.job else None,
+    }
+
+
+def stream_html_archive(
+        write: Callable[[BinaryIO, ExportProgress], None], archive_format: str
+) -> Response:
+    """
+    Streams an HTML archive as it is written. Writing it counts as an HTML
+    export, so that it cannot run at the same time as another one.
+    """
+    from fallen_london_chronicler.export.archive import ARCHIVE_FORMATS, \
+        stream_archive
+
+    try:
+        job = background_exports.claim(EXPORT_FORMAT_HTML)
+    except ExportAlreadyRunning as e:
+        return JSONResponse(already_running(e))
+
+    def export(stream: BinaryIO) -> None:
+        background_exports.run(
+            job.id, lambda job_id, progress: write(stream, progress)
+        )
+
+    return StreamingResponse(
+        stream_archive(export),
+        media_type=ARCHIVE_FORMATS[archive_format],
+        headers={
+            "Content-Disposition": f'attachment; '
+                                   f'filename="{get_html_export_name()}.'
+                                   f'{archive_format}"'
+        },
+    )
+
+
 @router.post("/export_html")
 async def export_html():
-    from fallen_london_chronicler.export.html import HTMLExporter
+    from fallen_london_chronicler.export.archive import ARCHIVE_FORMATS
 
     if not config.html_export_enable:
         return {
             "success": False
         }
 
-    with get_session() as session:
-        exporter = HTMLExporter(
-            export_dir=config.html_export_path,
-            root_url=config.html_export_url
-        )
-        path = exporter.export_all(session)
-    return {
-        "success": True,
-        "path": path
-    }
+    archive_format = config.html_export_format
+    if archive_format != "directory" \
+            and archive_format not in ARCHIVE_FORMATS:
+        return {
+            "success": False,
+            "error": f"Unknown export format: {archive_format}"
+        }
+    return start_export(
+        EXPORT_FORMAT_HTML,
+        lambda job_id, progress: run_html_export(
+            archive_format, job_id, progress
+        ),
+    )
+
+
+@router.get("/export_html/archive")
+async def export_html_archive(format: str = "zip"):
+    from fallen_london_chronicler.export.archive import ARCHIVE_FORMATS
+
+    if not config.html_export_enable:
+        return {
+            "success": False
+        }
+    if format not in ARCHIVE_FORMATS:
+        return {
+            "success": False,
+            "error": f"Unknown archive format: {format}"
+        }
+
+    def write(stream: BinaryIO, progress: ExportProgress) -> None:
+        exporter = make_html_exporter(progress)
+        with get_session() as session:
+            exporter.export_archive(session, stream, format)
+
+    return stream_html_archive(write, format)
 
 
 @router.post("/export_google_docs")
 async def export_google_docs():
-    from fallen_london_chronicler.export.google_docs import GoogleDocsExporter
-
     if not config.google_docs_export_enable:
         return {
             "success": False
         }
+    return start_export(EXPORT_FORMAT_GOOGLE_DOCS, run_google_docs_export)
 
-    with get_session() as session:
-        exporter = GoogleDocsExporter(
-            google_credentials_path=config.google_credentials_path,
-            google_credentials_cache_path=config.google_credentials_cache_path,
-            template_document_id=config.google_docs_template_id,
-        )
-        url = exporter.export_all(session)
+
+@router.get("/exports/")
+async def exports():
     return {
         "success": True,
-        "url": url,
+        "jobs": [job.to_dict() for job in background_exports.get_all()],
     }
+
+
+@router.get("/exports/{job_id}")
+async def export_job(job_id: str):
+    job = background_exports.get(job_id)
+    if not job:
+        return {
+            "success": False,
+            "error": f"Unknown export: {job_id}"
+        }
+    return {
+        "success": True,
+        "job": job.to_dict(),
+    }
+
+
+@router.get("/exports/{job_id}/download")
+async def download_export(job_id: str, format: str = "zip"):
+    from fallen_london_chronicler.export.archive import ARCHIVE_FORMATS, \
+        write_directory
+
+    job = background_exports.get(job_id)
+    if not job or job.status != EXPORT_SUCCEEDED or not job.result:
+        return {
+            "success": False,
+            "error": f"No finished export: {job_id}"
+        }
+    if job.format == EXPORT_FORMAT_GOOGLE_DOCS:
+        return RedirectResponse(job.result)
+    if os.path.isfile(job.result):
+        return FileResponse(
+            job.result, filename=os.path.basename(job.result)
+        )
+    if not os.path.isdir(job.result):
+        return {
+            "success": False,
+            "error": f"The export no longer exists: {job.result}"
+        }
+    if format not in ARCHIVE_FORMATS:
+        return {
+            "success": False,
+            "error": f"Unknown archive format: {format}"
+        }
+    # Exports to a directory all write to the same one, which only holds the
+    # latest export
+    if background_exports.is_superseded(job):
+        return {
+            "success": False,
+            "error": f"The export was superseded by a later one: {job_id}"
+        }
+    # Exports to a directory are downloaded as an archive of it, which must
+    # not be written to meanwhile
+    return stream_html_archive(
+        lambda stream, progress: write_directory(stream, format, job.result),
+        format,
+    )
@@ -1,32 +1,67 @@
-from typing import Any, Dict
+from typing import Any, Dict, Tuple
 
 from fastapi import APIRouter
-from sqlalchemy.orm import selectinload
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
 from starlette.requests import Request
-from starlette.responses import HTMLResponse
+from starlette.responses import HTMLResponse, Response
 
 from fallen_london_chronicler.db import get_session
-from fallen_london_chronicler.model import Storylet, Branch, Area
-from fallen_london_chronicler.web.templates import templated
+from fallen_london_chronicler.loaders import STORYLET_PAGE, \
+    get_loader_options
+from fallen_london_chronicler.model import Branch, BranchQualityRequirement, \
+    Quality, Storylet, Area
+from fallen_london_chronicler.model.generation import generation_column
+from fallen_london_chronicler.web.templates import render_page
 
 router = APIRouter()
 
 
-# noinspection PyUnusedLocal
 @router.get("/{area_id}/{storylet_id}", response_class=HTMLResponse)
-@templated("storylet.html")
-async def storylet_view(request: Request, area_id: int, storylet_id: int):
+async def storylet_view(
+        request: Request, area_id: int, storylet_id: int
+) -> Response:
     with get_session() as session:
-        area = session.query(Area).get(area_id)
-        storylet = session.query(Storylet)\
-            .options(
-            selectinload(Storylet.areas),
-            selectinload(Storylet.branches).selectinload(Branch.observations)
-        ).get(storylet_id)
-        return {
-            "area": area,
-            "storylet": storylet
-        }
+        return render_page(
+            request,
+            "storylet.html",
+            ("storylet", area_id, storylet_id),
+            get_storylet_page_version(session, area_id, storylet_id),
+            lambda: render_storylet(
+                session.query(Area).get(area_id),
+                session.query(Storylet)
+                .options(*get_loader_options(STORYLET_PAGE))
+                .get(storylet_id),
+            ),
+        )
+
+
+def get_storylet_page_version(
+        session: Session, area_id: int, storylet_id: int
+) -> Tuple[int, ...]:
+    """
+    Gets the versions of everything shown on a storylet's page, which
+    includes the names of the qualities its branches require, along with the
+    generation of the data.
+    """
+    return session.query(
+        generation_column(),
+        select([Area.version]).where(Area.id == area_id).as_scalar(),
+        select([Storylet.version])
+        .where(Storylet.id == storylet_id)
+        .as_scalar(),
+        select([func.sum(Branch.version + 1)])
+        .where(Branch.storylet_id == storylet_id)
+        .as_scalar(),
+        select([func.sum(Quality.version + 1)])
+        .where(Branch.storylet_id == storylet_id)
+        .where(
+            BranchQualityRequirement.branch_observation_id
+            == Branch.latest_observation_id
+        )
+        .where(Quality.id == BranchQualityRequirement.quality_id)
+        .as_scalar(),
+    ).one()
 
 
 def render_storylet(area: Area, storylet: Storylet) -> Dict[str, Any]:
@@ -1,13 +1,15 @@
 import os.path
 from contextvars import Context
 from functools import wraps
-from typing import Any, Callable
+from typing import Any, Callable, Dict, Hashable
 
 from jinja2 import contextfilter
 from starlette.requests import Request
+from starlette.responses import Response
 from starlette.templating import Jinja2Templates
 
 from fallen_london_chronicler.config import config
+from fallen_london_chronicler.web.cache import page_cache, page_response
 
 TEMPLATES_DIR = os.path.join("resources", "templates")
 
@@ -30,6 +32,26 @@ def templated(template_file: str):
     return templated_with_template
 
 
+def render_page(
+        request: Request,
+        template_file: str,
+        key: Hashable,
+        version: Any,
+        get_context: Callable[[], Dict[str, Any]],
+) -> Response:
+    """
+    Renders a page, or reuses the cached page if the versions of the entities
+    it shows have not changed since.
+    """
+    page = page_cache.get(key, version)
+    if page is None:
+        html = templates.get_template(template_file).render(
+            {"request": request, **get_context()}
+        )
+        page = page_cache.put(key, version, html)
+    return page_response(request, page)
+
+
 @contextfilter
 def format_url_filter(ctx: Context, value: str) -> str:
     return (